@@ -0,0 +1,116 @@
+"""
+Import-time benchmark for the CLI scripts.
+
+For each entry point it runs a fresh interpreter with `python -X importtime`
+and reports:
+  - cumulative import time of the module itself (from -X importtime)
+  - wall time of the whole interpreter start + import (minus a bare `python -c pass`)
+  - which heavy dependencies (torch, transformers, llmlingua, pandas, groq)
+    ended up imported
+
+Modules listed in BUDGETS must import within their budget and without heavy
+dependencies; the script exits with 1 otherwise, so it can run in CI.
+
+Usage:
+    python bench_import_time.py
+"""
+import os
+import re
+import statistics
+import subprocess
+import sys
+import time
+
+# ==========================================
+# CONFIGURATION
+# ==========================================
+HEAVY_MODULES = ['torch', 'transformers', 'llmlingua', 'pandas', 'groq', 'datasets', 'spacy']
+
+# Entry point -> budget (ms) per l'import. Le esecuzioni rule-only devono partire
+# ben sotto i 100 ms.
+BUDGETS = {
+    'rule_based': 100,
+    'rule_based_numeric': 100,
+    'linguistic_compress': 100,
+    'cut_prompt_merge_llmlingua2': 100,
+    'cut_prompt_llmlingua2': 100,
+    'evaluation_llama': 100,
+    'eval_metrics': 100,
+    'profiling': 100,
+    'compressor_models': 100,
+    'compressor_server': 100,
+    'compressor_registry': 100,
+    'compress_dataset': 100,
+    'compact_dataset': 100,
+    'keep_mask': 100,
+    'dataset_gsm8k': 100,
+    'demo_retrieval': 100,
+    'coarse_filter': 100,
+    'perplexity_compress': 100,
+    'profile_cache': 100,
+    'shard_compress': 100,
+    'token_budget': 100,
+}
+REPEAT = 5
+
+_IMPORTTIME_RE = re.compile(r"import time:\s+(\d+)\s+\|\s+(\d+)\s+\|\s+(\s*)(\S+)")
+
+
+def _run(code, importtime=False):
+    cmd = [sys.executable]
+    if importtime:
+        cmd += ["-X", "importtime"]
+    cmd += ["-c", code]
+    start = time.perf_counter()
+    proc = subprocess.run(cmd, capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+    return time.perf_counter() - start, proc
+
+
+def measure(module):
+    """Returns (cumulative_import_ms, wall_ms, heavy_loaded, error)."""
+    probe = (
+        f"import sys, {module}; "
+        f"print(','.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))"
+    )
+    cumulative, walls, heavy = [], [], []
+    for _ in range(REPEAT):
+        wall, proc = _run(probe, importtime=True)
+        if proc.returncode != 0:
+            return None, None, [], proc.stderr.strip().splitlines()[-1:]
+        walls.append(wall)
+        heavy = [m for m in proc.stdout.strip().split(',') if m]
+        for line in proc.stderr.splitlines():
+            match = _IMPORTTIME_RE.match(line)
+            if match and match.group(4) == module and not match.group(3):
+                cumulative.append(int(match.group(2)) / 1000)
+    return statistics.median(cumulative), statistics.median(walls) * 1000, heavy, None
+
+
+def main():
+    bare = statistics.median(_run("pass")[0] for _ in range(REPEAT)) * 1000
+    print(f"Interpreter startup (python -c pass): {bare:.1f} ms\n")
+    print(f"{'Module':<32} {'import ms':>10} {'wall-startup ms':>16} {'budget':>7}  heavy deps")
+    failures = []
+    for module, budget in BUDGETS.items():
+        cumulative, wall, heavy, error = measure(module)
+        if error:
+            print(f"{module:<32} {'ERROR':>10}  {error}")
+            failures.append(f"{module}: import failed")
+            continue
+        ok = cumulative <= budget and not heavy
+        print(f"{module:<32} {cumulative:>10.1f} {wall - bare:>16.1f} {budget:>7}  {', '.join(heavy) or '-'}"
+              f"{'' if ok else '   <-- FAIL'}")
+        if not ok:
+            failures.append(f"{module}: {cumulative:.1f} ms (budget {budget} ms), heavy: {heavy or 'none'}")
+
+    if failures:
+        print("\nImport-time budget exceeded:")
+        for line in failures:
+            print(f"  - {line}")
+        return 1
+    print("\nAll entry points within budget.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,352 @@
+"""
+Benchmark suite for the prompt compressors (rule-based, LLMLingua-2, LLMLingua-1).
+
+Runs every compressor on synthetic text and on GSM8K-shaped few-shot prompts of
+controlled length and records, per (compressor, case):
+  - prompts/sec and ms per 1k tokens
+  - peak RSS of the worker process (model included)
+  - achieved compression ratio (compressed tokens / original tokens)
+
+"tokens" are whitespace tokens, so numbers are comparable across compressors
+and do not depend on any tokenizer download.
+
+Each compressor runs in its own spawned process, so peak RSS is attributable.
+Everything runs offline: --make-tiny-models trains small tokenizers on the
+benchmark corpus and saves randomly initialised tiny BERT / GPT-2 models under
+benchmarks/models/ (timings then reflect the tiny models, which is what we
+want for regression tracking). LLMLingua also needs the tiktoken encoding
+cached locally (run it once online or set TIKTOKEN_CACHE_DIR).
+
+Usage:
+    python benchmark_compressors.py --make-tiny-models
+    python benchmark_compressors.py --save-baseline      # record baseline
+    python benchmark_compressors.py                      # compare, exit 1 on regression
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import resource
+import sys
+import time
+
+# ==========================================
+# CONFIGURATION
+# ==========================================
+BENCH_DIR = "benchmarks"
+BASELINE_FILE = os.path.join(BENCH_DIR, "baseline.json")
+TINY_MODEL_DIR = os.path.join(BENCH_DIR, "models")
+TINY_BERT = os.path.join(TINY_MODEL_DIR, "tiny-bert-tokclf")
+TINY_GPT2 = os.path.join(TINY_MODEL_DIR, "tiny-gpt2")
+
+COMPRESSORS = ['rule_based', 'rule_numeric', 'llmlingua2', 'llmlingua1', 'llmlingua1_kv']
+TARGET_RATE = 0.5
+FORCE_TOKENS = ['?', '.', '=', '+', '-', '*', '/', '0', '1', '2', '3', '4', '5', '6', '7', '8', '9']
+
+# Lunghezze controllate: parole per i sintetici, shot per i GSM8K-shaped
+SYNTHETIC_WORDS = [128, 512, 2048]
+GSM8K_SHOTS = [1, 4, 8]
+PROMPTS_PER_CASE = 20
+SEED = 42
+
+# Regression thresholds
+THROUGHPUT_TOLERANCE = 0.25   # fail if prompts/sec drops more than 25%
+RSS_TOLERANCE = 0.25          # fail if peak RSS grows more than 25%
+RATIO_TOLERANCE = 0.02        # fail if compression ratio moves more than 0.02
+
+# ==========================================
+# INPUT GENERATION
+# ==========================================
+_FILLER = (
+    "the a an and but or so of in on at to from with by for very really just only also then "
+    "more most every per each she he they it her his their after before"
+).split()
+_CONTENT = (
+    "apples baskets store sold bought price dollars cookies students hours minutes week "
+    "garden trees books pages train miles friends money saved spent total remaining boxes"
+).split()
+_NAMES = ["Natalia", "Weng", "Betty", "Julie", "James", "Albert", "Ken", "Alexis", "Tina", "Randy"]
+_ITEMS = ["clips", "apples", "cookies", "books", "pencils", "marbles", "stickers", "cupcakes"]
+
+
+def synthetic_prompt(rng, n_words):
+    words = []
+    for _ in range(n_words):
+        roll = rng.random()
+        if roll < 0.45:
+            words.append(rng.choice(_FILLER))
+        elif roll < 0.85:
+            words.append(rng.choice(_CONTENT))
+        else:
+            words.append(str(rng.randint(1, 500)))
+    return " ".join(words) + "."
+
+
+def gsm8k_problem(rng):
+    name, item = rng.choice(_NAMES), rng.choice(_ITEMS)
+    a, b, price = rng.randint(2, 60), rng.randint(2, 12), rng.randint(1, 9)
+    question = (
+        f"{name} has {a} {item}. Every day she buys {b} more {item} for ${price} each. "
+        f"How much money does {name} spend on {item} in a week if she only buys them on weekdays?"
+    )
+    answer = (
+        f"{name} buys {b} {item} per day on 5 weekdays, so she buys {b} * 5 = <<{b}*5={b * 5}>>{b * 5} {item}.\n"
+        f"Each costs ${price}, so she spends {b * 5} * {price} = <<{b * 5}*{price}={b * 5 * price}>>{b * 5 * price} dollars.\n"
+        f"#### {b * 5 * price}"
+    )
+    return question, answer
+
+
+def gsm8k_shaped_prompt(rng, n_shots):
+    """Same layout as merge_prompt.py: instruction + solved shots + target."""
+    parts = ["Instruction: Answer the following math problems reasoning step by step.\n\n"]
+    for _ in range(n_shots):
+        q, a = gsm8k_problem(rng)
+        parts.append(f"Question: {q}\nAnswer: {a}\n###\n\n")
+    q, _ = gsm8k_problem(rng)
+    parts.append(f"Question: {q}\nAnswer: Let's think step by step.")
+    return "".join(parts)
+
+
+def build_cases():
+    rng = random.Random(SEED)
+    cases = {}
+    for n in SYNTHETIC_WORDS:
+        cases[f"synthetic_{n}w"] = [synthetic_prompt(rng, n) for _ in range(PROMPTS_PER_CASE)]
+    for k in GSM8K_SHOTS:
+        cases[f"gsm8k_{k}shot"] = [gsm8k_shaped_prompt(rng, k) for _ in range(PROMPTS_PER_CASE)]
+    return cases
+
+
+def count_tokens(text):
+    return len(text.split())
+
+# ==========================================
+# TINY OFFLINE MODELS
+# ==========================================
+def make_tiny_models():
+    """Trains tiny tokenizers on the benchmark corpus and saves random tiny models."""
+    import torch
+    from tokenizers import Tokenizer, decoders, models, normalizers, pre_tokenizers, processors, trainers
+    from transformers import (BertConfig, BertForTokenClassification, GPT2Config,
+                              GPT2LMHeadModel, PreTrainedTokenizerFast)
+
+    torch.manual_seed(SEED)
+    corpus = [p for prompts in build_cases().values() for p in prompts]
+
+    # WordPiece per il classificatore LLMLingua-2 (stile BERT cased)
+    wp = Tokenizer(models.WordPiece(unk_token="[UNK]"))
+    wp.normalizer = normalizers.BertNormalizer(lowercase=False)
+    wp.pre_tokenizer = pre_tokenizers.BertPreTokenizer()
+    wp.decoder = decoders.WordPiece()
+    wp.train_from_iterator(corpus, trainers.WordPieceTrainer(
+        vocab_size=2000, special_tokens=["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]"]))
+    wp.post_processor = processors.TemplateProcessing(
+        single="[CLS] $A [SEP]", pair="[CLS] $A [SEP] $B [SEP]",
+        special_tokens=[("[CLS]", wp.token_to_id("[CLS]")), ("[SEP]", wp.token_to_id("[SEP]"))])
+    bert_tok = PreTrainedTokenizerFast(
+        tokenizer_object=wp, unk_token="[UNK]", pad_token="[PAD]", cls_token="[CLS]",
+        sep_token="[SEP]", mask_token="[MASK]", model_max_length=512)
+    bert = BertForTokenClassification(BertConfig(
+        vocab_size=len(bert_tok), hidden_size=64, num_hidden_layers=2, num_attention_heads=2,
+        intermediate_size=128, max_position_embeddings=512, num_labels=2))
+    bert.save_pretrained(TINY_BERT)
+    bert_tok.save_pretrained(TINY_BERT)
+
+    # Byte-level BPE per il modello causale LLMLingua-1 (stile GPT-2)
+    bpe = Tokenizer(models.BPE())
+    bpe.pre_tokenizer = pre_tokenizers.ByteLevel(add_prefix_space=False)
+    bpe.decoder = decoders.ByteLevel()
+    bpe.train_from_iterator(corpus, trainers.BpeTrainer(
+        vocab_size=2000, special_tokens=["<|endoftext|>"],
+        initial_alphabet=pre_tokenizers.ByteLevel.alphabet()))
+    gpt_tok = PreTrainedTokenizerFast(
+        tokenizer_object=bpe, bos_token="<|endoftext|>", eos_token="<|endoftext|>",
+        unk_token="<|endoftext|>", pad_token="<|endoftext|>", model_max_length=1024)
+    gpt2 = GPT2LMHeadModel(GPT2Config(
+        vocab_size=len(gpt_tok), n_embd=64, n_layer=2, n_head=2, n_positions=1024))
+    gpt2.save_pretrained(TINY_GPT2)
+    gpt_tok.save_pretrained(TINY_GPT2)
+    print(f"Tiny models saved to {TINY_BERT} and {TINY_GPT2}")
+
+# ==========================================
+# COMPRESSOR LOADING
+# ==========================================
+def load_compressor(name):
+    """Returns compress(text) -> compressed_text for the given benchmark target."""
+    if name == 'rule_based':
+        from rule_based import rule_based_compress
+        return rule_based_compress
+    if name == 'rule_numeric':
+        from rule_based_numeric import numeric_rule_compress
+        return numeric_rule_compress
+
+    os.environ.setdefault("HF_HUB_OFFLINE", "1")
+    os.environ.setdefault("TRANSFORMERS_OFFLINE", "1")
+    import torch
+    torch.manual_seed(SEED)
+
+    if name == 'llmlingua1_kv':
+        from perplexity_compress import PerplexityCompressor
+        compressor = PerplexityCompressor.load(TINY_GPT2)
+        return lambda text: compressor.compress_many([text], TARGET_RATE, FORCE_TOKENS)[0]
+
+    from llmlingua import PromptCompressor
+
+    if name == 'llmlingua2':
+        compressor = PromptCompressor(model_name=TINY_BERT, use_llmlingua2=True, device_map="cpu")
+
+        def compress(text):
+            return compressor.compress_prompt(text, rate=TARGET_RATE, force_tokens=FORCE_TOKENS)['compressed_prompt']
+        return compress
+
+    if name == 'llmlingua1':
+        compressor = PromptCompressor(
+            model_name=TINY_GPT2, device_map="cpu",
+            model_config={"torch_dtype": torch.float32}, open_api_config={})
+
+        def compress(text):
+            target = int(len(compressor.tokenizer.encode(text)) * TARGET_RATE)
+            return compressor.compress_prompt(
+                text, target_token=target, use_sentence_level_filter=False,
+                use_context_level_filter=False, use_token_level_filter=True)['compressed_prompt']
+        return compress
+
+    raise ValueError(f"Unknown compressor: {name}")
+
+# ==========================================
+# BENCHMARK WORKER
+# ==========================================
+def run_compressor(name, repeat):
+    """Runs all cases for one compressor. Executed in a fresh process."""
+    t0 = time.perf_counter()
+    compress = load_compressor(name)
+    load_s = time.perf_counter() - t0
+
+    results = {}
+    for case, prompts in build_cases().items():
+        compress(prompts[0])  # warmup
+        n_tokens_in = sum(count_tokens(p) for p in prompts)
+        best = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            outputs = [compress(p) for p in prompts]
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        n_tokens_out = sum(count_tokens(o) for o in outputs)
+        results[case] = {
+            'prompts_per_s': len(prompts) / best,
+            'ms_per_1k_tokens': 1000 * best / (n_tokens_in / 1000),
+            'compression_ratio': n_tokens_out / n_tokens_in,
+            'tokens_in': n_tokens_in,
+        }
+    peak_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    return {'load_s': load_s, 'peak_rss_mb': peak_rss_mb, 'cases': results}
+
+
+def run_isolated(name, repeat):
+    ctx = multiprocessing.get_context("spawn")
+    with ctx.Pool(1) as pool:
+        return pool.apply(run_compressor, (name, repeat))
+
+# ==========================================
+# BASELINE COMPARISON
+# ==========================================
+def compare(current, baseline, names=None):
+    """
+    Regressions of `current` against `baseline` for the compressors in `names`
+    (default: all of current). A baseline compressor or case missing from
+    the run counts as a failure, so a crash never passes as "no regressions".
+    """
+    failures = []
+    for name in names if names is not None else current:
+        res, base = current.get(name), baseline.get(name)
+        if base is None:
+            continue
+        if res is None:
+            failures.append(f"{name}: in the baseline but missing from this run")
+            continue
+        for case in base['cases']:
+            if case not in res['cases']:
+                failures.append(f"{name}/{case}: in the baseline but missing from this run")
+        if res['peak_rss_mb'] > base['peak_rss_mb'] * (1 + RSS_TOLERANCE):
+            failures.append(f"{name}: peak RSS {res['peak_rss_mb']:.0f} MB > baseline {base['peak_rss_mb']:.0f} MB")
+        for case, r in res['cases'].items():
+            b = base['cases'].get(case)
+            if b is None:
+                continue
+            if r['prompts_per_s'] < b['prompts_per_s'] * (1 - THROUGHPUT_TOLERANCE):
+                failures.append(f"{name}/{case}: {r['prompts_per_s']:.1f} prompts/s < baseline {b['prompts_per_s']:.1f}")
+            if abs(r['compression_ratio'] - b['compression_ratio']) > RATIO_TOLERANCE:
+                failures.append(f"{name}/{case}: ratio {r['compression_ratio']:.3f} vs baseline {b['compression_ratio']:.3f}")
+    return failures
+
+
+def print_report(results):
+    print("\n" + "=" * 84)
+    print(f"{'Compressor':<12} {'Case':<16} {'prompts/s':>10} {'ms/1k tok':>10} {'ratio':>7} {'peak RSS MB':>12} {'load s':>7}")
+    print("=" * 84)
+    for name, res in results.items():
+        for case, r in res['cases'].items():
+            print(f"{name:<12} {case:<16} {r['prompts_per_s']:>10.1f} {r['ms_per_1k_tokens']:>10.2f} "
+                  f"{r['compression_ratio']:>7.3f} {res['peak_rss_mb']:>12.0f} {res['load_s']:>7.2f}")
+    print("=" * 84)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark prompt compressors.")
+    parser.add_argument("--only", default=",".join(COMPRESSORS), help="comma-separated compressors to run")
+    parser.add_argument("--repeat", type=int, default=3, help="timed repetitions per case (best is kept)")
+    parser.add_argument("--baseline", default=BASELINE_FILE)
+    parser.add_argument("--save-baseline", action="store_true", help="overwrite the baseline with this run")
+    parser.add_argument("--make-tiny-models", action="store_true", help="create the offline tiny models and exit")
+    args = parser.parse_args()
+
+    if args.make_tiny_models:
+        make_tiny_models()
+        return 0
+
+    names = args.only.split(",")
+    results, errors = {}, {}
+    for name in names:
+        print(f"--- Benchmarking {name} ---")
+        try:
+            results[name] = run_isolated(name, args.repeat)
+        except Exception as e:
+            errors[name] = f"{type(e).__name__}: {e}"
+            print(f"  FAILED {name}: {errors[name]}")
+    print_report(results)
+
+    if errors:
+        print("FAILED COMPRESSORS:")
+        for name, error in errors.items():
+            print(f"  - {name}: {error}")
+        if args.save_baseline:
+            print("Baseline not saved: every compressor must run.")
+        return 1
+
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(args.baseline) or ".", exist_ok=True)
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=4)
+        print(f"Baseline saved to {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print(f"No baseline at {args.baseline}; run with --save-baseline first.")
+        return 0
+    with open(args.baseline, 'r', encoding='utf-8') as f:
+        baseline = json.load(f)
+    failures = compare(results, baseline, names)
+    if failures:
+        print("REGRESSIONS:")
+        for line in failures:
+            print(f"  - {line}")
+        return 1
+    print("No regressions against baseline.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
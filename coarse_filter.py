@@ -0,0 +1,70 @@
+"""
+Query-aware coarse filter, run before token-level compression (in the spirit
+of LongLLMLingua's coarse-grained stage).
+
+Each few-shot context is split into its demonstrations. They are scored
+against the row's target question with BM25 (demo_retrieval.BM25Index, NumPy
+only, microseconds per row), and only the most relevant fraction is kept, in
+their original order. The token-level model then sees only the survivors, so
+its cost drops in proportion to the words removed.
+
+To keep the overall compression rate, the token-level rate is raised to
+rate * words_before / words_after (capped at 1.0): coarse + fine together
+still keep about `rate` of the context.
+
+    python cut_prompt_merge_llmlingua2.py --coarse 0.5    # keep half of the demonstrations
+"""
+import math
+import re
+
+from compressor_models import DEMO_SEPARATOR
+from merge_prompt import INSTRUCTION
+
+# ==========================================
+# CONFIGURATION
+# ==========================================
+MIN_DEMOS = 1   # dimostrazioni tenute in ogni caso
+
+# Fine di una dimostrazione: il separatore da solo sulla riga ("####" della risposta GSM8K escluso)
+_DEMO_END = re.compile(r'(?<!#)' + re.escape(DEMO_SEPARATOR) + r'(?!#)[ \t]*(?:\n\s*|$)')
+
+
+def split_context(context, header=INSTRUCTION):
+    """
+    (header, demonstrations): the instruction prefix, if present, and the
+    demonstration blocks with their separator; header + ''.join(demos) == context.
+    """
+    head = header if header and context.startswith(header) else ""
+    body = context[len(head):]
+    demos, pos = [], 0
+    for match in _DEMO_END.finditer(body):
+        demos.append(body[pos:match.end()])
+        pos = match.end()
+    if body[pos:].strip():
+        demos.append(body[pos:])
+    elif demos:
+        demos[-1] += body[pos:]
+    return head, demos
+
+
+def filter_demonstrations(context, query, keep, header=INSTRUCTION):
+    """Context with only the ceil(keep * n) demonstrations most relevant to `query`."""
+    from demo_retrieval import BM25Index
+
+    head, demos = split_context(context, header)
+    n_keep = max(MIN_DEMOS, math.ceil(keep * len(demos)))
+    if n_keep >= len(demos):
+        return context
+    kept = sorted(BM25Index(demos).top_k(query, n_keep))
+    return head + "".join(demos[i] for i in kept)
+
+
+def coarse_filter(contexts, queries, keep, rate):
+    """
+    (filtered contexts, token-level rate) for one compression call: the rate is
+    adjusted on the total words of `contexts`, so the overall rate stays `rate`.
+    """
+    filtered = [filter_demonstrations(c, q, keep) if c else c for c, q in zip(contexts, queries)]
+    before = sum(len(c.split()) for c in contexts)
+    after = sum(len(c.split()) for c in filtered)
+    return filtered, min(1.0, rate * before / after) if after else rate
@@ -0,0 +1,174 @@
+"""
+Compact (normalised) format for the formatted few-shot dataset.
+
+The classic format stores every full 8-shot prompt in each row ('question',
+plus 'context_only' again), so every demonstration text is repeated dozens of
+times on disk and in memory. The compact format stores each problem once and
+every row as references:
+
+    {
+      "format": "compact-fewshot-v1",
+      "templates": {"instruction": ..., "demo": ..., "target": ...},
+      "items": [{"question": ..., "answer": ...}, ...],        # demonstration table
+      "rows":  [{"target": 17, "demos": [3, 250, ...]}, ...]   # + any extra per-row fields
+    }
+
+CompactDataset materialises a row (the same dict merge_prompt.build_entry
+produces, plus its extra fields) only when it is accessed. load_rows() reads
+both formats, so the compression scripts accept either.
+
+    python merge_prompt.py --compact --output datasets/dataset_gsm8k_8shot.compact.json
+    python compact_dataset.py pack datasets/dataset_gsm8k_formatted_8shot.json out.compact.json
+    python compact_dataset.py unpack out.compact.json out.json
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+from keep_mask import unpack_rows
+from merge_prompt import NUM_SHOTS, RETRIEVAL, SEED, TEMPLATES, build_entry, demo_rows
+
+FORMAT = "compact-fewshot-v1"
+_DERIVED_FIELDS = ('question', 'answer', 'context_only', 'target_only', 'protected_spans')
+
+
+class CompactDataset:
+    """Read-only sequence of formatted rows, materialised on access."""
+
+    def __init__(self, items, rows, templates=TEMPLATES):
+        self.items = items
+        self.rows = rows
+        self.templates = dict(templates)
+
+    @classmethod
+    def build(cls, input_data, num_shots=NUM_SHOTS, seed=SEED, per_row_seed=False, retrieval=RETRIEVAL):
+        """Same demonstrations as merge_prompt.build_rows, stored as indices."""
+        items = [{'question': item['question'], 'answer': item['answer']} for item in input_data]
+        rows = [{'target': i, 'demos': demos}
+                for i, demos in demo_rows(items, num_shots, seed, per_row_seed, retrieval=retrieval)]
+        return cls(items, rows)
+
+    @classmethod
+    def pack(cls, entries, templates=TEMPLATES):
+        """
+        Compact version of classic formatted rows. Demonstrations are parsed back
+        out of context_only / target_only and deduplicated; raises ValueError if
+        a row was not produced with these templates.
+        """
+        instruction = templates['instruction']
+        demo_prefix, demo_mid = templates['demo'].split('{question}')[0], "\nAnswer: "
+        demo_end = templates['demo'].split('{answer}')[1]
+        target_prefix, target_suffix = templates['target'].split('{question}')
+
+        items, index, rows = [], {}, []
+
+        def item_id(question, answer):
+            key = (question, answer)
+            if key not in index:
+                index[key] = len(items)
+                items.append({'question': question, 'answer': answer})
+            return index[key]
+
+        for n, entry in enumerate(entries):
+            context, target = entry.get('context_only', ''), entry.get('target_only', '')
+            if not context.startswith(instruction) or not target.startswith(target_prefix):
+                raise ValueError(f"Row {n}: not built with the merge_prompt templates")
+            demos = []
+            for block in context[len(instruction):].split(demo_end)[:-1]:
+                question, _, answer = block[len(demo_prefix):].partition(demo_mid)
+                demos.append(item_id(question, answer))
+            question = target[len(target_prefix):len(target) - len(target_suffix)]
+            row = {'target': item_id(question, entry['answer']), 'demos': demos}
+            row.update((k, v) for k, v in entry.items() if k not in _DERIVED_FIELDS)
+            rows.append(row)
+
+        dataset = cls(items, rows, templates)
+        for n, entry in enumerate(entries):
+            rebuilt = dataset[n]
+            if any(rebuilt[k] != entry.get(k, rebuilt[k]) for k in ('question', 'context_only', 'target_only')):
+                raise ValueError(f"Row {n}: does not round-trip through the compact format")
+        return dataset
+
+    @classmethod
+    def from_payload(cls, payload):
+        if payload.get('format') != FORMAT:
+            raise ValueError(f"Not a {FORMAT} file (format: {payload.get('format')})")
+        return cls(payload['items'], payload['rows'], payload.get('templates', TEMPLATES))
+
+    def to_payload(self):
+        return {'format': FORMAT, 'templates': self.templates, 'items': self.items, 'rows': self.rows}
+
+    def save(self, path):
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.to_payload(), f, ensure_ascii=False)
+
+    def materialize(self, i):
+        row = self.rows[i]
+        entry = build_entry(self.items[row['target']], [self.items[j] for j in row['demos']], self.templates)
+        entry.update((k, v) for k, v in row.items() if k not in ('target', 'demos'))
+        return unpack_rows([entry])[0]
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self.materialize(j) for j in range(*i.indices(len(self.rows)))]
+        return self.materialize(i)
+
+    def __iter__(self):
+        return (self.materialize(i) for i in range(len(self.rows)))
+
+
+def is_compact(payload):
+    return isinstance(payload, dict) and payload.get('format') == FORMAT
+
+
+def load_rows(path, lazy=False):
+    """
+    Rows of a formatted dataset in either format. Classic files return the
+    list as is; compact files return a CompactDataset (lazy=True) or its
+    materialised rows (lazy=False, for scripts that add fields to each row).
+    Compressed fields stored as keep masks (keep_mask.py) come back as strings.
+    """
+    with open(path, 'r', encoding='utf-8') as f:
+        payload = json.load(f)
+    if is_compact(payload):
+        dataset = CompactDataset.from_payload(payload)
+        return dataset if lazy else list(dataset)
+    return unpack_rows(payload)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compact few-shot dataset format.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    pack = sub.add_parser("pack", help="classic formatted dataset -> compact")
+    pack.add_argument("input")
+    pack.add_argument("output")
+    unpack = sub.add_parser("unpack", help="compact -> classic formatted dataset")
+    unpack.add_argument("input")
+    unpack.add_argument("output")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    if args.command == "pack":
+        with open(args.input, 'r', encoding='utf-8') as f:
+            entries = json.load(f)
+        dataset = CompactDataset.pack(entries)
+        dataset.save(args.output)
+        print(f"{len(dataset)} rows, {len(dataset.items)} distinct problems")
+    else:
+        rows = load_rows(args.input)
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(rows, f, indent=4, ensure_ascii=False)
+    elapsed = time.perf_counter() - start
+    size_in, size_out = os.path.getsize(args.input), os.path.getsize(args.output)
+    print(f"{args.input}: {size_in / 2**20:.2f} MB -> {args.output}: {size_out / 2**20:.2f} MB "
+          f"({size_in / max(1, size_out):.1f}x) in {elapsed:.2f}s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
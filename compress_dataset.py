@@ -0,0 +1,137 @@
+"""
+Single-pass compression driver: reads the formatted dataset once, runs every
+selected compressor from compressor_registry over it and writes one combined
+file with all the fields (question_rulebased, question_llmlingua2, ...).
+
+Each compressor keeps its own batching and caching policy (see the registry);
+models are loaded one at a time and freed before the next compressor.
+
+    python compress_dataset.py                                   # all registered compressors
+    python compress_dataset.py --methods rule_based,rule_numeric,llmlingua2 --rate 0.3
+    python compress_dataset.py --list
+    python compress_dataset.py --masks   # compressed fields as keep masks (see keep_mask.py)
+"""
+import argparse
+import json
+import sys
+import time
+
+import compressor_registry
+from compact_dataset import load_rows
+from compressor_models import clean_memory
+from keep_mask import pack_rows
+from profiling import span, start_profiling, finish_profiling
+from protected_spans import row_text_and_spans
+
+# ==========================================
+# CONFIGURATION
+# ==========================================
+INPUT_FILE = "datasets/dataset_gsm8k_formatted_8shot.json"
+OUTPUT_FILE = "datasets/gsm8k_compressed_all.json"
+
+
+def prepare_rows(data):
+    """Sets question_original and returns (texts, protected spans) to compress, one per row."""
+    texts, spans = [], []
+    for entry in data:
+        field = 'question' if 'question' in entry else 'question_original'
+        text, row_spans = row_text_and_spans(entry, field)
+        entry.setdefault('question_original', text)
+        if row_spans:
+            entry['protected_spans'] = [list(pair) for pair in row_spans]
+        texts.append(text)
+        spans.append(row_spans)
+    return texts, spans
+
+
+def run_compressor(spec, data, texts, spans, rate):
+    """
+    Fills spec.field on every row and returns the number of failed rows (they
+    keep the original text); raises if the compressor cannot be loaded.
+    """
+    with span(f"{spec.name}_load"):
+        compress_many = spec.factory(rate)
+    batch = spec.batch_size or len(texts) or 1
+    errors = 0
+    with span(f"{spec.name}_compress"):
+        for start in range(0, len(texts), batch):
+            end = start + batch
+            try:
+                compressed = compress_many(texts[start:end], spans[start:end])
+            except Exception as e:
+                print(f"  [{spec.name}] Error on rows {start}-{min(end, len(texts)) - 1}: {e}")
+                compressed = texts[start:end]
+                errors += end - start
+            for entry, text in zip(data[start:end], compressed):
+                entry[spec.field] = text
+            if spec.batch_size and (start // batch) % 10 == 0:
+                print(f"  [{spec.name}] Done {min(end, len(texts))}/{len(texts)}")
+    del compress_many
+    clean_memory()
+    return min(errors, len(texts))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run all registered compressors over the dataset in one pass.")
+    parser.add_argument("--methods", default=",".join(compressor_registry.names()))
+    parser.add_argument("--rate", type=float, default=compressor_registry.DEFAULT_RATE)
+    parser.add_argument("--input", default=INPUT_FILE)
+    parser.add_argument("--output", default=OUTPUT_FILE)
+    parser.add_argument("--limit", type=int, default=None, help="only the first N rows")
+    parser.add_argument("--masks", action="store_true",
+                        help="store the compressed fields as keep masks over question_original (keep_mask.py)")
+    parser.add_argument("--list", action="store_true", help="list the registered compressors and exit")
+    args = parser.parse_args(argv)
+
+    if args.list:
+        for name in compressor_registry.names():
+            spec = compressor_registry.get(name)
+            print(f"{name:<14} -> {spec.field:<28} {spec.description}")
+        return 0
+
+    specs = [compressor_registry.get(name) for name in args.methods.split(",")]
+    start_profiling("compress_dataset")
+    with span("json_load"):
+        data = load_rows(args.input)  # formato classico o compatto
+    if args.limit:
+        data = data[:args.limit]
+    texts, spans = prepare_rows(data)
+    print(f"Rows: {len(data)}, compressors: {', '.join(spec.name for spec in specs)}, rate: {args.rate}")
+
+    summary = []
+    for spec in specs:
+        print(f"\n--- {spec.name} -> {spec.field} ---")
+        start = time.perf_counter()
+        try:
+            errors = run_compressor(spec, data, texts, spans, args.rate)
+        except Exception as e:
+            # Es. spaCy o llmlingua non installati: gli altri compressori proseguono
+            print(f"  [{spec.name}] Skipped: {e}")
+            continue
+        elapsed = time.perf_counter() - start
+        words_in = sum(len(t.split()) for t in texts)
+        words_out = sum(len(entry[spec.field].split()) for entry in data)
+        summary.append((spec.name, elapsed, words_out / words_in if words_in else 1.0, errors))
+
+    print("\n" + "=" * 56)
+    print(f"{'Compressor':<14} {'time s':>8} {'rows/s':>9} {'ratio':>7} {'errors':>7}")
+    print("=" * 56)
+    for name, elapsed, ratio, errors in summary:
+        print(f"{name:<14} {elapsed:>8.2f} {len(data) / elapsed if elapsed else 0.0:>9.1f} {ratio:>7.3f} {errors:>7}")
+    print("=" * 56)
+
+    if args.masks:
+        with span("keep_masks"):
+            fallbacks = pack_rows(data, [spec.field for spec in specs])
+        for field, count in fallbacks.items():
+            if count:
+                print(f"  {field}: {count} rows not extractive, stored as text")
+    with span("json_dump"), open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(data, f, indent=None if args.masks else 4, ensure_ascii=False)
+    print(f"Saved to {args.output}")
+    finish_profiling()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,603 @@
+"""
+Loading of the LLMLingua compressors and batched LLMLingua-2 word scoring.
+
+llmlingua's compress_prompt() handles one prompt (or one list of contexts) per
+call with a single rate. Llmlingua2Scorer exposes the underlying step, i.e. the
+token classifier's keep-probability per word, for many prompts in padded
+batches; select_keep() then applies rate and force_tokens per prompt. This is
+what lets the compression server batch requests from different clients with
+different rates in the same forward pass.
+
+Words are whitespace tokens of the input (same unit as rule_based), so a
+compressed prompt is always the original words with some of them dropped.
+
+torch / transformers / llmlingua are imported inside the functions: importing
+this module is free.
+"""
+import functools
+import hashlib
+import os
+import re
+import sys
+from types import SimpleNamespace
+
+from protected_spans import compress_unprotected, split_segments
+
+# ==========================================
+# CONFIGURATION
+# ==========================================
+LLMLINGUA2_MODEL = "microsoft/llmlingua-2-bert-base-multilingual-cased-meetingbank"
+LLMLINGUA1_MODEL = "gpt2"  # Alternativa: "TinyLlama/TinyLlama-1.1B-Chat-v1.0"
+
+# Numeri e operatori matematici essenziali per GSM8K
+DEFAULT_FORCE_TOKENS = [
+    '?', '.', '=', '+', '-', '*', '/',
+    '0', '1', '2', '3', '4', '5', '6', '7', '8', '9'
+]
+
+MAX_SEQ_LEN = 512   # finestra del classificatore BERT
+BATCH_SIZE = 32     # finestre per forward pass
+
+# Modalità chunked: i contesti si dividono ai separatori delle dimostrazioni
+# (vedi merge_prompt.py), poi alle frasi se una dimostrazione non sta nella finestra
+DEMO_SEPARATOR = "###"
+_SENTENCE_END_RE = re.compile(r'(?<=[.!?])\s+')
+
+
+def separator_re(separator=DEMO_SEPARATOR):
+    """The separator on its own: not the "####" of a GSM8K answer, which contains "###"."""
+    return re.compile(r'(?<!{0}){1}(?!{2})'.format(re.escape(separator[0]), re.escape(separator),
+                                                   re.escape(separator[-1])))
+_WORD_RE = re.compile(r'\S+')
+
+# Backend del classificatore LLMLingua-2:
+#   torch : PyTorch eager, fp32 (default)
+#   int8  : quantizzazione dinamica int8 dei Linear (solo CPU)
+#   onnx  : ONNX Runtime su un export creato con quantize_llmlingua2.py
+BACKENDS = ('torch', 'int8', 'onnx')
+ONNX_MODEL_PATH = "models/llmlingua2/model.onnx"
+
+# Snapshot dei pesi (formato zip di torch.save) mappati in memoria dai worker
+WEIGHTS_SNAPSHOT_DIR = "models/shared"
+
+
+def default_device():
+    import torch
+    return "cuda" if torch.cuda.is_available() else "cpu"
+
+# ==========================================
+# MODEL LOADING
+# ==========================================
+def load_llmlingua2(model_name=LLMLINGUA2_MODEL, device=None, backend='torch', onnx_path=ONNX_MODEL_PATH,
+                    num_threads=None, weights_path=None):
+    """
+    LLMLingua-2 PromptCompressor. With backend 'int8' or 'onnx' the classifier
+    is swapped in place, so compress_prompt() and Llmlingua2Scorer both use it.
+    num_threads only applies to ONNX Runtime (torch: torch.set_num_threads).
+    With weights_path the classifier is memory-mapped from that snapshot
+    instead of being loaded with from_pretrained (CPU, torch backend only).
+    """
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown backend '{backend}' (choose from {BACKENDS})")
+    if weights_path:
+        if backend != 'torch':
+            raise ValueError(f"Shared weights need the torch backend (got '{backend}')")
+        return snapshot_compressor_class()(model_name=model_name, device_map="cpu", use_llmlingua2=True,
+                                           weights_path=weights_path)
+    from llmlingua import PromptCompressor
+    if backend != 'torch':
+        device = "cpu"
+    compressor = PromptCompressor(
+        model_name=model_name,
+        use_llmlingua2=True,
+        device_map=device or default_device()
+    )
+    if backend == 'int8':
+        compressor.model = quantize_int8(compressor.model)
+    elif backend == 'onnx':
+        compressor.model = OnnxTokenClassifier(onnx_path, num_threads)
+    return compressor
+
+
+def quantize_int8(model):
+    """Dynamic int8 quantisation of the Linear layers (weights int8, activations fp32)."""
+    import torch
+    return torch.quantization.quantize_dynamic(model.to("cpu").eval(), {torch.nn.Linear}, dtype=torch.qint8)
+
+
+class OnnxTokenClassifier:
+    """
+    Drop-in replacement for the HF token classifier backed by ONNX Runtime:
+    called with input_ids / attention_mask, returns an object with .logits.
+    """
+
+    def __init__(self, onnx_path, num_threads=None):
+        import onnxruntime as ort
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+        self.session = ort.InferenceSession(onnx_path, options, providers=["CPUExecutionProvider"])
+        self.input_names = {i.name for i in self.session.get_inputs()}
+        self.device = "cpu"
+
+    def __call__(self, input_ids, attention_mask, **kwargs):
+        import torch
+        feeds = {'input_ids': input_ids.cpu().numpy(), 'attention_mask': attention_mask.cpu().numpy()}
+        if 'token_type_ids' in self.input_names:
+            feeds['token_type_ids'] = torch.zeros_like(input_ids).cpu().numpy()
+        logits = self.session.run(['logits'], {k: v for k, v in feeds.items() if k in self.input_names})[0]
+        return SimpleNamespace(logits=torch.from_numpy(logits))
+
+    # Compatibilità con il codice che tratta il modello come un nn.Module
+    def eval(self):
+        return self
+
+    def to(self, *args, **kwargs):
+        return self
+
+
+def load_llmlingua1(model_name=LLMLINGUA1_MODEL, device="cpu", weights_path=None):
+    """
+    Same setup as old_files/cut_prompt_llmlingua1.py (CPU, float32, pad token fix).
+    With weights_path the model is memory-mapped from that snapshot.
+    """
+    import torch
+    if weights_path:
+        compressor = snapshot_compressor_class()(
+            model_name=model_name,
+            device_map=device,
+            model_config={"trust_remote_code": True},
+            open_api_config={},
+            weights_path=weights_path
+        )
+    else:
+        from llmlingua import PromptCompressor
+        compressor = PromptCompressor(
+            model_name=model_name,
+            device_map=device,
+            model_config={
+                "trust_remote_code": True,
+                "torch_dtype": torch.float32
+            },
+            open_api_config={}
+        )
+    if compressor.tokenizer.pad_token is None:
+        compressor.tokenizer.pad_token = compressor.tokenizer.eos_token
+    compressor.device = device
+    return compressor
+
+
+def compress_llmlingua1(compressor, text, rate, protected_spans=None):
+    """
+    LLMLingua-1 token-level compression with an explicit target_token (see old_files).
+    protected_spans are left verbatim and not passed to the model.
+    """
+    return compress_unprotected(text, protected_spans,
+                                lambda segments: [_compress_llmlingua1(compressor, s, rate) for s in segments])
+
+
+def _compress_llmlingua1(compressor, text, rate):
+    target_tokens = int(len(compressor.tokenizer.encode(text)) * rate)
+    result = compressor.compress_prompt(
+        text,
+        target_token=target_tokens,
+        use_sentence_level_filter=False,
+        use_context_level_filter=False,
+        use_token_level_filter=True
+    )
+    return result.get('compressed_prompt', text)
+
+
+def llmlingua1_word_scores(compressor, text):
+    """
+    Surprisal of every whitespace word of `text` under the LLMLingua-1 small LM:
+    mean NLL of its tokens, the quantity LLMLingua-1's token-level filter ranks by
+    (less predictable = more informative). One forward per model window; the
+    first token of each window has no context and counts as infinitely informative.
+    """
+    import torch
+    words = [(m.start(), m.end()) for m in _WORD_RE.finditer(text)]
+    enc = compressor.tokenizer(text, return_offsets_mapping=True, add_special_tokens=False)
+    ids = enc['input_ids']
+    config = compressor.model.config
+    window = getattr(config, 'max_position_embeddings', None) or getattr(config, 'n_positions', 1024)
+
+    nll = [float('inf')] * len(ids)
+    for start in range(0, len(ids), window):
+        chunk = torch.tensor([ids[start:start + window]], device=compressor.device)
+        with torch.inference_mode():
+            logits = compressor.model(chunk).logits[0, :-1].float()
+        losses = torch.nn.functional.cross_entropy(logits, chunk[0, 1:], reduction='none').tolist()
+        nll[start + 1:start + 1 + len(losses)] = losses
+
+    sums, counts = [0.0] * len(words), [0] * len(words)
+    w = 0
+    for (tok_start, tok_end), loss in zip(enc['offset_mapping'], nll):
+        while w < len(words) and words[w][1] <= tok_start:
+            w += 1
+        if w < len(words) and tok_end > words[w][0]:
+            sums[w] += loss
+            counts[w] += 1
+    return [sums[i] / counts[i] if counts[i] else 0.0 for i in range(len(words))]
+
+# ==========================================
+# SHARED (MEMORY-MAPPED) WEIGHTS
+# ==========================================
+def checkpoint_revision(model_name):
+    """
+    Identifies the exact weights of a checkpoint: the commit hash of a Hub
+    model (from the local cache if present, otherwise asked to the Hub), or
+    for a local directory a hash of its file names, sizes and mtimes.
+    """
+    if os.path.isdir(model_name):
+        digest = hashlib.sha256()
+        for root, dirs, files in os.walk(model_name):
+            dirs.sort()
+            for name in sorted(files):
+                path = os.path.join(root, name)
+                st = os.stat(path)
+                digest.update(f"{os.path.relpath(path, model_name)}:{st.st_size}:{st.st_mtime_ns}\n".encode())
+        return digest.hexdigest()
+    from huggingface_hub import HfApi, try_to_load_from_cache
+    cached = try_to_load_from_cache(model_name, "config.json")
+    if isinstance(cached, str):
+        return os.path.basename(os.path.dirname(cached))  # .../snapshots/<commit>/config.json
+    return HfApi().model_info(model_name).sha
+
+
+def weights_snapshot_path(model_name, revision=None, directory=WEIGHTS_SNAPSHOT_DIR):
+    """Snapshot file keyed by model name and revision: new weights never reuse a stale snapshot."""
+    revision = revision or checkpoint_revision(model_name)
+    return os.path.join(directory, f"{model_name.strip('/').replace('/', '--')}@{revision[:16]}.pt")
+
+
+def save_weights_snapshot(model, path):
+    """
+    state_dict in torch's zip format, the one torch.load(mmap=True) can map,
+    plus the non-persistent buffers (e.g. BERT's position_ids) so that a model
+    built on the meta device can be filled from the snapshot alone.
+    """
+    import torch
+    state = model.state_dict()
+    state.update((name, buf) for name, buf in model.named_buffers() if name not in state)
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = path + ".tmp"
+    torch.save(state, tmp_path)
+    os.replace(tmp_path, path)  # i worker non vedono mai un file a metà
+
+
+def mmap_weights(model, path):
+    """
+    Swaps the model's parameters for tensors memory-mapped from `path`.
+    The pages live in the page cache, so every process that maps the same
+    snapshot shares one physical copy of the weights; weights the model
+    already had are freed (a model built on the meta device by
+    model_from_snapshot has none). Only for inference: the mapping is
+    copy-on-write, and writing to a weight would make it private again.
+    """
+    import torch
+    state = torch.load(path, map_location="cpu", mmap=True, weights_only=True)
+    result = model.load_state_dict(state, assign=True, strict=False)
+    if result.missing_keys:
+        raise RuntimeError(f"Snapshot {path} does not match the model, missing: {result.missing_keys[:5]}")
+    for name in result.unexpected_keys:
+        # Buffer non persistenti salvati da save_weights_snapshot
+        module_name, _, buf_name = name.rpartition('.')
+        module = model.get_submodule(module_name)
+        if buf_name not in module._buffers:
+            raise RuntimeError(f"Snapshot {path} does not match the model, unexpected: {name}")
+        module.register_buffer(buf_name, state[name], persistent=False)
+    if hasattr(model, 'tie_weights'):
+        model.tie_weights()  # es. lm_head/wte di GPT-2: assign=True spezza il legame
+    clean_memory()
+    try:
+        # Restituisce al sistema l'heap liberato (glibc non lo fa da sola per i blocchi piccoli)
+        import ctypes
+        ctypes.CDLL("libc.so.6").malloc_trim(0)
+    except (OSError, AttributeError):
+        pass
+    return model
+
+
+def model_from_snapshot(model_name, path, trust_remote_code=True):
+    """
+    Builds the model from its config on the meta device (nothing is read or
+    allocated for the weights) and fills it with the snapshot at `path` via
+    mmap_weights: the worker never holds a private copy of the weights, not
+    even while loading. Token classifier or causal LM, as llmlingua decides.
+    """
+    import torch
+    from transformers import AutoConfig, AutoModelForCausalLM, AutoModelForTokenClassification
+    config = AutoConfig.from_pretrained(model_name, trust_remote_code=trust_remote_code)
+    if any("ForTokenClassification" in arch for arch in config.architectures or ()):
+        model_class = AutoModelForTokenClassification
+    else:
+        model_class = AutoModelForCausalLM
+    with torch.device("meta"):
+        model = model_class.from_config(config, trust_remote_code=trust_remote_code)
+    return mmap_weights(model, path).eval()
+
+
+@functools.lru_cache(maxsize=None)
+def snapshot_compressor_class():
+    """
+    PromptCompressor whose load_model reads only the config and the tokenizer
+    of the checkpoint and takes the model from model_from_snapshot, instead of
+    from_pretrained. It sets up what llmlingua's load_model does (tokenizer
+    padding, device, context_idxs, max_position_embeddings).
+    """
+    from llmlingua import PromptCompressor
+    from transformers import AutoConfig, AutoTokenizer
+
+    class SnapshotPromptCompressor(PromptCompressor):
+        def __init__(self, *args, weights_path, **kwargs):
+            self.weights_path = weights_path
+            super().__init__(*args, **kwargs)
+
+        def load_model(self, model_name, device_map="cpu", model_config={}):
+            trust_remote_code = model_config.get("trust_remote_code", True)
+            config = AutoConfig.from_pretrained(model_name, trust_remote_code=trust_remote_code)
+            tokenizer = AutoTokenizer.from_pretrained(model_name, trust_remote_code=trust_remote_code)
+            if model_config.get("pad_to_left", True):
+                tokenizer.padding_side = "left"
+                tokenizer.pad_token_id = config.pad_token_id if config.pad_token_id else tokenizer.eos_token_id
+            self.tokenizer = tokenizer
+            self.model = model_from_snapshot(model_name, self.weights_path, trust_remote_code)
+            self.device = device_map
+            self.context_idxs = []
+            self.max_position_embeddings = config.max_position_embeddings
+
+    return SnapshotPromptCompressor
+
+# ==========================================
+# BATCHED LLMLINGUA-2 SCORING
+# ==========================================
+class Llmlingua2Scorer:
+    """Keep-probability per word from the LLMLingua-2 token classifier, in batches."""
+
+    def __init__(self, model, tokenizer, device, max_seq_len=MAX_SEQ_LEN, batch_size=BATCH_SIZE):
+        self.model = model
+        self.tokenizer = tokenizer
+        self.device = device
+        self.max_seq_len = max_seq_len
+        self.batch_size = batch_size
+        self._word_len_cache = {}
+
+    @classmethod
+    def from_compressor(cls, compressor, **kwargs):
+        return cls(compressor.model, compressor.tokenizer, compressor.device, **kwargs)
+
+    @classmethod
+    def load(cls, model_name=LLMLINGUA2_MODEL, device=None, backend='torch', **kwargs):
+        return cls.from_compressor(load_llmlingua2(model_name, device, backend), **kwargs)
+
+    def _word_lengths(self, words):
+        """Number of sub-tokens per word (cached: GSM8K reuses a small vocabulary)."""
+        cache = self._word_len_cache
+        missing = list({w for w in words if w not in cache})
+        if missing:
+            encoded = self.tokenizer(missing, add_special_tokens=False)['input_ids']
+            for word, ids in zip(missing, encoded):
+                cache[word] = max(1, len(ids))
+        return [cache[w] for w in words]
+
+    def windows(self, words):
+        """Splits a word list into (start, end) windows that fit the classifier."""
+        limit = self.max_seq_len - 2  # [CLS] ... [SEP]
+        spans, start, used = [], 0, 0
+        for idx, length in enumerate(self._word_lengths(words)):
+            if used + length > limit and idx > start:
+                spans.append((start, idx))
+                start, used = idx, 0
+            used += length
+        if start < len(words) or not words:
+            spans.append((start, len(words)))
+        return spans
+
+    def chunks(self, text, separator=DEMO_SEPARATOR):
+        """
+        Word lists that each fit one classifier window, cut at demonstration
+        boundaries (the separator stays with its demonstration) and, inside a
+        demonstration that is too long, at sentence boundaries. Consecutive
+        pieces are packed into the same chunk while they fit.
+        """
+        limit = self.max_seq_len - 2
+        demos, pos = [], 0
+        for match in separator_re(separator).finditer(text):
+            demos.append(text[pos:match.end()])
+            pos = match.end()
+        demos.append(text[pos:])
+
+        pieces = []
+        for demo in demos:
+            words = demo.split()
+            if sum(self._word_lengths(words)) <= limit:
+                pieces.append(words)
+            else:
+                # Una frase più lunga della finestra la taglia comunque windows()
+                pieces.extend(sentence.split() for sentence in _SENTENCE_END_RE.split(demo))
+
+        chunks, current, used = [], [], 0
+        for words in pieces:
+            length = sum(self._word_lengths(words))
+            if current and used + length > limit:
+                chunks.append(current)
+                current, used = [], 0
+            current = current + words
+            used += length
+        if current:
+            chunks.append(current)
+        return chunks
+
+    def score_words(self, word_lists):
+        """Returns, for each word list, the keep-probability of every word."""
+        import torch
+
+        jobs = []  # (list index, start, words)
+        for list_idx, words in enumerate(word_lists):
+            for start, end in self.windows(words):
+                if end > start:
+                    jobs.append((list_idx, start, words[start:end]))
+        scores = [[0.0] * len(words) for words in word_lists]
+
+        for b in range(0, len(jobs), self.batch_size):
+            batch = jobs[b:b + self.batch_size]
+            enc = self.tokenizer(
+                [words for _, _, words in batch],
+                is_split_into_words=True,
+                padding=True,
+                truncation=True,
+                max_length=self.max_seq_len,
+                return_tensors="pt"
+            )
+            with torch.inference_mode():
+                logits = self.model(
+                    input_ids=enc['input_ids'].to(self.device),
+                    attention_mask=enc['attention_mask'].to(self.device)
+                ).logits
+            probs = torch.softmax(logits, dim=-1)[:, :, 1].float().cpu().tolist()
+            for row, (list_idx, start, words) in enumerate(batch):
+                sums = [0.0] * len(words)
+                counts = [0] * len(words)
+                for pos, word_id in enumerate(enc.word_ids(row)):
+                    if word_id is not None:
+                        sums[word_id] += probs[row][pos]
+                        counts[word_id] += 1
+                target = scores[list_idx]
+                for i in range(len(words)):
+                    # Parole troncate (caso limite) restano a 0: vengono scartate per prime
+                    target[start + i] = sums[i] / counts[i] if counts[i] else 0.0
+        return scores
+
+# ==========================================
+# SELECTION
+# ==========================================
+_EDGE_PUNCT_RE = re.compile(r'^\W+|\W+$')
+
+
+@functools.lru_cache(maxsize=32)
+def _forced_re(force_tokens):
+    # Alternative più lunghe prima: "..." vince su "."
+    alternatives = "|".join(re.escape(t) for t in sorted(set(force_tokens), key=len, reverse=True) if t)
+    return re.compile(f"(?:{alternatives})+") if alternatives else None
+
+
+def forced_mask(words, force_tokens):
+    """
+    True for the words that are themselves force tokens: made only of force
+    tokens ("=", "72", "3.5"), also once the punctuation around them is removed
+    ("$18," -> "18"). As in compress_prompt, a force token does not force the
+    word it sits in: "apples." is scored like any other word.
+    """
+    pattern = _forced_re(tuple(force_tokens))
+    if pattern is None:
+        return [False] * len(words)
+    mask = []
+    for word in words:
+        core = _EDGE_PUNCT_RE.sub('', word)
+        mask.append(bool(pattern.fullmatch(word) or (core and pattern.fullmatch(core))))
+    return mask
+
+
+def is_forced(word, force_tokens):
+    return forced_mask([word], force_tokens)[0]
+
+
+def select_keep(words, probs, rate, force_tokens=(), keep_exact=()):
+    """
+    Keep mask for one prompt with round(rate * n) words: forced words (see
+    forced_mask, plus the words equal to one of `keep_exact`) are always kept
+    and count toward that target, the rest of it is filled by descending
+    probability. Only when the forced words alone exceed the target is more
+    than rate kept.
+    """
+    n = len(words)
+    target = int(round(n * rate))
+    keep = [f or w in keep_exact for w, f in zip(words, forced_mask(words, force_tokens))]
+    budget = target - sum(keep)
+    if budget > 0:
+        candidates = sorted((i for i in range(n) if not keep[i]), key=lambda i: -probs[i])
+        for i in candidates[:budget]:
+            keep[i] = True
+    return keep
+
+
+def drop_order(words, scores, force_tokens=()):
+    """Indices of the words that may be dropped, least informative (lowest score) first."""
+    forced = forced_mask(words, force_tokens)
+    return sorted((i for i in range(len(words)) if not forced[i]), key=lambda i: scores[i])
+
+
+def apply_keep(words, keep):
+    return " ".join(w for w, k in zip(words, keep) if k)
+
+
+def compress_texts(scorer, texts, rate, force_tokens=DEFAULT_FORCE_TOKENS, protected_spans=None):
+    """
+    Batched LLMLingua-2 compression of many texts with the same rate.
+    protected_spans (one list of (start, end) per text) are not scored and stay
+    verbatim; the rate applies to the unprotected words of each text.
+    """
+    if protected_spans is None:
+        word_lists = [t.split() for t in texts]
+        scores = scorer.score_words(word_lists)
+        return [apply_keep(w, select_keep(w, s, rate, force_tokens)) for w, s in zip(word_lists, scores)]
+
+    segment_lists = [[seg.split() for seg, protected in split_segments(t, spans) if not protected and seg.strip()]
+                     for t, spans in zip(texts, protected_spans)]
+    flat_scores = scorer.score_words([words for segments in segment_lists for words in segments])
+    out, offset = [], 0
+    for text, spans, segments in zip(texts, protected_spans, segment_lists):
+        seg_scores = flat_scores[offset:offset + len(segments)]
+        offset += len(segments)
+        keep = select_keep([w for words in segments for w in words], [p for s in seg_scores for p in s],
+                           rate, force_tokens)
+        compressed, pos = [], 0
+        for words in segments:
+            compressed.append(apply_keep(words, keep[pos:pos + len(words)]))
+            pos += len(words)
+        out.append(compress_unprotected(text, spans, lambda _: compressed))
+    return out
+
+
+def join_words(words, separator=DEMO_SEPARATOR):
+    """Like " ".join, but each demonstration separator ends its line."""
+    out = []
+    for word in words:
+        out.append(word)
+        out.append("\n" if word == separator else " ")
+    return "".join(out).strip()
+
+
+def compress_chunked(scorer, texts, rate, force_tokens=DEFAULT_FORCE_TOKENS, separator=DEMO_SEPARATOR):
+    """
+    Chunked LLMLingua-2 compression for contexts longer than the classifier
+    window. The chunks of all texts (see Llmlingua2Scorer.chunks) are scored in
+    one batched call, so cost grows linearly with the context, and the rate is
+    applied once over each whole text: a chunk with little information can be
+    compressed harder than the others. Demonstration separators are kept so
+    that the compressed context keeps its structure.
+    """
+    chunked = [scorer.chunks(t, separator) for t in texts]
+    flat = [chunk for chunks in chunked for chunk in chunks]
+    flat_scores = scorer.score_words(flat)
+
+    out, offset = [], 0
+    for chunks in chunked:
+        words = [w for chunk in chunks for w in chunk]
+        probs = [p for scores in flat_scores[offset:offset + len(chunks)] for p in scores]
+        offset += len(chunks)
+        # Solo il separatore esatto: il "####" delle risposte resta una parola qualsiasi
+        keep = select_keep(words, probs, rate, force_tokens, keep_exact=(separator,))
+        out.append(join_words([w for w, k in zip(words, keep) if k], separator))
+    return out
+
+
+def clean_memory():
+    import gc
+    gc.collect()
+    # Se torch non è mai stato importato non c'è nulla da liberare sulla GPU
+    torch = sys.modules.get('torch')
+    if torch is not None and torch.cuda.is_available():
+        torch.cuda.empty_cache()
@@ -0,0 +1,131 @@
+"""
+Registry of the prompt compressors.
+
+Each compressor is registered once with the dataset field it writes, the
+method label used in the evaluation reports and its batching policy.
+compress_dataset.py runs every registered compressor over the dataset in a
+single pass; the evaluators (evaluation_llama.py, "evaluation qwen.py",
+simulate_load.py) take their method list from evaluation_methods().
+
+Adding a compressor:
+
+    @register('my_method', field='question_my_method', label='MyMethod', batch_size=32)
+    def _my_method(rate):
+        model = ...                        # heavy imports inside the factory
+        def compress_many(texts, spans):   # spans: protected spans, one list per text
+            return [...]
+        return compress_many
+
+The factory runs only when the compressor is actually used, so importing this
+module costs nothing.
+"""
+from compressor_models import DEFAULT_FORCE_TOKENS
+from protected_spans import compress_unprotected
+
+# ==========================================
+# CONFIGURATION
+# ==========================================
+DEFAULT_RATE = 0.5
+ORIGINAL = ('Original', 'question_original')   # riferimento non compresso nei report
+
+
+class CompressorSpec:
+    def __init__(self, name, field, label, factory, batch_size=None, description=""):
+        self.name = name
+        self.field = field
+        self.label = label
+        self.factory = factory
+        self.batch_size = batch_size   # righe per chiamata; None = tutto il dataset in una volta
+        self.description = description
+
+
+_REGISTRY = {}
+
+
+def register(name, field, label, batch_size=None):
+    """Decorator: registers factory(rate) -> compress_many(texts, spans)."""
+    def decorator(factory):
+        if name in _REGISTRY:
+            raise ValueError(f"Compressor '{name}' already registered")
+        _REGISTRY[name] = CompressorSpec(name, field, label, factory, batch_size,
+                                         (factory.__doc__ or "").strip())
+        return factory
+    return decorator
+
+
+def get(name):
+    try:
+        return _REGISTRY[name]
+    except KeyError:
+        raise ValueError(f"Unknown compressor '{name}' (registered: {', '.join(_REGISTRY)})") from None
+
+
+def names():
+    return list(_REGISTRY)
+
+
+def evaluation_methods(include_original=True):
+    """(label, field) pairs for the evaluators, in registration order."""
+    methods = [(spec.label, spec.field) for spec in _REGISTRY.values()]
+    return [ORIGINAL] + methods if include_original else methods
+
+# ==========================================
+# BUILT-IN COMPRESSORS
+# ==========================================
+@register('rule_based', field='question_rulebased', label='RuleBased')
+def _rule_based(rate):
+    """Stopword-category removal (rule_based.py); rate is ignored."""
+    from rule_based import rule_based_compress
+    return lambda texts, spans: [rule_based_compress(t, s) for t, s in zip(texts, spans)]
+
+
+@register('rule_numeric', field='question_rulebased_numeric', label='RuleNumeric')
+def _rule_numeric(rate):
+    """Numeric-aware rule tier with the POS lexicon (rule_based_numeric.py); rate is ignored."""
+    from rule_based_numeric import numeric_rule_compress
+    return lambda texts, spans: [numeric_rule_compress(t, s) for t, s in zip(texts, spans)]
+
+
+@register('linguistic', field='question_linguistic', label='Linguistic')
+def _linguistic(rate):
+    """spaCy tagger, whole dataset in one nlp.pipe with a demonstration Doc cache; rate is ignored."""
+    from linguistic_compress import LinguisticCompressor
+    return LinguisticCompressor().compress_many
+
+
+@register('llmlingua2', field='question_llmlingua2', label='LLMLingua2', batch_size=1)
+def _llmlingua2(rate):
+    """LLMLingua-2 compress_prompt, one prompt per call; protected spans are not sent to the model."""
+    from compressor_models import load_llmlingua2
+    compressor = load_llmlingua2()
+
+    def compress_one(text, spans):
+        return compress_unprotected(text, spans, lambda segments: [
+            compressor.compress_prompt(s, rate=rate, force_tokens=DEFAULT_FORCE_TOKENS)['compressed_prompt']
+            for s in segments
+        ])
+    return lambda texts, spans: [compress_one(t, s) for t, s in zip(texts, spans)]
+
+
+@register('llmlingua1', field='question_llmlingua1', label='LLMLingua1', batch_size=1)
+def _llmlingua1(rate):
+    """LLMLingua-1 token-level filter with the small causal LM, one prompt per call."""
+    from compressor_models import compress_llmlingua1, load_llmlingua1
+    compressor = load_llmlingua1()
+    return lambda texts, spans: [compress_llmlingua1(compressor, t, rate, s) for t, s in zip(texts, spans)]
+
+
+@register('llmlingua1_kv', field='question_llmlingua1_kv', label='LLMLingua1KV')
+def _llmlingua1_kv(rate):
+    """LLMLingua-1-style word filter, whole dataset in padded batches with KV reuse (perplexity_compress.py)."""
+    from perplexity_compress import PerplexityCompressor
+    compressor = PerplexityCompressor.load()
+    return lambda texts, spans: compressor.compress_many(texts, rate, DEFAULT_FORCE_TOKENS, spans)
+
+
+@register('llmlingua1_cached', field='question_llmlingua1_cached', label='LLMLingua1Cached')
+def _llmlingua1_cached(rate):
+    """Small-LM word filter on per-demonstration NLL profiles cached on disk (profile_cache.py)."""
+    from profile_cache import CachedPerplexityCompressor
+    compressor = CachedPerplexityCompressor.load()
+    return lambda texts, spans: compressor.compress_many(texts, rate, DEFAULT_FORCE_TOKENS, spans)
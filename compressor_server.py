@@ -0,0 +1,303 @@
+"""
+Resident compression service: keeps LLMLingua-2 (and optionally LLMLingua-1)
+warm and batches concurrent requests from different clients.
+
+LLMLingua-2 requests go through a batching queue: requests that arrive within
+MAX_WAIT_MS of each other (up to MAX_BATCH_PROMPTS prompts) share the same
+classifier forward passes, while rate and force_tokens stay per request.
+LLMLingua-1 requests are served one at a time under a lock.
+
+Start it (HTTP or Unix socket):
+    python compressor_server.py --port 8766
+    python compressor_server.py --unix /tmp/compressor.sock --models llmlingua2,llmlingua1
+
+API:
+    POST /compress {"prompts": [...], "method": "llmlingua2", "rate": 0.5, "force_tokens": [...]}
+        -> {"compressed": [...], "batch_size": n, "elapsed_s": t}
+    GET  /health   -> loaded models
+    GET  /stats    -> request / batch counters
+
+From Python (scripts use this via --server):
+    client = CompressorClient("http://127.0.0.1:8766")   # or "unix:///tmp/compressor.sock"
+    client.compress(["..."], rate=0.3)
+"""
+import argparse
+import http.client
+import json
+import os
+import queue
+import socket
+import socketserver
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from compressor_models import (BACKENDS, DEFAULT_FORCE_TOKENS, LLMLINGUA1_MODEL, LLMLINGUA2_MODEL, Llmlingua2Scorer,
+                               apply_keep, compress_llmlingua1, load_llmlingua1, select_keep)
+
+# ==========================================
+# CONFIGURATION
+# ==========================================
+DEFAULT_PORT = 8766
+MAX_BATCH_PROMPTS = 64
+MAX_WAIT_MS = 10
+DEFAULT_RATE = 0.5
+CLIENT_CHUNK = 32   # prompts per request inviati dal client
+REQUEST_TIMEOUT_S = 300  # attesa massima di una richiesta in coda al batcher
+
+
+class _Job:
+    def __init__(self, texts, rate, force_tokens):
+        self.word_lists = [t.split() for t in texts]
+        self.rate = rate
+        self.force_tokens = force_tokens
+        self.future = Future()
+
+
+class BatchingCompressor:
+    """Collects LLMLingua-2 jobs from many threads and scores them together."""
+
+    def __init__(self, scorer, max_batch=MAX_BATCH_PROMPTS, max_wait_ms=MAX_WAIT_MS):
+        self.scorer = scorer
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self.queue = queue.Queue()
+        self.stats = {'requests': 0, 'prompts': 0, 'batches': 0, 'busy_s': 0.0}
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+        self._thread.start()
+
+    def submit(self, texts, rate=DEFAULT_RATE, force_tokens=DEFAULT_FORCE_TOKENS):
+        job = _Job(texts, rate, force_tokens)
+        self.queue.put(job)
+        return job.future
+
+    def _loop(self):
+        while True:
+            batch = [self.queue.get()]
+            n_prompts = len(batch[0].word_lists)
+            deadline = time.perf_counter() + self.max_wait
+            while n_prompts < self.max_batch:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                try:
+                    job = self.queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                batch.append(job)
+                n_prompts += len(job.word_lists)
+            self._run(batch, n_prompts)
+
+    def _run(self, batch, n_prompts):
+        start = time.perf_counter()
+        try:
+            word_lists = [words for job in batch for words in job.word_lists]
+            scores = self.scorer.score_words(word_lists)
+        except Exception as e:
+            for job in batch:
+                job.future.set_exception(e)
+            return
+        offset = 0
+        for job in batch:
+            job_scores = scores[offset:offset + len(job.word_lists)]
+            offset += len(job.word_lists)
+            # Un job malformato fallisce da solo: il thread del batcher deve sopravvivere
+            try:
+                out = [apply_keep(words, select_keep(words, probs, job.rate, job.force_tokens))
+                       for words, probs in zip(job.word_lists, job_scores)]
+            except Exception as e:
+                job.future.set_exception(e)
+                continue
+            job.future.set_result((out, n_prompts))
+        self.stats['requests'] += len(batch)
+        self.stats['prompts'] += n_prompts
+        self.stats['batches'] += 1
+        self.stats['busy_s'] += time.perf_counter() - start
+
+
+class ModelPool:
+    """The warm models, loaded once at startup."""
+
+    def __init__(self, methods, llmlingua2_model=LLMLINGUA2_MODEL, llmlingua1_model=LLMLINGUA1_MODEL, device=None,
+                 backend='torch'):
+        self.batcher = None
+        self.llmlingua1 = None
+        self.llmlingua1_lock = threading.Lock()
+        if 'llmlingua2' in methods:
+            print(f"Loading LLMLingua-2: {llmlingua2_model} (backend: {backend})")
+            self.batcher = BatchingCompressor(Llmlingua2Scorer.load(llmlingua2_model, device, backend))
+        if 'llmlingua1' in methods:
+            print(f"Loading LLMLingua-1: {llmlingua1_model}")
+            self.llmlingua1 = load_llmlingua1(llmlingua1_model)
+
+    def methods(self):
+        return [name for name, obj in (('llmlingua2', self.batcher), ('llmlingua1', self.llmlingua1)) if obj]
+
+    def compress(self, texts, method, rate, force_tokens, timeout=REQUEST_TIMEOUT_S):
+        if method == 'llmlingua2' and self.batcher is not None:
+            return self.batcher.submit(texts, rate, force_tokens).result(timeout=timeout)
+        if method == 'llmlingua1' and self.llmlingua1 is not None:
+            with self.llmlingua1_lock:
+                return [compress_llmlingua1(self.llmlingua1, t, rate) for t in texts], len(texts)
+        raise ValueError(f"Method '{method}' not loaded (available: {self.methods()})")
+
+
+def _check_strings(name, value):
+    if not isinstance(value, list) or not all(isinstance(v, str) for v in value):
+        raise ValueError(f"'{name}' must be a list of strings")
+
+
+class CompressionHandler(BaseHTTPRequestHandler):
+    server_version = "CompressorServer/1.0"
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        pool = self.server.pool
+        if self.path == '/health':
+            self._send_json(200, {'status': 'ok', 'methods': pool.methods()})
+        elif self.path == '/stats':
+            self._send_json(200, pool.batcher.stats if pool.batcher else {})
+        else:
+            self._send_json(404, {'error': f'Unknown path {self.path}'})
+
+    def do_POST(self):
+        if self.path != '/compress':
+            self._send_json(404, {'error': f'Unknown path {self.path}'})
+            return
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            payload = json.loads(self.rfile.read(length) or b'{}')
+            texts = payload.get('prompts')
+            if texts is None:
+                texts = [payload.get('prompt', '')]
+            force_tokens = payload.get('force_tokens', DEFAULT_FORCE_TOKENS)
+            _check_strings('prompts', texts)
+            _check_strings('force_tokens', force_tokens)
+            start = time.perf_counter()
+            compressed, batch_size = self.server.pool.compress(
+                texts,
+                payload.get('method', 'llmlingua2'),
+                float(payload.get('rate', DEFAULT_RATE)),
+                force_tokens
+            )
+        except (ValueError, TypeError, json.JSONDecodeError) as e:
+            self._send_json(400, {'error': str(e)})
+            return
+        except FutureTimeout:
+            self._send_json(504, {'error': f'Compression not done within {REQUEST_TIMEOUT_S}s'})
+            return
+        except Exception as e:
+            self._send_json(500, {'error': str(e)})
+            return
+        self._send_json(200, {'compressed': compressed, 'batch_size': batch_size,
+                              'elapsed_s': time.perf_counter() - start})
+
+    def _send_json(self, status, obj):
+        body = json.dumps(obj, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class ThreadingUnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def get_request(self):
+        request, _ = super().get_request()
+        return request, ('unix', 0)  # BaseHTTPRequestHandler si aspetta (host, port)
+
+# ==========================================
+# CLIENT
+# ==========================================
+class _UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, path, timeout=None):
+        super().__init__('localhost', timeout=timeout)
+        self.unix_path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(self.unix_path)
+
+
+class CompressorClient:
+    """Thin client for the compression server (http://host:port or unix:///path)."""
+
+    def __init__(self, url, timeout=600):
+        self.url = url
+        self.timeout = timeout
+
+    def _connection(self):
+        if self.url.startswith('unix://'):
+            return _UnixHTTPConnection(self.url[len('unix://'):], timeout=self.timeout)
+        host = self.url.split('://', 1)[-1].rstrip('/')
+        return http.client.HTTPConnection(host, timeout=self.timeout)
+
+    def _request(self, method, path, payload=None):
+        conn = self._connection()
+        try:
+            body = json.dumps(payload).encode('utf-8') if payload is not None else None
+            conn.request(method, path, body=body, headers={'Content-Type': 'application/json'})
+            response = conn.getresponse()
+            data = json.loads(response.read() or b'{}')
+        finally:
+            conn.close()
+        if response.status != 200:
+            raise RuntimeError(f"Compressor server error {response.status}: {data.get('error')}")
+        return data
+
+    def health(self):
+        return self._request('GET', '/health')
+
+    def compress(self, prompts, method='llmlingua2', rate=DEFAULT_RATE, force_tokens=None):
+        out = []
+        for i in range(0, len(prompts), CLIENT_CHUNK):
+            payload = {'prompts': prompts[i:i + CLIENT_CHUNK], 'method': method, 'rate': rate}
+            if force_tokens is not None:
+                payload['force_tokens'] = force_tokens
+            out.extend(self._request('POST', '/compress', payload)['compressed'])
+        return out
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Resident LLMLingua compression server.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--unix", default=None, help="listen on a Unix socket instead of TCP")
+    parser.add_argument("--models", default="llmlingua2", help="comma-separated: llmlingua2,llmlingua1")
+    parser.add_argument("--llmlingua2-model", default=LLMLINGUA2_MODEL)
+    parser.add_argument("--llmlingua1-model", default=LLMLINGUA1_MODEL)
+    parser.add_argument("--device", default=None)
+    parser.add_argument("--backend", choices=BACKENDS, default="torch", help="LLMLingua-2 classifier backend")
+    args = parser.parse_args()
+
+    pool = ModelPool(args.models.split(','), args.llmlingua2_model, args.llmlingua1_model, args.device, args.backend)
+
+    if args.unix:
+        if os.path.exists(args.unix):
+            os.unlink(args.unix)
+        server = ThreadingUnixHTTPServer(args.unix, CompressionHandler)
+        where = f"unix://{args.unix}"
+    else:
+        server = ThreadingHTTPServer((args.host, args.port), CompressionHandler)
+        server.daemon_threads = True
+        where = f"http://{args.host}:{args.port}"
+    server.pool = pool
+    print(f"Compressor server ready on {where} (methods: {', '.join(pool.methods())})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if args.unix and os.path.exists(args.unix):
+            os.unlink(args.unix)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,13 @@
+import argparse
 import json
-import re
-import sys
-import torch
-import gc
-from llmlingua import PromptCompressor
+from compressor_models import clean_memory, load_llmlingua2
+from profiling import span, start_profiling, finish_profiling, instrument_compressor
+from protected_spans import compress_unprotected, row_text_and_spans
+from rule_based import rule_based_compress
+from rule_based_numeric import numeric_rule_compress
+
+# torch / llmlingua sono importati solo quando serve LLMLingua-2 (vedi compressor_models),
+# così le esecuzioni --rule-only partono senza pagare secondi di import.
 
 # ==========================================
 # CONFIGURATION
@@ -17,56 +21,53 @@ OUTPUT_FILE = "datasets/gsm8k_compressed.json"
 TARGET_RATE = 0.5
 
 # ==========================================
-# RULE-BASED LOGIC
+# LLMLINGUA-2
 # ==========================================
-ARTICLES = {'a', 'an', 'the'}
-CONJUNCTIONS = {'and', 'but', 'or', 'so', 'yet', 'for', 'nor'}
-PREPOSITIONS = {
-    'in', 'on', 'at', 'to', 'from', 'with', 'by', 'about', 'as', 'into',
-    'like', 'through', 'after', 'over', 'between', 'out', 'against',
-    'during', 'without', 'before', 'under', 'around', 'among', 'of',
-    'per', 'within', 'upon', 'beneath', 'beside', 'beyond', 'off',
-    'above', 'below', 'near', 'behind', 'across', 'along', 'toward',
-    'towards', 'throughout', 'until', 'since'
-}
-ADVERBS = {
-    'very', 'really', 'quite', 'just', 'only', 'also', 'too', 'much',
-    'most', 'more', 'well', 'even', 'however', 'then', 'now', 'every',
-    'daily', 'always', 'never', 'often', 'sometimes', 'usually', 'rarely',
-    'frequently', 'seldom', 'hardly', 'barely', 'nearly', 'almost',
-    'extremely', 'completely', 'totally', 'absolutely', 'quite', 'rather',
-    'fairly', 'pretty', 'enough', 'still', 'yet', 'already'
-}
-PRONOUNS = {
-    'i', 'you', 'he', 'she', 'it', 'we', 'they', 'me', 'him', 'her',
-    'us', 'them', 'my', 'your', 'his', 'her', 'its', 'our', 'their',
-    'mine', 'yours', 'hers', 'ours', 'theirs', 'myself', 'yourself',
-    'himself', 'herself', 'itself', 'ourselves', 'yourselves', 'themselves'
-}
-REMOVE_WORDS = ARTICLES | CONJUNCTIONS | PREPOSITIONS | ADVERBS | PRONOUNS
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Rule-based + LLMLingua-2 compression of the formatted dataset.")
+    parser.add_argument("--rule-only", action="store_true", help="skip LLMLingua-2 (no torch/llmlingua import)")
+    return parser.parse_args(argv)
 
-def rule_based_compress(text):
-    tokens = text.split()
-    # Keep token if it's NOT in the remove list (normalized) or if it's empty
-    compressed_tokens = [t for t in tokens if re.sub(r'[^\w]', '', t.lower()) not in REMOVE_WORDS or t == '']
-    compressed = ' '.join(compressed_tokens)
-    return re.sub(r'\s+', ' ', compressed).strip()
+def run_llmlingua2(data):
+    print("\n[2/2] Loading LLMLingua-2 (Microsoft BERT)...")
+    clean_memory()
+    
+    with span("model_load"):
+        compressor_v2 = load_llmlingua2()
+    instrument_compressor(compressor_v2)
+    
+    print("      Compressing with LLMLingua-2...")
+    for i, entry in enumerate(data):
+        if 'question_original' in entry:
+            # Protected spans (the target question) are not sent to the model at all
+            entry['question_llmlingua2'] = compress_unprotected(
+                entry['question_original'],
+                entry.get('protected_spans'),
+                lambda segments, c=compressor_v2: [
+                    c.compress_prompt(s, rate=TARGET_RATE, force_tokens=['?', '.', '='])['compressed_prompt']
+                    for s in segments
+                ]
+            )
+        
+        if i % 10 == 0: print(f"      Done {i}/{len(data)}")
 
-def clean_memory():
-    gc.collect()
-    torch.cuda.empty_cache()
+    del compressor_v2
+    clean_memory()
 
 # ==========================================
 # MAIN PROCESSING
 # ==========================================
 
-def main():
+def main(argv=None):
+    args = parse_args(argv)
+    start_profiling("cut_prompt_llmlingua2")
     print(f"--- Reading {INPUT_FILE} ---")
     try:
-        with open(INPUT_FILE, 'r', encoding='utf-8') as f:
+        with span("json_load"), open(INPUT_FILE, 'r', encoding='utf-8') as f:
             data = json.load(f)
     except Exception as e:
         print(f"Error reading file: {e}")
+        finish_profiling()
         return
 
     # Limit to 50 for testing purposes (remove this line to process all)
@@ -83,42 +84,31 @@ def main():
         
         # Now use 'question_original' as the base
         if 'question_original' in entry:
-            entry['question_rulebased'] = rule_based_compress(entry['question_original'])
+            # Offsets from merge_prompt.py or <protect> markup: the target question stays verbatim
+            text, spans = row_text_and_spans(entry, 'question_original')
+            entry['question_original'] = text
+            if spans:
+                entry['protected_spans'] = [list(pair) for pair in spans]
+            entry['question_rulebased'] = rule_based_compress(text, spans)
+            # Second tier: keeps numerals, units and quantity modifiers (more, only, per, every...)
+            entry['question_rulebased_numeric'] = numeric_rule_compress(text, spans)
             # Initialize the field for the next step
-            entry['question_llmlingua2'] = ""
+            # (setdefault: with --rule-only we keep an existing LLMLingua-2 result)
+            entry.setdefault('question_llmlingua2', "")
         else:
             print("Warning: Found entry without a question!")
 
     # 2. EXECUTE LLMLINGUA-2 (BERT-based, fast)
-    print("\n[2/2] Loading LLMLingua-2 (Microsoft BERT)...")
-    clean_memory()
-    
-    compressor_v2 = PromptCompressor(
-        model_name="microsoft/llmlingua-2-bert-base-multilingual-cased-meetingbank",
-        use_llmlingua2=True,
-        device_map="cuda" if torch.cuda.is_available() else "cpu"
-    )
-    
-    print("      Compressing with LLMLingua-2...")
-    for i, entry in enumerate(data):
-        if 'question_original' in entry:
-            result = compressor_v2.compress_prompt(
-                entry['question_original'], 
-                rate=TARGET_RATE, 
-                force_tokens=['?', '.', '=']
-            )
-            # Write directly into the original list (in-place modification)
-            entry['question_llmlingua2'] = result['compressed_prompt']
-        
-        if i % 10 == 0: print(f"      Done {i}/{len(data)}")
-
-    del compressor_v2
-    clean_memory()
+    if args.rule_only:
+        print("\n[2/2] Skipping LLMLingua-2 (--rule-only)")
+    else:
+        run_llmlingua2(data)
 
     print(f"\nSaving clean dataset to {OUTPUT_FILE}...")
-    with open(OUTPUT_FILE, 'w', encoding='utf-8') as f:
+    with span("json_dump"), open(OUTPUT_FILE, 'w', encoding='utf-8') as f:
         json.dump(data, f, indent=4, ensure_ascii=False)
     print("Done! You can now run the evaluation script.")
+    finish_profiling()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
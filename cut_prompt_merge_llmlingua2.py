@@ -1,9 +1,14 @@
+import argparse
 import json
-import re
-import sys
-import torch
-import gc
-from llmlingua import PromptCompressor
+from compact_dataset import load_rows
+from compressor_models import BACKENDS, DEFAULT_FORCE_TOKENS, clean_memory, load_llmlingua2
+from profiling import span, start_profiling, finish_profiling, instrument_compressor
+from protected_spans import row_text_and_spans
+from rule_based import rule_based_compress
+from rule_based_numeric import numeric_rule_compress
+
+# torch / llmlingua sono importati solo quando serve LLMLingua-2 (vedi compressor_models),
+# così le esecuzioni --rule-only partono senza pagare secondi di import.
 
 # ==========================================
 # CONFIGURATION
@@ -15,57 +20,213 @@ OUTPUT_FILE = "datasets/gsm8k_compressed0.1.json"
 # rate=0.5 significa "tieni il 50% dei token del contesto"
 TARGET_RATE = 0.1
 
+# MODIFICA: Aggiunti numeri e operatori matematici essenziali
+FORCE_TOKENS = DEFAULT_FORCE_TOKENS
+
+# Chunked: contesti divisi alle dimostrazioni (###) e compressi in batch con un
+# unico rate globale (compressor_models.compress_chunked), per contesti oltre
+# la finestra di 512 token del classificatore. Attivabile anche con --chunked.
+CHUNKED = False
+CHUNKED_ROWS = 16   # righe per chiamata batched
+
+# Filtro grossolano (coarse_filter.py): frazione di dimostrazioni tenute, le più
+# pertinenti a target_only, prima del modello token-level. None = disattivato.
+COARSE_KEEP = None
+
 # ==========================================
-# RULE-BASED LOGIC (ORIGINALE - NON MODIFICATA)
+# LLMLINGUA-2
 # ==========================================
-ARTICLES = {'a', 'an', 'the'}
-CONJUNCTIONS = {'and', 'but', 'or', 'so', 'yet', 'for', 'nor'}
-PREPOSITIONS = {
-    'in', 'on', 'at', 'to', 'from', 'with', 'by', 'about', 'as', 'into',
-    'like', 'through', 'after', 'over', 'between', 'out', 'against',
-    'during', 'without', 'before', 'under', 'around', 'among', 'of',
-    'per', 'within', 'upon', 'beneath', 'beside', 'beyond', 'off',
-    'above', 'below', 'near', 'behind', 'across', 'along', 'toward',
-    'towards', 'throughout', 'until', 'since'
-}
-ADVERBS = {
-    'very', 'really', 'quite', 'just', 'only', 'also', 'too', 'much',
-    'most', 'more', 'well', 'even', 'however', 'then', 'now', 'every',
-    'daily', 'always', 'never', 'often', 'sometimes', 'usually', 'rarely',
-    'frequently', 'seldom', 'hardly', 'barely', 'nearly', 'almost',
-    'extremely', 'completely', 'totally', 'absolutely', 'quite', 'rather',
-    'fairly', 'pretty', 'enough', 'still', 'yet', 'already'
-}
-PRONOUNS = {
-    'i', 'you', 'he', 'she', 'it', 'we', 'they', 'me', 'him', 'her',
-    'us', 'them', 'my', 'your', 'his', 'her', 'its', 'our', 'their',
-    'mine', 'yours', 'hers', 'ours', 'theirs', 'myself', 'yourself',
-    'himself', 'herself', 'itself', 'ourselves', 'yourselves', 'themselves'
-}
-REMOVE_WORDS = ARTICLES | CONJUNCTIONS | PREPOSITIONS | ADVERBS | PRONOUNS
-
-def rule_based_compress(text):
-    tokens = text.split()
-    # Keep token if it's NOT in the remove list (normalized) or if it's empty
-    compressed_tokens = [t for t in tokens if re.sub(r'[^\w]', '', t.lower()) not in REMOVE_WORDS or t == '']
-    compressed = ' '.join(compressed_tokens)
-    return re.sub(r'\s+', ' ', compressed).strip()
-
-def clean_memory():
-    gc.collect()
-    torch.cuda.empty_cache()
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Rule-based + LLMLingua-2 compression of the formatted dataset.")
+    parser.add_argument("--rule-only", action="store_true", help="skip LLMLingua-2 (no torch/llmlingua import)")
+    parser.add_argument("--server", default=None,
+                        help="use a running compressor_server.py (http://host:port or unix:///path) instead of loading the model")
+    parser.add_argument("--backend", choices=BACKENDS, default="torch",
+                        help="classifier backend: int8 / onnx run on CPU (see quantize_llmlingua2.py)")
+    parser.add_argument("--linguistic", action="store_true",
+                        help="also write question_linguistic with the spaCy compressor (linguistic_compress.py)")
+    parser.add_argument("--spacy-processes", type=int, default=1, help="n_process for nlp.pipe")
+    parser.add_argument("--chunked", action="store_true", default=CHUNKED,
+                        help="split contexts at ### / sentences and compress the chunks as one batch")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="compress in N processes, one model each (see shard_compress.py --tune)")
+    parser.add_argument("--threads", type=int, default=None,
+                        help="torch threads per worker (default: cores / workers)")
+    parser.add_argument("--shared-weights", action="store_true",
+                        help="workers memory-map one copy of the weights instead of loading one each")
+    parser.add_argument("--coarse", type=float, default=COARSE_KEEP, metavar="KEEP",
+                        help="keep only this fraction of demonstrations (BM25 vs target) before LLMLingua-2")
+    return parser.parse_args(argv)
+
+def compress_entry(compressor, entry, coarse_keep=None):
+    """
+    LLMLingua-2 prompt for one row: contesto compresso + domanda target intatta.
+    coarse_keep: filtro grossolano delle dimostrazioni prima del modello (coarse_filter.py).
+    Solleva l'eccezione di compress_prompt (il chiamante decide il fallback).
+    """
+    # A. Recupero Context e Target
+    # Cerchiamo i campi separati creati dallo script di formattazione.
+    # Se non esistono, usiamo 'question_original' come fallback per il contesto.
+    context_text = entry.get('context_only', entry.get('question_original', ''))
+    target_text = entry.get('target_only', '') # Questo resta vuoto se non c'è il campo, ed è ok.
+    rate = TARGET_RATE
+    if coarse_keep and context_text:
+        from coarse_filter import coarse_filter
+        (context_text,), rate = coarse_filter([context_text], [target_text], coarse_keep, TARGET_RATE)
+
+    # B. Compressione Intelligente
+    # Comprimiamo SOLO il contesto (gli esempi few-shot)
+    if context_text:
+        result = compressor.compress_prompt(
+            context_text, 
+            rate=rate, 
+            force_tokens=FORCE_TOKENS
+        )
+        compressed_context = result['compressed_prompt']
+    else:
+        compressed_context = ""
+
+    # C. Ricostruzione
+    # Il prompt finale è: Contesto Compresso + Domanda Target Intatta
+    # Se target_text era vuoto, il risultato sarà solo il contesto compresso (comportamento fallback)
+    return f"{compressed_context}\n{target_text}".strip()
+
+def run_linguistic(data, texts, spans, n_process=1):
+    """question_linguistic: spaCy (solo tagger) su tutto il dataset in un'unica pipe, dimostrazioni in cache."""
+    from linguistic_compress import LinguisticCompressor
+
+    print("\n      Running spaCy linguistic compression...")
+    with span("spacy_load"):
+        compressor = LinguisticCompressor(n_process=n_process)
+    with span("linguistic_compress"):
+        compressed = compressor.compress_many(texts, spans)
+    for entry, text in zip(data, compressed):
+        entry['question_linguistic'] = text
+    stats = compressor.stats
+    print(f"      {stats['pieces']} pieces, {stats['analysed']} analysed, {stats['cache_hits']} from cache")
+
+def run_llmlingua2(data, backend='torch', coarse_keep=None):
+    print("\n[2/2] Loading LLMLingua-2 (Microsoft BERT)...")
+    clean_memory()
+    
+    # Usiamo il modello specifico addestrato su MeetingBank
+    with span("model_load"):
+        compressor_v2 = load_llmlingua2(backend=backend)
+    instrument_compressor(compressor_v2)
+    
+    print(f"      Compressing with LLMLingua-2 (Rate: {TARGET_RATE})...")
+    
+    for i, entry in enumerate(data):
+        try:
+            entry['question_llmlingua2'] = compress_entry(compressor_v2, entry, coarse_keep)
+        except Exception as e:
+            print(f"Error on row {i}: {e}")
+            entry['question_llmlingua2'] = entry.get('question_original', '')
+
+        if i % 10 == 0: 
+            print(f"      Done {i}/{len(data)}")
+
+    del compressor_v2
+    clean_memory()
+
+def run_llmlingua2_chunked(data, backend='torch', coarse_keep=None):
+    """
+    Come run_llmlingua2, ma i contesti sono divisi in chunk che stanno nella
+    finestra del classificatore e valutati in batch, CHUNKED_ROWS righe alla volta.
+    Seleziona a livello di parola (come il server, vedi run_llmlingua2_remote):
+    l'output non coincide con compress_prompt.
+    """
+    from coarse_filter import coarse_filter
+    from compressor_models import Llmlingua2Scorer, compress_chunked
+
+    print("\n[2/2] Loading LLMLingua-2 (Microsoft BERT)...")
+    clean_memory()
+    with span("model_load"):
+        scorer = Llmlingua2Scorer.from_compressor(load_llmlingua2(backend=backend))
+
+    print(f"      Compressing chunked contexts with LLMLingua-2 (Rate: {TARGET_RATE})...")
+    for start in range(0, len(data), CHUNKED_ROWS):
+        rows = data[start:start + CHUNKED_ROWS]
+        contexts = [entry.get('context_only', entry.get('question_original', '')) for entry in rows]
+        inputs, rate = contexts, TARGET_RATE
+        if coarse_keep:
+            with span("coarse_filter"):
+                inputs, rate = coarse_filter(contexts, [e.get('target_only', '') for e in rows], coarse_keep, TARGET_RATE)
+        try:
+            with span("chunked_compress"):
+                compressed = compress_chunked(scorer, inputs, rate, FORCE_TOKENS)
+        except Exception as e:
+            print(f"Error on rows {start}-{start + len(rows) - 1}: {e}")
+            compressed = None
+        for i, (entry, context_text) in enumerate(zip(rows, contexts)):
+            if compressed is None:
+                entry['question_llmlingua2'] = entry.get('question_original', '')
+                continue
+            target_text = entry.get('target_only', '')
+            entry['question_llmlingua2'] = f"{compressed[i] if context_text else ''}\n{target_text}".strip()
+        print(f"      Done {start + len(rows)}/{len(data)}")
+
+    del scorer
+    clean_memory()
+
+def run_llmlingua2_sharded(data, workers, threads=None, backend='torch', shared_weights=False, coarse_keep=None):
+    """Stessa logica di run_llmlingua2, con le righe distribuite su `workers` processi."""
+    from shard_compress import available_cores, compress_sharded, start_pool
+
+    threads = threads or max(1, available_cores() // workers)
+    print(f"\n[2/2] Compressing with LLMLingua-2 on {workers} workers x {threads} threads (Rate: {TARGET_RATE})...")
+    pool = start_pool(workers, threads, backend=backend, shared_weights=shared_weights)
+    try:
+        with span("sharded_compress"):
+            for i, final_prompt, error in compress_sharded(pool, data, coarse_keep):
+                if error:
+                    print(f"Error on row {i}: {error}")
+                    final_prompt = data[i].get('question_original', '')
+                data[i]['question_llmlingua2'] = final_prompt
+                if i % 10 == 0:
+                    print(f"      Done {i}/{len(data)}")
+    finally:
+        pool.close()
+        pool.join()
+
+def run_llmlingua2_remote(data, server_url, coarse_keep=None):
+    """
+    Stessa logica di run_llmlingua2, ma il modello resta caldo nel compressor server.
+    Nota: il server seleziona parole intere (compressor_models.select_keep), non
+    token come compress_prompt: l'output non coincide. Sono forzate solo le parole
+    fatte di force token (numeri, operatori) e contano nel rate; compress_prompt
+    invece può tenere il solo "." di "apples.". Se le parole forzate superano
+    rate * parole (rate bassi su GSM8K, ricco di numeri), se ne tengono di più.
+    """
+    from compressor_server import CompressorClient
+
+    print(f"\n[2/2] Compressing with LLMLingua-2 via {server_url} (Rate: {TARGET_RATE})...")
+    contexts = [entry.get('context_only', entry.get('question_original', '')) for entry in data]
+    inputs, rate = contexts, TARGET_RATE
+    if coarse_keep:
+        from coarse_filter import coarse_filter
+        with span("coarse_filter"):
+            inputs, rate = coarse_filter(contexts, [e.get('target_only', '') for e in data], coarse_keep, TARGET_RATE)
+    with span("remote_compress"):
+        compressed = CompressorClient(server_url).compress(inputs, rate=rate, force_tokens=FORCE_TOKENS)
+    for entry, context_text, compressed_context in zip(data, contexts, compressed):
+        target_text = entry.get('target_only', '')
+        entry['question_llmlingua2'] = f"{compressed_context if context_text else ''}\n{target_text}".strip()
 
 # ==========================================
 # MAIN PROCESSING
 # ==========================================
 
-def main():
+def main(argv=None):
+    args = parse_args(argv)
+    start_profiling("cut_prompt_merge_llmlingua2")
     print(f"--- Reading {INPUT_FILE} ---")
     try:
-        with open(INPUT_FILE, 'r', encoding='utf-8') as f:
-            data = json.load(f)
+        with span("json_load"):
+            data = load_rows(INPUT_FILE)  # formato classico o compatto (compact_dataset.py)
     except Exception as e:
         print(f"Error reading file: {e}")
+        finish_profiling()
         return
 
     # Scommenta questa riga se vuoi fare un test veloce sui primi 10
@@ -74,80 +235,48 @@ def main():
 
     # 1. EXECUTE RULE-BASED COMPRESSION (UNCHANGED)
     print("\n[1/2] Running Rule-Based Compression...")
+    base_texts, base_spans = [], []
     for entry in data:
         # Se esiste la chiave 'question', la usiamo come base
         # (Nota: se hai usato il mio script precedente, 'question' è il full prompt)
-        base_text = entry.get('question', '')
+        # protected_spans (o markup <protect>) indicano il target da non comprimere
+        base_text, spans = row_text_and_spans(entry)
+        base_texts.append(base_text)
+        base_spans.append(spans)
         
         # Salviamo l'originale se non c'è già una copia
         if 'question_original' not in entry:
             entry['question_original'] = base_text
         
         # Eseguiamo la tua logica
-        entry['question_rulebased'] = rule_based_compress(base_text)
+        entry['question_rulebased'] = rule_based_compress(base_text, spans)
+        # Secondo livello: tiene numeri, unità e modificatori di quantità (more, only, per, every...)
+        entry['question_rulebased_numeric'] = numeric_rule_compress(base_text, spans)
         
         # Prepariamo il campo per il prossimo step
-        entry['question_llmlingua2'] = ""
+        # (setdefault: con --rule-only non cancelliamo un risultato LLMLingua-2 già presente)
+        entry.setdefault('question_llmlingua2', "")
 
-    # 2. EXECUTE LLMLINGUA-2 (MODIFIED SECTION)
-    print("\n[2/2] Loading LLMLingua-2 (Microsoft BERT)...")
-    clean_memory()
-    
-    # Usiamo il modello specifico addestrato su MeetingBank
-    compressor_v2 = PromptCompressor(
-        model_name="microsoft/llmlingua-2-bert-base-multilingual-cased-meetingbank",
-        use_llmlingua2=True,
-        device_map="cuda" if torch.cuda.is_available() else "cpu"
-    )
-    
-    print(f"      Compressing with LLMLingua-2 (Rate: {TARGET_RATE})...")
-    
-    for i, entry in enumerate(data):
-        
-        # A. Recupero Context e Target
-        # Cerchiamo i campi separati creati dallo script di formattazione.
-        # Se non esistono, usiamo 'question_original' come fallback per il contesto.
-        context_text = entry.get('context_only', entry.get('question_original', ''))
-        target_text = entry.get('target_only', '') # Questo resta vuoto se non c'è il campo, ed è ok.
+    if args.linguistic:
+        run_linguistic(data, base_texts, base_spans, args.spacy_processes)
 
-        # B. Compressione Intelligente
-        try:
-            # Comprimiamo SOLO il contesto (gli esempi few-shot)
-            if context_text:
-                result = compressor_v2.compress_prompt(
-                    context_text, 
-                    rate=TARGET_RATE, 
-                    # MODIFICA: Aggiunti numeri e operatori matematici essenziali
-                    force_tokens=[
-                        '?', '.', '=', '+', '-', '*', '/', 
-                        '0', '1', '2', '3', '4', '5', '6', '7', '8', '9'
-                    ]
-                )
-                compressed_context = result['compressed_prompt']
-            else:
-                compressed_context = ""
-
-            # C. Ricostruzione
-            # Il prompt finale è: Contesto Compresso + Domanda Target Intatta
-            # Se target_text era vuoto, il risultato sarà solo il contesto compresso (comportamento fallback)
-            final_prompt = f"{compressed_context}\n{target_text}".strip()
-            
-            entry['question_llmlingua2'] = final_prompt
-            
-        except Exception as e:
-            print(f"Error on row {i}: {e}")
-            entry['question_llmlingua2'] = entry.get('question_original', '')
-
-        if i % 10 == 0: 
-            print(f"      Done {i}/{len(data)}")
-
-    del compressor_v2
-    clean_memory()
+    # 2. EXECUTE LLMLINGUA-2 (MODIFIED SECTION)
+    if args.rule_only:
+        print("\n[2/2] Skipping LLMLingua-2 (--rule-only)")
+    elif args.server:
+        run_llmlingua2_remote(data, args.server, args.coarse)
+    elif args.chunked:
+        run_llmlingua2_chunked(data, args.backend, args.coarse)
+    elif args.workers > 1:
+        run_llmlingua2_sharded(data, args.workers, args.threads, args.backend, args.shared_weights, args.coarse)
+    else:
+        run_llmlingua2(data, args.backend, args.coarse)
 
     print(f"\nSaving processed dataset to {OUTPUT_FILE}...")
-    with open(OUTPUT_FILE, 'w', encoding='utf-8') as f:
+    with span("json_dump"), open(OUTPUT_FILE, 'w', encoding='utf-8') as f:
         json.dump(data, f, indent=4, ensure_ascii=False)
     print("Done! Evaluation ready.")
+    finish_profiling()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -1,7 +1,26 @@
-import os
+"""
+GSM8K extraction to the JSON files used by merge_prompt.py.
+
+Rows never go through per-row dataset[i] lookups: the subset is chosen with
+select()/shuffle() (index mappings, no copy), read back in Arrow batches with
+Dataset.iter() and streamed to the output file one batch at a time.
+
+    python dataset_gsm8k.py                                        # first 50 test problems
+    python dataset_gsm8k.py --num-samples 300 --output gsm8k_test_set_300.json
+    python dataset_gsm8k.py --split train,test --num-samples 0     # full splits
+    python dataset_gsm8k.py --num-samples 300 --sample stratified --seed 42
+    python dataset_gsm8k.py snapshot                               # save a local copy (needs network once)
+    python dataset_gsm8k.py --offline ...                          # use the local copy / HF cache only
+"""
+import argparse
 import json
-from datasets import load_dataset
-from tqdm import tqdm
+import os
+import random
+import sys
+
+from profiling import span, start_profiling, finish_profiling
+
+# `datasets` (pyarrow) is imported only inside the functions that need it.
 
 # --- CONFIGURATION ---
 DATASET_NAME = "gsm8k"
@@ -10,52 +29,181 @@ DATASET_SPLIT = "test"
 # 1. MODIFICATION: Define the output folder
 OUTPUT_DIR = "datasets"
 OUTPUT_FILENAME = "gsm8k_test_set.json"
-NUM_SAMPLES = 50 # Number of samples to extract
+NUM_SAMPLES = 50 # Number of samples to extract (0 or None = whole split)
+SEED = 42
+
+SNAPSHOT_DIR = os.path.join(OUTPUT_DIR, "gsm8k_snapshot")  # DatasetDict.save_to_disk, for offline runs
+BATCH_SIZE = 1000          # rows per Arrow batch when writing
+SAMPLE_MODES = ('head', 'random', 'stratified')
+MAX_STEPS_STRATUM = 8      # stratified: problems with >= 8 solution steps share one stratum
+
+# --- LOADING ---
+
+def load_split(split=DATASET_SPLIT, offline=False, snapshot_dir=SNAPSHOT_DIR):
+    """
+    The requested split(s) as one Dataset; "train,test" concatenates them.
+    offline=True reads the local snapshot if there is one, otherwise only the
+    Hugging Face cache (HF_DATASETS_OFFLINE), never the network.
+    """
+    if offline:
+        os.environ["HF_DATASETS_OFFLINE"] = "1"
+    import datasets
+
+    names = [s.strip() for s in split.split(",") if s.strip()]
+    if offline and os.path.isdir(snapshot_dir):
+        snapshot = datasets.load_from_disk(snapshot_dir)
+        parts = [snapshot[name] for name in names]
+    else:
+        parts = [datasets.load_dataset(DATASET_NAME, DATASET_CONFIG, split=name) for name in names]
+    return parts[0] if len(parts) == 1 else datasets.concatenate_datasets(parts)
+
+
+def save_snapshot(snapshot_dir=SNAPSHOT_DIR):
+    """Downloads every split once and saves it as Arrow files for --offline."""
+    import datasets
+    dataset = datasets.load_dataset(DATASET_NAME, DATASET_CONFIG)
+    dataset.save_to_disk(snapshot_dir)
+    return {name: len(split) for name, split in dataset.items()}
+
+# --- SUBSETS ---
+
+def solution_steps(answer):
+    """Reasoning lines before the final '#### <number>' line: a cheap difficulty proxy."""
+    return answer.split("####")[0].strip().count("\n") + 1
+
+
+def stratified_indices(strata, num_samples, seed=SEED):
+    """
+    num_samples indices with every stratum represented in proportion to its
+    size (largest remainder), drawn at random inside each stratum; sorted.
+    """
+    groups = {}
+    for i, stratum in enumerate(strata):
+        groups.setdefault(stratum, []).append(i)
+    total = len(strata)
+    quotas = {key: len(members) * num_samples / total for key, members in groups.items()}
+    counts = {key: int(q) for key, q in quotas.items()}
+    leftover = num_samples - sum(counts.values())
+    for key in sorted(quotas, key=lambda k: (counts[k] - quotas[k], k))[:leftover]:
+        counts[key] += 1
+    rng = random.Random(seed)
+    chosen = []
+    for key in sorted(groups):
+        chosen.extend(rng.sample(groups[key], counts[key]))
+    return sorted(chosen)
+
+
+def select_subset(dataset, num_samples=NUM_SAMPLES, sample='head', seed=SEED):
+    """
+    head: the first N rows; random: N rows after a seeded shuffle;
+    stratified: N rows proportional over solution-step counts.
+    Only index mappings are built here, no rows are converted.
+    """
+    if not num_samples or num_samples >= len(dataset):
+        if num_samples and num_samples > len(dataset):
+            print(f"Warning: Using all {len(dataset)} available samples in the split.")
+        return dataset.shuffle(seed=seed) if sample == 'random' else dataset
+    if sample == 'head':
+        return dataset.select(range(num_samples))
+    if sample == 'random':
+        return dataset.shuffle(seed=seed).select(range(num_samples))
+    if sample == 'stratified':
+        # One column converted in bulk, no per-row conversion
+        strata = [min(solution_steps(a), MAX_STEPS_STRATUM) for a in dataset['answer']]
+        return dataset.select(stratified_indices(strata, num_samples, seed))
+    raise ValueError(f"Unknown sample mode '{sample}' ({', '.join(SAMPLE_MODES)})")
+
+# --- SAVING ---
+
+def iter_rows(dataset, batch_size=BATCH_SIZE):
+    """Row dicts, converted from Arrow one batch (all columns at once) at a time."""
+    for batch in dataset.iter(batch_size=batch_size):
+        columns = list(batch)
+        for values in zip(*(batch[c] for c in columns)):
+            yield dict(zip(columns, values))
+
+
+def write_json_rows(rows, path, indent=4, ensure_ascii=True):
+    """
+    Streams rows into a JSON list; the file is byte-identical to
+    json.dump(list(rows), f, indent=indent, ensure_ascii=ensure_ascii) but
+    rows are never all in memory.
+    """
+    pad = "\n" + " " * indent if indent is not None else ""
+    first, sep = ("[" + pad, "," + pad) if indent is not None else ("[", ", ")
+    count = 0
+    with open(path, 'w', encoding='utf-8') as f:
+        for row in rows:
+            f.write((sep if count else first) + json.dumps(row, indent=indent, ensure_ascii=ensure_ascii).replace("\n", pad))
+            count += 1
+        f.write(("\n]" if indent is not None else "]") if count else "[]")
+    return count
 
 # --- MAIN FUNCTION ---
 
-def extract_and_save_dataset(num_samples: int = NUM_SAMPLES, output_dir: str = OUTPUT_DIR, output_file: str = OUTPUT_FILENAME):
+def extract_and_save_dataset(num_samples: int = NUM_SAMPLES, output_dir: str = OUTPUT_DIR, output_file: str = OUTPUT_FILENAME,
+                             split: str = DATASET_SPLIT, sample: str = 'head', seed: int = SEED,
+                             offline: bool = False, batch_size: int = BATCH_SIZE, indent=4):
     """
-    Loads the GSM8K dataset (test split) and saves the first N samples as a JSON file
-    in the specified folder.
+    Loads GSM8K (split, or "train,test") and saves num_samples rows (0 = all)
+    as a JSON file in the specified folder.
     """
-    print(f"Loading dataset {DATASET_NAME} ({DATASET_SPLIT} split)...")
+    print(f"Loading dataset {DATASET_NAME} ({split} split{', offline' if offline else ''})...")
     try:
         # Load the specified dataset
-        dataset = load_dataset(DATASET_NAME, DATASET_CONFIG, split=DATASET_SPLIT)
+        with span("load_dataset"):
+            dataset = load_split(split, offline)
     except Exception as e:
         print(f"Error loading the dataset: {e}")
         return
 
-    # Limit to the specified number of samples or the total available
-    if num_samples > len(dataset):
-        num_samples = len(dataset)
-        print(f"Warning: Using all {num_samples} available samples in the split.")
-    
-    # Convert the first N samples into a list of Python dictionaries
-    data_list = []
-    print(f"Extracting and converting the first {num_samples} samples...")
-    for i in tqdm(range(num_samples)):
-        data_list.append(dataset[i])
-        
+    with span("select_subset"):
+        subset = select_subset(dataset, num_samples, sample, seed)
+    print(f"Extracting {len(subset)} of {len(dataset)} samples ({sample})...")
+
     # 2. MODIFICATION: Create the output folder
     os.makedirs(output_dir, exist_ok=True)
-    
+
     # Create the full file path
     full_output_path = os.path.join(output_dir, output_file)
-        
+
     # --- DATA SAVING ---
     try:
-        # Open the file and write the JSON data
-        with open(full_output_path, 'w', encoding='utf-8') as f:
-            json.dump(data_list, f, indent=4)
-            
+        with span("write_rows"):
+            count = write_json_rows(iter_rows(subset, batch_size), full_output_path, indent)
+
         print(f"\n--- SAVING COMPLETE ---")
         print(f"Data saved to: {os.path.abspath(full_output_path)}")
-        print(f"File contains {len(data_list)} GSM8K samples.")
+        print(f"File contains {count} GSM8K samples.")
     except Exception as e:
         print(f"Error while saving the file: {e}")
 
 
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Extract GSM8K problems to JSON.")
+    parser.add_argument("command", nargs="?", choices=("extract", "snapshot"), default="extract")
+    parser.add_argument("--split", default=DATASET_SPLIT, help='"train", "test" or "train,test"')
+    parser.add_argument("--num-samples", type=int, default=NUM_SAMPLES, help="0 = the whole split")
+    parser.add_argument("--sample", choices=SAMPLE_MODES, default='head')
+    parser.add_argument("--seed", type=int, default=SEED)
+    parser.add_argument("--output-dir", default=OUTPUT_DIR)
+    parser.add_argument("--output", default=OUTPUT_FILENAME)
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--no-indent", action="store_true", help="single-line JSON (smaller, faster)")
+    parser.add_argument("--offline", action="store_true", help=f"no network: {SNAPSHOT_DIR} or the HF cache")
+    args = parser.parse_args(argv)
+
+    start_profiling("dataset_gsm8k")
+    if args.command == "snapshot":
+        with span("save_snapshot"):
+            sizes = save_snapshot()
+        print(f"Snapshot saved to {SNAPSHOT_DIR}: {sizes}")
+    else:
+        extract_and_save_dataset(args.num_samples, args.output_dir, args.output, args.split, args.sample,
+                                 args.seed, args.offline, args.batch_size, None if args.no_indent else 4)
+    finish_profiling()
+    return 0
+
+
 if __name__ == "__main__":
-    extract_and_save_dataset()
\ No newline at end of file
+    sys.exit(main())
@@ -0,0 +1,171 @@
+"""
+Similarity-based demonstration retrieval for merge_prompt.py.
+
+Instead of random.sample, each target question gets the k pool problems whose
+questions are most similar to it (BM25 over word tokens, rule_based stopwords
+removed). The index is a NumPy CSR posting list: a query gathers the postings
+of its terms, sums them per document with np.bincount and takes the top k
+with np.argpartition, so one query over a few thousand problems costs tens of
+microseconds.
+
+Retrieved demonstrations are ordered by increasing similarity, so the most
+relevant one sits right before the target question.
+
+    python merge_prompt.py --retrieval bm25 --shots 4
+    python demo_retrieval.py --input datasets/gsm8k_test_set_300.json --shots 1,2,4,8
+"""
+import argparse
+import json
+import re
+import sys
+import time
+
+from merge_prompt import INPUT_FILE, NUM_SHOTS, SEED, build_context, sample_rows
+from rule_based import REMOVE_WORDS
+
+# ==========================================
+# CONFIGURATION
+# ==========================================
+K1 = 1.5
+B = 0.75
+STOPWORDS = REMOVE_WORDS | {'is', 'are', 'was', 'were', 'be', 'has', 'have', 'had', 'does', 'do', 'did',
+                            'how', 'what', 'many', 'if', 'each', 'will', 'that', 'this', 'there'}
+
+_TOKEN_RE = re.compile(r"[a-z]+|\d+(?:\.\d+)?")
+
+
+def tokenize(text):
+    return [t for t in _TOKEN_RE.findall(text.lower()) if t not in STOPWORDS]
+
+# ==========================================
+# INDEX
+# ==========================================
+class BM25Index:
+    """BM25 over a fixed list of documents; postings stored as CSR NumPy arrays."""
+
+    def __init__(self, documents, k1=K1, b=B):
+        import numpy as np
+        docs = [tokenize(d) for d in documents]
+        self.n_docs = len(docs)
+        self.vocab = {}
+        terms, doc_ids, tfs = [], [], []  # una voce per coppia (termine, documento)
+        for doc_id, tokens in enumerate(docs):
+            counts = {}
+            for token in tokens:
+                counts[token] = counts.get(token, 0) + 1
+            for token, tf in counts.items():
+                terms.append(self.vocab.setdefault(token, len(self.vocab)))
+                doc_ids.append(doc_id)
+                tfs.append(tf)
+
+        terms = np.array(terms, dtype=np.int64)
+        doc_ids = np.array(doc_ids, dtype=np.int32)
+        tfs = np.array(tfs, dtype=np.float32)
+        lengths = np.array([len(t) for t in docs], dtype=np.float32)
+        avgdl = float(lengths.mean()) if len(docs) else 1.0
+        df = np.bincount(terms, minlength=len(self.vocab)).astype(np.float32)
+        idf = np.log(1 + (self.n_docs - df + 0.5) / (df + 0.5))
+        norm = k1 * (1 - b + b * lengths[doc_ids] / max(avgdl, 1.0))
+        weights = idf[terms] * tfs * (k1 + 1) / (tfs + norm)
+
+        # CSR: postings ordinate per termine, offsets[t]:offsets[t + 1] = documenti del termine t
+        order = np.argsort(terms, kind='stable')
+        self.doc_ids = doc_ids[order]
+        self.weights = weights[order].astype(np.float32)
+        self.offsets = np.concatenate(([0], np.cumsum(df, dtype=np.int64)))
+
+    def scores(self, query):
+        """BM25 score of every document for `query` (repeated query terms count once)."""
+        import numpy as np
+        terms = {self.vocab[t] for t in tokenize(query) if t in self.vocab}
+        if not terms:
+            return np.zeros(self.n_docs, dtype=np.float32)
+        slices = [slice(self.offsets[t], self.offsets[t + 1]) for t in terms]
+        ids = np.concatenate([self.doc_ids[s] for s in slices])
+        weights = np.concatenate([self.weights[s] for s in slices])
+        return np.bincount(ids, weights=weights, minlength=self.n_docs)
+
+    def top_k(self, query, k, exclude=()):
+        """
+        Indices of the k best documents, best first; `exclude` (e.g. the target
+        itself) is never returned. Ties go to the lower index.
+        """
+        import numpy as np
+        scores = self.scores(query)
+        if len(exclude):
+            scores[list(exclude)] = -np.inf
+        k = min(k, self.n_docs - len(set(exclude)))
+        if k <= 0:
+            return []
+        if k < self.n_docs:
+            # Tutti i documenti a pari merito con il k-esimo, non quelli scelti da argpartition
+            kth = -np.partition(-scores, k - 1)[k - 1]
+            candidates = np.flatnonzero(scores >= kth)
+        else:
+            candidates = np.arange(self.n_docs)
+        order = np.lexsort((candidates, -scores[candidates]))
+        return candidates[order[:k]].tolist()
+
+
+def retrieve_rows(questions, num_shots=NUM_SHOTS, index=None, start=0, stop=None):
+    """
+    (target index, demo indices) like merge_prompt.sample_rows, with the
+    demonstrations retrieved from the other questions of the same pool.
+    """
+    index = index or BM25Index(questions)
+    stop = len(questions) if stop is None else stop
+    for i in range(start, stop):
+        yield i, index.top_k(questions[i], num_shots, exclude=(i,))[::-1]
+
+# ==========================================
+# BENCHMARK
+# ==========================================
+def _percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))] if values else 0.0
+
+
+def benchmark(input_data, shots=(1, 2, 4, 8), baseline_shots=NUM_SHOTS, seed=SEED):
+    """Index build time, query latency and context tokens vs random baseline_shots demonstrations."""
+    import numpy  # noqa: F401  importato prima: il tempo di build non include l'import
+    from mock_llm_server import count_tokens
+    questions = [item['question'] for item in input_data]
+
+    start = time.perf_counter()
+    index = BM25Index(questions)
+    build_ms = (time.perf_counter() - start) * 1000
+
+    latencies = []
+    for i, q in enumerate(questions):
+        start = time.perf_counter()
+        index.top_k(q, max(shots), exclude=(i,))
+        latencies.append((time.perf_counter() - start) * 1e6)
+
+    def context_tokens(rows):
+        return sum(count_tokens(build_context([input_data[j] for j in demos])) for _, demos in rows) / len(questions)
+
+    baseline = context_tokens(sample_rows(len(questions), baseline_shots, seed))
+    print(f"Pool: {len(questions)} questions, vocab {len(index.vocab)}, postings {len(index.doc_ids)}")
+    print(f"Build: {build_ms:.1f} ms | query p50 {_percentile(latencies, 0.5):.0f} us, "
+          f"p99 {_percentile(latencies, 0.99):.0f} us")
+    print(f"\n{'Selection':<16} {'ctx tokens':>11} {'saved':>8}")
+    print(f"{f'random {baseline_shots}-shot':<16} {baseline:>11.0f} {'-':>8}")
+    for k in shots:
+        tokens = context_tokens(retrieve_rows(questions, k, index))
+        print(f"{f'bm25 {k}-shot':<16} {tokens:>11.0f} {1 - tokens / baseline if baseline else 0.0:>8.1%}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="BM25 demonstration retrieval benchmark.")
+    parser.add_argument("--input", default=INPUT_FILE)
+    parser.add_argument("--shots", default="1,2,4,8")
+    parser.add_argument("--baseline-shots", type=int, default=NUM_SHOTS)
+    args = parser.parse_args(argv)
+    with open(args.input, 'r', encoding='utf-8') as f:
+        input_data = json.load(f)
+    benchmark(input_data, [int(k) for k in args.shots.split(",")], args.baseline_shots)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,269 @@
+"""
+Latency / throughput metrics shared by the evaluation scripts.
+
+Every backend (Groq API, local HF model, mock server) records the same
+observations through a RequestTimer, and EvalMetrics aggregates them as
+histograms per (model, method). The snapshot can be exported as Prometheus
+text format or as JSON.
+
+Per request we separate:
+  - queue_wait_seconds : enqueue -> first attempt dispatched
+  - service_seconds    : duration of the successful attempt
+  - retry_seconds      : failed attempts + backoff sleeps
+  - latency_seconds    : enqueue -> finish (sum of the three above)
+  - ttft_seconds       : attempt start -> first output token (streaming only)
+  - output_tokens_per_second : completion tokens / service time
+"""
+import json
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+# ==========================================
+# HISTOGRAM CONFIGURATION
+# ==========================================
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+THROUGHPUT_BUCKETS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500)
+
+METRIC_DEFS = {
+    'latency_seconds': ("End-to-end request latency (queue + retries + service)", LATENCY_BUCKETS),
+    'service_seconds': ("Duration of the successful attempt", LATENCY_BUCKETS),
+    'queue_wait_seconds': ("Time between enqueue and first dispatch", LATENCY_BUCKETS),
+    'retry_seconds': ("Time spent in failed attempts and backoff", LATENCY_BUCKETS),
+    'ttft_seconds': ("Time to first output token", LATENCY_BUCKETS),
+    'output_tokens_per_second': ("Completion tokens per second of service time", THROUGHPUT_BUCKETS),
+}
+
+PERCENTILES = (50, 95, 99)
+METRIC_PREFIX = "eval"
+
+
+class Histogram:
+    """Cumulative-bucket histogram that also keeps raw values for exact percentiles."""
+
+    def __init__(self, buckets):
+        self.buckets = tuple(buckets)
+        self.bucket_counts = [0] * len(self.buckets)
+        self.count = 0
+        self.sum = 0.0
+        self.values = []
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        self.values.append(value)
+        for idx, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.bucket_counts[idx] += 1
+
+    def percentile(self, q):
+        """Nearest-rank percentile (q in 0..100). Returns None if empty."""
+        if not self.values:
+            return None
+        ordered = sorted(self.values)
+        rank = max(1, math.ceil(q / 100 * len(ordered)))
+        return ordered[rank - 1]
+
+    def snapshot(self):
+        snap = {
+            'count': self.count,
+            'sum': self.sum,
+            'mean': self.sum / self.count if self.count else None,
+            'buckets': {str(b): c for b, c in zip(self.buckets, self.bucket_counts)},
+        }
+        for q in PERCENTILES:
+            snap[f'p{q}'] = self.percentile(q)
+        return snap
+
+
+class EvalMetrics:
+    """Thread-safe registry of histograms keyed by (metric, model, method)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms = {}
+        self._requests = {}  # (model, method, status) -> count
+
+    def observe(self, metric, value, model, method):
+        if value is None:
+            return
+        _, buckets = METRIC_DEFS[metric]
+        with self._lock:
+            key = (metric, model, method)
+            if key not in self._histograms:
+                self._histograms[key] = Histogram(buckets)
+            self._histograms[key].observe(value)
+
+    def count_request(self, model, method, status):
+        with self._lock:
+            key = (model, method, status)
+            self._requests[key] = self._requests.get(key, 0) + 1
+
+    def request(self, model, method, enqueued_at=None):
+        """Starts tracking one logical request (all its attempts)."""
+        return RequestTimer(self, model, method, enqueued_at)
+
+    def histogram(self, metric, model, method):
+        return self._histograms.get((metric, model, method))
+
+    def series(self):
+        """Sorted list of (model, method) pairs that have observations."""
+        with self._lock:
+            return sorted({(model, method) for _, model, method in self._histograms})
+
+    # ------------------------------------------
+    # REPORTING
+    # ------------------------------------------
+    def summary_rows(self):
+        """One flat row per (model, method), handy for printing or pandas."""
+        rows = []
+        for model, method in self.series():
+            row = {'Model': model, 'Method': method}
+            for metric in METRIC_DEFS:
+                hist = self.histogram(metric, model, method)
+                if hist is None:
+                    continue
+                for q in PERCENTILES:
+                    row[f'{metric}_p{q}'] = hist.percentile(q)
+            rows.append(row)
+        return rows
+
+    def to_json(self):
+        with self._lock:
+            snap = {'histograms': [], 'requests': []}
+            for (metric, model, method), hist in sorted(self._histograms.items()):
+                entry = {'metric': metric, 'model': model, 'method': method}
+                entry.update(hist.snapshot())
+                snap['histograms'].append(entry)
+            for (model, method, status), count in sorted(self._requests.items()):
+                snap['requests'].append({'model': model, 'method': method, 'status': status, 'count': count})
+        return snap
+
+    def to_prometheus(self):
+        lines = []
+        with self._lock:
+            by_metric = {}
+            for (metric, model, method), hist in sorted(self._histograms.items()):
+                by_metric.setdefault(metric, []).append((model, method, hist))
+
+            for metric, series in by_metric.items():
+                name = f"{METRIC_PREFIX}_{metric}"
+                help_text, _ = METRIC_DEFS[metric]
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} histogram")
+                for model, method, hist in series:
+                    labels = f'model="{_escape(model)}",method="{_escape(method)}"'
+                    for bound, count in zip(hist.buckets, hist.bucket_counts):
+                        lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {count}')
+                    lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {hist.count}')
+                    lines.append(f'{name}_sum{{{labels}}} {hist.sum}')
+                    lines.append(f'{name}_count{{{labels}}} {hist.count}')
+
+            if self._requests:
+                name = f"{METRIC_PREFIX}_requests_total"
+                lines.append(f"# HELP {name} Finished requests by status")
+                lines.append(f"# TYPE {name} counter")
+                for (model, method, status), count in sorted(self._requests.items()):
+                    lines.append(f'{name}{{model="{_escape(model)}",method="{_escape(method)}",status="{status}"}} {count}')
+        return "\n".join(lines) + "\n"
+
+    def save(self, path_prefix):
+        """Writes <prefix>.json and <prefix>.prom. Returns the two paths."""
+        json_path = f"{path_prefix}.json"
+        prom_path = f"{path_prefix}.prom"
+        with open(json_path, 'w', encoding='utf-8') as f:
+            json.dump(self.to_json(), f, indent=4)
+        with open(prom_path, 'w', encoding='utf-8') as f:
+            f.write(self.to_prometheus())
+        return json_path, prom_path
+
+    def print_summary(self):
+        print("\n" + "=" * 78)
+        print("          LATENCY PERCENTILES (seconds)          ")
+        print("=" * 78)
+        print(f"{'Model':<26} {'Method':<12} {'p50':>7} {'p95':>7} {'p99':>7} {'TTFT50':>7} {'tok/s50':>8}")
+        for row in self.summary_rows():
+            print(
+                f"{row['Model'][:26]:<26} {row['Method'][:12]:<12} "
+                f"{_fmt(row.get('latency_seconds_p50'))} {_fmt(row.get('latency_seconds_p95'))} "
+                f"{_fmt(row.get('latency_seconds_p99'))} {_fmt(row.get('ttft_seconds_p50'))} "
+                f"{_fmt(row.get('output_tokens_per_second_p50'), 8, 1)}"
+            )
+        print("=" * 78)
+
+
+class RequestTimer:
+    """
+    Timing of one logical request. Typical use:
+
+        timer = metrics.request(MODEL_ID, method_name)
+        for attempt in range(max_retries):
+            try:
+                with timer.attempt():
+                    ...call the backend, timer.first_token() when streaming...
+                break
+            except RateLimitError:
+                timer.backoff(wait_time)
+        timer.finish(output_tokens=n)
+    """
+
+    def __init__(self, metrics, model, method, enqueued_at=None):
+        self.metrics = metrics
+        self.model = model
+        self.method = method
+        self.enqueued_at = enqueued_at if enqueued_at is not None else time.perf_counter()
+        self.dispatched_at = None
+        self.attempt_started_at = None
+        self.ttft = None
+        self.service = None
+        self.retry = 0.0
+        self.attempts = 0
+
+    @contextmanager
+    def attempt(self):
+        start = time.perf_counter()
+        if self.dispatched_at is None:
+            self.dispatched_at = start
+        self.attempt_started_at = start
+        self.ttft = None
+        self.attempts += 1
+        try:
+            yield self
+        except BaseException:
+            self.retry += time.perf_counter() - start
+            raise
+        self.service = time.perf_counter() - start
+
+    def first_token(self):
+        if self.ttft is None and self.attempt_started_at is not None:
+            self.ttft = time.perf_counter() - self.attempt_started_at
+
+    def backoff(self, seconds):
+        """Sleeps and accounts the wait as retry time."""
+        start = time.perf_counter()
+        time.sleep(seconds)
+        self.retry += time.perf_counter() - start
+
+    def finish(self, output_tokens=None, success=True):
+        end = time.perf_counter()
+        queue_wait = (self.dispatched_at - self.enqueued_at) if self.dispatched_at is not None else None
+        m = self.metrics
+        m.count_request(self.model, self.method, 'ok' if success and self.service is not None else 'error')
+        m.observe('latency_seconds', end - self.enqueued_at, self.model, self.method)
+        m.observe('queue_wait_seconds', queue_wait, self.model, self.method)
+        m.observe('retry_seconds', self.retry, self.model, self.method)
+        if success and self.service is not None:
+            m.observe('service_seconds', self.service, self.model, self.method)
+            m.observe('ttft_seconds', self.ttft, self.model, self.method)
+            if output_tokens and self.service > 0:
+                m.observe('output_tokens_per_second', output_tokens / self.service, self.model, self.method)
+        return end - self.enqueued_at
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _fmt(value, width=7, digits=2):
+    return f"{value:>{width}.{digits}f}" if value is not None else f"{'-':>{width}}"
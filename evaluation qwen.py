@@ -1,21 +1,67 @@
+import argparse
 import json
 import re
 import time
-import torch
-import pandas as pd
-from transformers import Qwen2_5_VLForConditionalGeneration, AutoProcessor, BitsAndBytesConfig
-from qwen_vl_utils import process_vision_info
+from contextlib import nullcontext
+from compact_dataset import load_rows
+from compressor_registry import evaluation_methods
+from eval_metrics import EvalMetrics
+from profiling import memory_rollup
+
+# torch, transformers e pandas sono importati solo dove servono (caricamento del
+# modello, generazione, report): --help e le utility partono senza.
 
 # ==========================================
 # CONFIGURAZIONE
 # ==========================================
 INPUT_FILE = "datasets/gsm8k_compressed.json" 
 OUTPUT_FILE = "results_evaluation_qwen.json"
+METRICS_PREFIX = "metrics_evaluation_qwen"
 MODEL_ID = "Qwen/Qwen2.5-VL-7B-Instruct"
 
+# Backend di inferenza:
+#   'vl'   -> Qwen2_5_VLForConditionalGeneration + AutoProcessor (come in origine)
+#   'text' -> qualsiasi AutoModelForCausalLM + AutoTokenizer: niente vision tower
+#             (pesi non caricati) né preprocessing immagini. GSM8K è solo testo.
+BACKEND = 'vl'
+# Modello del backend 'text' se non indicato: Qwen2.5 solo testo della stessa taglia.
+# È un checkpoint rilasciato a parte, non i pesi linguistici di Qwen2.5-VL: --compare
+# confronta quindi due modelli diversi (costo di caricamento e velocità, non accuratezza).
+TEXT_MODEL_ID = "Qwen/Qwen2.5-7B-Instruct"
+
+# dtype dei pesi: bfloat16 anche su CPU (metà memoria di float32)
+DTYPE = 'bfloat16'
+# 'auto' = GPU se disponibile (accelerate); 'cpu' per forzare la CPU
+DEVICE_MAP = 'auto'
+
 # Usa True se hai poca VRAM (sotto i 16GB) per caricare il modello a 4-bit
 USE_4BIT = False
 
+MAX_NEW_TOKENS = 512
+SYSTEM_PROMPT = "You are a helpful math assistant. Solve step by step. End with '####' and the number."
+
+# Decodifica speculativa (assisted generation di transformers): un draft piccolo con lo
+# stesso tokenizer propone DRAFT_TOKENS token, il target li verifica in un solo forward e
+# tiene il prefisso che coincide con il suo argmax. Con la decodifica greedy l'output è
+# quello del target da solo; cambia solo il numero di forward del modello grande.
+DRAFT_MODEL_ID = None   # es. "Qwen/Qwen2.5-0.5B-Instruct" (con --backend text); None = disattivata
+DRAFT_TOKENS = 5
+# Con il draft ogni prompt è generato anche senza: speed-up misurato e output confrontati.
+# L'identità è esatta in float32; in bfloat16 la verifica a blocchi arrotonda diversamente
+# dal decoding token per token e un argmax quasi alla pari può cambiare (colonna 'identical').
+DRAFT_BASELINE = True
+
+# Modelli minuscoli offline (target + draft, stesso tokenizer) per provare tutto su CPU
+TINY_TARGET = "benchmarks/models/tiny-qwen2-chat"
+TINY_DRAFT = "benchmarks/models/tiny-qwen2-chat-draft"
+TINY_RESIDUAL_SCALE = 0.3  # peso dei layer del target assenti nel draft
+
+# Metodi da valutare (label del registro dei compressori, vedi compressor_registry.py)
+METHODS_TO_RUN = ['LLMLingua2']
+
+# Domande per backend in --compare (il confronto misura la velocità, non l'accuratezza)
+COMPARE_QUESTIONS = 3
+
 # ==========================================
 # UTILS (Estrazione e Check - Invariati)
 # ==========================================
@@ -35,59 +81,204 @@ def check_correctness(pred, gold):
     except:
         return False
 
+class FirstTokenStreamer:
+    """
+    Streamer minimale per generate() (stessa interfaccia di BaseStreamer, senza
+    importare transformers): non stampa nulla, segnala solo al timer quando
+    arriva il primo token generato (il primo put() contiene il prompt).
+    """
+    def __init__(self, timer):
+        self.timer = timer
+        self.prompt_seen = False
+
+    def put(self, value):
+        if not self.prompt_seen:
+            self.prompt_seen = True
+            return
+        self.timer.first_token()
+
+    def end(self):
+        pass
+
 # ==========================================
-# MAIN
+# MODELLO
 # ==========================================
-def main():
-    print(f"--- Loading Dataset: {INPUT_FILE} ---")
-    try:
-        with open(INPUT_FILE, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-    except FileNotFoundError:
-        print("Dataset non trovato.")
-        return
-    
-    # data = data[:5] # Decommenta per test rapido
+def load_model(backend=BACKEND, model_id=None, dtype=DTYPE, device_map=DEVICE_MAP, use_4bit=USE_4BIT):
+    """
+    (model, processor, load report). Per 'text' il processor è il tokenizer.
+    Il report contiene il tempo di caricamento e la RSS del processo dopo il load.
+    """
+    import torch
+    from transformers import AutoModelForCausalLM, AutoProcessor, AutoTokenizer
 
-    print(f"--- Loading Model: {MODEL_ID} ---")
-    print(f"--- Quantization 4-bit: {USE_4BIT} ---")
+    model_id = model_id or (MODEL_ID if backend == 'vl' else TEXT_MODEL_ID)
+    rss_before = memory_rollup()['rss_mb']
+    start = time.perf_counter()
 
     # Configurazione Quantizzazione (per risparmiare memoria)
     bnb_config = None
-    if USE_4BIT:
+    if use_4bit:
+        from transformers import BitsAndBytesConfig
         bnb_config = BitsAndBytesConfig(
             load_in_4bit=True,
             bnb_4bit_use_double_quant=True,
             bnb_4bit_quant_type="nf4",
             bnb_4bit_compute_dtype=torch.bfloat16
         )
+    kwargs = {'quantization_config': bnb_config, 'torch_dtype': getattr(torch, dtype),
+              'device_map': None if device_map == 'cpu' else device_map}
+
+    if backend == 'vl':
+        # Modello VL (Vision-Language): carica anche la vision tower, inutile su testo
+        from transformers import Qwen2_5_VLForConditionalGeneration
+        model = Qwen2_5_VLForConditionalGeneration.from_pretrained(model_id, trust_remote_code=True, **kwargs)
+        # Processor (gestisce tokenizzazione e immagini)
+        processor = AutoProcessor.from_pretrained(model_id, trust_remote_code=True)
+    elif backend == 'text':
+        model = AutoModelForCausalLM.from_pretrained(model_id, **kwargs)
+        processor = AutoTokenizer.from_pretrained(model_id)
+    else:
+        raise ValueError(f"Unknown backend '{backend}' (vl, text)")
+    model.eval()
+
+    report = {
+        'backend': backend,
+        'model': model_id,
+        'dtype': 'nf4' if use_4bit else dtype,
+        'device': str(model.device),
+        'params_m': sum(p.numel() for p in model.parameters()) / 1e6,
+        'load_s': time.perf_counter() - start,
+        'rss_mb': memory_rollup()['rss_mb'],
+    }
+    report['rss_delta_mb'] = report['rss_mb'] - rss_before
+    return model, processor, report
+
 
-    # Caricamento Modello VL (Vision-Language)
-    # Nota: Anche se usiamo solo testo, usiamo la classe specifica per Qwen-VL
-    model = Qwen2_5_VLForConditionalGeneration.from_pretrained(
-        MODEL_ID,
-        quantization_config=bnb_config,
-        torch_dtype=torch.bfloat16,
-        device_map="auto",
-        trust_remote_code=True
+def load_draft(model_id, dtype=DTYPE, device_map=DEVICE_MAP, draft_tokens=DRAFT_TOKENS):
+    """Draft per assisted generation: un AutoModelForCausalLM con lo stesso tokenizer del target."""
+    import torch
+    from transformers import AutoModelForCausalLM
+
+    draft = AutoModelForCausalLM.from_pretrained(
+        model_id, torch_dtype=getattr(torch, dtype), device_map=None if device_map == 'cpu' else device_map)
+    # k fisso: la schedule euristica di default cambia k tra una domanda e l'altra
+    draft.generation_config.num_assistant_tokens = draft_tokens
+    draft.generation_config.num_assistant_tokens_schedule = 'constant'
+    return draft.eval()
+
+
+class DraftCounter:
+    """
+    Statistiche di una generate() assistita (batch 1):
+      rounds   -> forward del target (uno per verifica);
+      drafted  -> token proposti dal draft (somma delle sue generate());
+      accepted -> token del draft tenuti: ogni round aggiunge i token accettati
+                  più uno del target, quindi generati - rounds.
+    """
+    def __init__(self, model, draft):
+        self.model = model
+        self.draft = draft
+        self.rounds = 0
+        self.drafted = 0
+
+    def __enter__(self):
+        draft_generate = self.draft.generate
+
+        def generate(*args, **kwargs):
+            out = draft_generate(*args, **kwargs)
+            prompt = kwargs['input_ids'] if 'input_ids' in kwargs else args[0]
+            self.drafted += out.sequences.shape[1] - prompt.shape[1]
+            return out
+
+        self.draft.generate = generate  # attributo d'istanza: copre il metodo della classe
+        self._hook = self.model.register_forward_hook(self._count_round)
+        return self
+
+    def _count_round(self, module, inputs, output):
+        self.rounds += 1
+
+    def __exit__(self, *exc):
+        self._hook.remove()
+        del self.draft.generate
+
+    def report(self, generated):
+        accepted = max(0, generated - self.rounds)
+        return {'rounds': self.rounds, 'drafted': self.drafted, 'accepted': accepted}
+
+
+def build_messages(prompt_text):
+    # Formato Chat Qwen
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": prompt_text},
+    ]
+
+
+def encode_prompt(processor, backend, prompt_text):
+    """Input del modello per un prompt; lo stesso chat template per entrambi i backend."""
+    text_input = processor.apply_chat_template(
+        build_messages(prompt_text), tokenize=False, add_generation_prompt=True
     )
+    if backend == 'vl':
+        # Nota: 'images=None' perché è una task solo testo
+        return processor(text=[text_input], images=None, videos=None, padding=True, return_tensors="pt")
+    return processor([text_input], return_tensors="pt")
+
 
-    # Caricamento Processor (gestisce tokenizzazione e immagini)
-    processor = AutoProcessor.from_pretrained(MODEL_ID, trust_remote_code=True)
+def generate(model, processor, inputs, timer, max_new_tokens=MAX_NEW_TOKENS, draft=None):
+    """
+    (risposta, id generati) con decodifica greedy, cronometrata da `timer`.
+    Con `draft` la generazione è assistita e le statistiche del draft finiscono
+    in timer.draft (vedi DraftCounter).
+    """
+    import torch
 
-    methods_map = [
-        #('Original', 'question_original'),
-        #('RuleBased', 'question_rulebased'),
-        ('LLMLingua2', 'question_llmlingua2')
+    # Spostiamo gli input sul device del modello
+    inputs = inputs.to(model.device)
+    kwargs = {}
+    counter = None
+    if draft is not None:
+        kwargs['assistant_model'] = draft
+        counter = DraftCounter(model, draft)
+    with timer.attempt(), torch.no_grad(), counter or nullcontext():
+        generated_ids = model.generate(
+            **inputs,
+            max_new_tokens=max_new_tokens,
+            temperature=0.01, # Quasi deterministico (0.0 a volte dà errori su hf)
+            do_sample=False,
+            streamer=FirstTokenStreamer(timer),
+            **kwargs
+        )
+
+    # Decodifica (rimuoviamo i token di input dall'output)
+    generated_ids_trimmed = [
+        out_ids[len(in_ids):] for in_ids, out_ids in zip(inputs.input_ids, generated_ids)
     ]
+    response_text = processor.batch_decode(
+        generated_ids_trimmed, skip_special_tokens=True, clean_up_tokenization_spaces=False
+    )[0]
+    output_ids = generated_ids_trimmed[0].tolist()
+    if counter is not None:
+        timer.draft = counter.report(len(output_ids))
+    return response_text, output_ids
 
+# ==========================================
+# VALUTAZIONE
+# ==========================================
+def evaluate(data, model, processor, backend, model_label, metrics, output_file=None,
+             max_new_tokens=MAX_NEW_TOKENS, verbose=True, draft=None, baseline=DRAFT_BASELINE):
+    """
+    (risultati per domanda, righe per il report); salva in output_file ogni 5 domande.
+    Con `draft` e `baseline` ogni prompt è generato prima dal target da solo
+    (metriche sotto "[no draft] <model>") e poi con il draft.
+    """
+    methods_map = [(label, field) for label, field in evaluation_methods() if label in METHODS_TO_RUN]
     final_results = []
     stats = []
 
-    print("\n--- Starting Local Inference ---")
-    
     for i, entry in enumerate(data):
-        print(f"\nProcessing Question {i+1}/{len(data)}")
+        if verbose:
+            print(f"\nProcessing Question {i+1}/{len(data)}")
         gold_val = extract_answer_gsm8k(entry.get('answer', ''))
         
         result_entry = {'id': i, 'gold': gold_val, 'evaluations': {}}
@@ -96,90 +287,270 @@ def main():
             prompt_text = entry.get(json_key, "")
             if not prompt_text: continue
 
-            # Preparazione Messaggio (Formato Chat Qwen)
-            messages = [
-                {
-                    "role": "system", 
-                    "content": "You are a helpful math assistant. Solve step by step. End with '####' and the number."
-                },
-                {
-                    "role": "user", 
-                    "content": prompt_text
-                }
-            ]
-
-            # Preparazione Input
-            text_input = processor.apply_chat_template(
-                messages, tokenize=False, add_generation_prompt=True
-            )
-            
-            # Nota: 'images=None' perché è una task solo testo
-            inputs = processor(
-                text=[text_input],
-                images=None, 
-                videos=None,
-                padding=True,
-                return_tensors="pt"
-            )
-            
-            # Spostiamo gli input sulla GPU
-            inputs = inputs.to(model.device)
+            inputs = encode_prompt(processor, backend, prompt_text)
 
             # Generazione
-            start_t = time.time()
-            with torch.no_grad():
-                generated_ids = model.generate(
-                    **inputs, 
-                    max_new_tokens=512,
-                    temperature=0.01, # Quasi deterministico (0.0 a volte dà errori su hf)
-                    do_sample=False
-                )
-            end_t = time.time()
-
-            # Decodifica (rimuoviamo i token di input dall'output)
-            generated_ids_trimmed = [
-                out_ids[len(in_ids):] for in_ids, out_ids in zip(inputs.input_ids, generated_ids)
-            ]
-            response_text = processor.batch_decode(
-                generated_ids_trimmed, skip_special_tokens=True, clean_up_tokenization_spaces=False
-            )[0]
+            base_timer, base_ids = None, None
+            if draft is not None and baseline:
+                base_timer = metrics.request(f"[no draft] {model_label}", method_name)
+                _, base_ids = generate(model, processor, inputs, base_timer, max_new_tokens)
+                base_timer.finish(output_tokens=len(base_ids))
+            timer = metrics.request(model_label, method_name)
+            response_text, output_ids = generate(model, processor, inputs, timer, max_new_tokens, draft)
+            output_tokens_count = len(output_ids)
 
             # Valutazione
             input_tokens_count = inputs.input_ids.shape[1] # Conteggio esatto token input
             pred_val = extract_answer_gsm8k(response_text)
             is_correct = check_correctness(pred_val, gold_val)
-            latency = end_t - start_t
+            timer.finish(output_tokens=output_tokens_count)
+            latency = timer.service
 
             # Log e Salvataggio
-            print(f"  [{method_name:<11}] Tok: {input_tokens_count:<4} | Lat: {latency:.2f}s | OK: {str(is_correct):<5} | Pred: {pred_val}")
+            if verbose:
+                print(f"  [{method_name:<11}] Tok: {input_tokens_count:<4} | Lat: {latency:.2f}s | OK: {str(is_correct):<5} | Pred: {pred_val}")
             
             result_entry['evaluations'][method_name] = {
                 'response': response_text,
                 'prediction': pred_val,
                 'correct': is_correct,
                 'tokens': int(input_tokens_count),
-                'latency': latency
+                'output_tokens': int(output_tokens_count),
+                'latency': latency,
+                'ttft': timer.ttft
             }
-            stats.append({'Method': method_name, 'Correct': 1 if is_correct else 0, 'Tokens': input_tokens_count, 'Latency': latency})
+            row = {'Method': method_name, 'Correct': 1 if is_correct else 0, 'Tokens': input_tokens_count,
+                   'Latency': latency, 'OutputTokens': output_tokens_count}
+            if draft is not None:
+                draft_info = dict(timer.draft)
+                if base_timer is not None:
+                    draft_info['baseline_latency'] = base_timer.service
+                    draft_info['baseline_tokens'] = len(base_ids)
+                    draft_info['identical'] = base_ids == output_ids
+                    if verbose and not draft_info['identical']:
+                        print(f"  [{method_name:<11}] ATTENZIONE: output diverso dalla greedy senza draft")
+                result_entry['evaluations'][method_name]['draft'] = draft_info
+                row['Draft'] = draft_info
+            stats.append(row)
 
         final_results.append(result_entry)
         
         # Salvataggio incrementale
-        if i % 5 == 0:
-            with open(OUTPUT_FILE, 'w', encoding='utf-8') as f:
+        if output_file and i % 5 == 0:
+            with open(output_file, 'w', encoding='utf-8') as f:
                 json.dump(final_results, f, indent=4)
 
+    return final_results, stats
+
+def print_draft_summary(stats, draft_label, draft_tokens):
+    """Acceptance rate, token per forward del target e speed-up per metodo."""
+    by_method = {}
+    for row in stats:
+        if 'Draft' in row:
+            by_method.setdefault(row['Method'], []).append(row)
+    if not by_method:
+        return
+    print("\n" + "=" * 96)
+    print(f"          SPECULATIVE DECODING (draft: {draft_label}, k={draft_tokens})          ")
+    print("=" * 96)
+    print(f"{'Method':<12} {'drafted':>8} {'accepted':>9} {'accept %':>9} {'tok/fwd':>8} "
+          f"{'base tok/s':>11} {'tok/s':>8} {'speed-up':>9} {'identical':>10}")
+    for method, rows in by_method.items():
+        drafts = [r['Draft'] for r in rows]
+        drafted = sum(d['drafted'] for d in drafts)
+        accepted = sum(d['accepted'] for d in drafts)
+        rounds = sum(d['rounds'] for d in drafts)
+        tokens = sum(r['OutputTokens'] for r in rows)
+        latency = sum(r['Latency'] for r in rows)
+        line = (f"{method[:12]:<12} {drafted:>8} {accepted:>9} {accepted / drafted if drafted else 0.0:>9.1%} "
+                f"{tokens / rounds if rounds else 0.0:>8.2f} ")
+        checked = [r for r in rows if 'baseline_latency' in r['Draft']]
+        if checked:
+            base_latency = sum(r['Draft']['baseline_latency'] for r in checked)
+            base_tokens = sum(r['Draft']['baseline_tokens'] for r in checked)
+            identical = sum(r['Draft']['identical'] for r in checked)
+            line += (f"{base_tokens / base_latency if base_latency else 0.0:>11.1f} "
+                     f"{tokens / latency if latency else 0.0:>8.1f} "
+                     f"{base_latency / sum(r['Latency'] for r in checked):>8.2f}x {f'{identical}/{len(checked)}':>10}")
+        else:
+            line += f"{'-':>11} {tokens / latency if latency else 0.0:>8.1f} {'-':>9} {'-':>10}"
+        print(line)
+    print("=" * 96)
+
+# ==========================================
+# CONFRONTO BACKEND (vl vs text)
+# ==========================================
+def _measure_backend(backend, model_id, data, dtype, device_map, use_4bit, max_new_tokens):
+    """Eseguito in un processo dedicato: RSS e tempo di load non risentono dell'altro backend."""
+    model, processor, report = load_model(backend, model_id, dtype, device_map, use_4bit)
+    _, stats = evaluate(data, model, processor, backend, report['model'], EvalMetrics(),
+                        max_new_tokens=max_new_tokens, verbose=False)
+    import resource
+    report['peak_rss_mb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024  # KiB su Linux; KV cache compresa
+    report['requests'] = len(stats)
+    report['output_tokens'] = sum(s['OutputTokens'] for s in stats)
+    generation_s = sum(s['Latency'] for s in stats)
+    report['tokens_per_s'] = report['output_tokens'] / generation_s if generation_s else 0.0
+    return report
+
+
+def compare_backends(data, backends, model_ids=None, dtype=DTYPE, device_map=DEVICE_MAP, use_4bit=USE_4BIT,
+                     max_new_tokens=MAX_NEW_TOKENS):
+    """Load time, RSS e token/s di ogni backend sulle stesse domande, un processo per backend."""
+    import multiprocessing
+    model_ids = model_ids or {}
+    ctx = multiprocessing.get_context("spawn")
+    reports = []
+    for backend in backends:
+        with ctx.Pool(1) as pool:
+            reports.append(pool.apply(_measure_backend, (backend, model_ids.get(backend), data, dtype,
+                                                         device_map, use_4bit, max_new_tokens)))
+
+    print("\n" + "=" * 96)
+    print(f"{'Backend':<8} {'Model':<32} {'dtype':<9} {'params M':>9} {'load s':>7} {'load MB':>8} "
+          f"{'peak MB':>8} {'tok/s':>7}")
+    print("=" * 96)
+    for r in reports:
+        print(f"{r['backend']:<8} {r['model'][-32:]:<32} {r['dtype']:<9} {r['params_m']:>9.1f} {r['load_s']:>7.2f} "
+              f"{r['rss_delta_mb']:>8.0f} {r['peak_rss_mb']:>8.0f} {r['tokens_per_s']:>7.1f}")
+    print("=" * 96)
+    return reports
+
+# ==========================================
+# MODELLI MINUSCOLI (test offline su CPU)
+# ==========================================
+def make_tiny_models(target_dir=TINY_TARGET, draft_dir=TINY_DRAFT):
+    """
+    Target Qwen2 casuale con tokenizer e chat template in stile Qwen, e draft con
+    lo stesso tokenizer ottenuto tenendo solo il primo layer del target (stessi
+    embedding e lm_head). Le uscite dei layer successivi del target sono ridotte
+    (TINY_RESIDUAL_SCALE): il draft ne approssima bene l'argmax, ma non sempre.
+    """
+    import copy
+    import torch
+    from tokenizers import Tokenizer, decoders, models, pre_tokenizers, trainers
+    from transformers import PreTrainedTokenizerFast, Qwen2Config, Qwen2ForCausalLM
+    from benchmark_compressors import SEED, build_cases
+
+    torch.manual_seed(SEED)
+    corpus = [p for prompts in build_cases().values() for p in prompts]
+    bpe = Tokenizer(models.BPE())
+    bpe.pre_tokenizer = pre_tokenizers.ByteLevel(add_prefix_space=False)
+    bpe.decoder = decoders.ByteLevel()
+    bpe.train_from_iterator(corpus, trainers.BpeTrainer(
+        vocab_size=2000, special_tokens=["<|endoftext|>", "<|im_start|>", "<|im_end|>"],
+        initial_alphabet=pre_tokenizers.ByteLevel.alphabet()))
+    tokenizer = PreTrainedTokenizerFast(
+        tokenizer_object=bpe, eos_token="<|im_end|>", pad_token="<|endoftext|>", model_max_length=4096)
+    tokenizer.chat_template = (
+        "{% for m in messages %}<|im_start|>{{ m['role'] }}\n{{ m['content'] }}<|im_end|>\n{% endfor %}"
+        "{% if add_generation_prompt %}<|im_start|>assistant\n{% endif %}")
+
+    target = Qwen2ForCausalLM(Qwen2Config(
+        vocab_size=len(tokenizer), hidden_size=128, intermediate_size=256, num_hidden_layers=4,
+        num_attention_heads=4, num_key_value_heads=2, max_position_embeddings=4096,
+        eos_token_id=tokenizer.eos_token_id, pad_token_id=tokenizer.pad_token_id))
+    with torch.no_grad():
+        for layer in target.model.layers[1:]:
+            layer.self_attn.o_proj.weight.mul_(TINY_RESIDUAL_SCALE)
+            layer.mlp.down_proj.weight.mul_(TINY_RESIDUAL_SCALE)
+    draft = copy.deepcopy(target)
+    draft.model.layers = draft.model.layers[:1]
+    draft.config.num_hidden_layers = 1
+    if getattr(draft.config, 'layer_types', None):
+        draft.config.layer_types = draft.config.layer_types[:1]
+
+    for model, path in ((target, target_dir), (draft, draft_dir)):
+        model.save_pretrained(path)
+        tokenizer.save_pretrained(path)
+    print(f"Tiny models saved to {target_dir} and {draft_dir}")
+
+# ==========================================
+# MAIN
+# ==========================================
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Local GSM8K evaluation with a Hugging Face model.")
+    parser.add_argument("--input", default=INPUT_FILE)
+    parser.add_argument("--output", default=OUTPUT_FILE)
+    parser.add_argument("--backend", choices=("vl", "text"), default=BACKEND,
+                        help="text: AutoModelForCausalLM + tokenizer, no vision tower")
+    parser.add_argument("--model", default=None,
+                        help=f"default {MODEL_ID} (vl) / {TEXT_MODEL_ID} (text); the vl model in --compare")
+    parser.add_argument("--dtype", choices=("bfloat16", "float16", "float32"), default=DTYPE)
+    parser.add_argument("--device-map", default=DEVICE_MAP, help="'auto' or 'cpu'")
+    parser.add_argument("--4bit", dest="use_4bit", action="store_true", default=USE_4BIT)
+    parser.add_argument("--max-new-tokens", type=int, default=MAX_NEW_TOKENS)
+    parser.add_argument("--limit", type=int, default=None, help="first N questions only")
+    parser.add_argument("--compare", default=None, metavar="BACKENDS",
+                        help="e.g. 'vl,text': load time, RSS and tokens/s per backend on the first "
+                             f"--limit questions (default {COMPARE_QUESTIONS}). The backends load different "
+                             "checkpoints (--model and --text-model), not the same weights with and without "
+                             "the vision tower")
+    parser.add_argument("--text-model", default=TEXT_MODEL_ID, help="text model used by --compare")
+    parser.add_argument("--draft-model", default=DRAFT_MODEL_ID,
+                        help="small model with the same tokenizer: assisted (speculative) greedy decoding")
+    parser.add_argument("--draft-tokens", type=int, default=DRAFT_TOKENS, help="tokens proposed per target forward")
+    parser.add_argument("--no-baseline", dest="baseline", action="store_false", default=DRAFT_BASELINE,
+                        help="with --draft-model, skip the plain greedy run (no speed-up / identity check)")
+    parser.add_argument("--make-tiny-models", action="store_true",
+                        help=f"create a tiny target/draft pair ({TINY_TARGET}, {TINY_DRAFT}) and exit")
+    args = parser.parse_args(argv)
+
+    if args.make_tiny_models:
+        make_tiny_models()
+        return
+
+    print(f"--- Loading Dataset: {args.input} ---")
+    try:
+        data = load_rows(args.input, lazy=True)  # anche formato compatto (righe espanse una alla volta) / keep mask
+    except FileNotFoundError:
+        print("Dataset non trovato.")
+        return
+
+    if args.compare:
+        data = data[:args.limit or COMPARE_QUESTIONS]
+        backends = args.compare.split(",")
+        model_ids = {'vl': args.model or MODEL_ID, 'text': args.text_model}
+        compare_backends(data, backends, model_ids, args.dtype, args.device_map, args.use_4bit, args.max_new_tokens)
+        return
+
+    if args.limit:
+        data = data[:args.limit]
+
+    print(f"--- Loading Model ({args.backend}): {args.model or (MODEL_ID if args.backend == 'vl' else TEXT_MODEL_ID)} ---")
+    print(f"--- Quantization 4-bit: {args.use_4bit} ---")
+    model, processor, report = load_model(args.backend, args.model, args.dtype, args.device_map, args.use_4bit)
+    print(f"--- Loaded in {report['load_s']:.1f}s | {report['params_m']:.0f}M params | {report['dtype']} on "
+          f"{report['device']} | RSS {report['rss_mb']:.0f} MB (+{report['rss_delta_mb']:.0f}) ---")
+
+    draft = None
+    if args.draft_model:
+        print(f"--- Loading Draft: {args.draft_model} (k={args.draft_tokens}) ---")
+        draft = load_draft(args.draft_model, args.dtype, args.device_map, args.draft_tokens)
+
+    metrics = EvalMetrics()
+    print("\n--- Starting Local Inference ---")
+    final_results, stats = evaluate(data, model, processor, args.backend, report['model'], metrics, args.output,
+                                    args.max_new_tokens, draft=draft, baseline=args.baseline)
+
     # Salvataggio finale
-    with open(OUTPUT_FILE, 'w', encoding='utf-8') as f:
+    with open(args.output, 'w', encoding='utf-8') as f:
         json.dump(final_results, f, indent=4)
 
     # Report
     if stats:
+        import pandas as pd
         df = pd.DataFrame(stats)
         summary = df.groupby('Method').agg({'Correct': 'mean', 'Tokens': 'mean', 'Latency': 'mean'}).reset_index()
         summary['Accuracy'] = (summary['Correct'] * 100).map('{:.2f}%'.format)
         print("\n=== FINAL LOCAL RESULTS ===")
         print(summary)
 
+        metrics.print_summary()
+        if draft is not None:
+            print_draft_summary(stats, args.draft_model, args.draft_tokens)
+        json_path, prom_path = metrics.save(METRICS_PREFIX)
+        print(f"Metriche salvate in: {json_path}, {prom_path}")
+
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -1,9 +1,13 @@
+import argparse
 import json
 import re
-import time
 import os
-import pandas as pd
-from groq import Groq, RateLimitError
+from compact_dataset import load_rows
+from compressor_registry import evaluation_methods
+from eval_metrics import EvalMetrics
+
+# groq e pandas sono importati solo dove servono: chi usa solo le utility
+# (simulate_load.py, extract_answer_gsm8k, check_correctness) non ne paga il costo.
 
 # ==========================================
 # CONFIGURAZIONE
@@ -11,6 +15,8 @@ from groq import Groq, RateLimitError
 # Assicurati che questo sia il file generato dallo script di compressione
 INPUT_FILE = "datasets/gsm8k_compressed.json" 
 OUTPUT_FILE = "results_evaluation_api.json"
+# Snapshot istogrammi latenza/throughput (.json + .prom)
+METRICS_PREFIX = "metrics_evaluation_api"
 
 # Chiave API (Meglio usare le variabili d'ambiente se possibile)
 GROQ_API_KEY = os.getenv("GROQ_API_KEY") 
@@ -18,6 +24,16 @@ GROQ_API_KEY = os.getenv("GROQ_API_KEY")
 # Modello
 MODEL_ID = "llama-3.1-8b-instant" 
 
+# Streaming: necessario per misurare il time-to-first-token (TTFT)
+USE_STREAMING = False
+
+# Metodi da valutare (label del registro dei compressori, vedi compressor_registry.py).
+# Ogni metodo è una chiamata API a pagamento (e soggetta a rate limit) per riga:
+# solo quelli elencati, non tutti i campi presenti nel file. --methods all per tutti.
+METHODS_TO_RUN = ['Original', 'RuleBased', 'LLMLingua2']
+
+SYSTEM_PROMPT = "You are a math expert. Solve the problem step by step. IMPORTANT: At the end, output the final answer after '####'."
+
 # ==========================================
 # UTILS
 # ==========================================
@@ -55,14 +71,88 @@ def check_correctness(pred, gold):
     except:
         return False
 
+def build_messages(prompt_text):
+    return [
+        {
+            "role": "system", 
+            "content": SYSTEM_PROMPT
+        },
+        {
+            "role": "user", 
+            "content": prompt_text
+        }
+    ]
+
+def query_groq(client, messages, timer, stream=USE_STREAMING, model=MODEL_ID):
+    """
+    Una singola chiamata chat completion.
+    Restituisce (response_text, prompt_tokens, completion_tokens).
+    In streaming segnala al timer l'arrivo del primo token.
+    """
+    if not stream:
+        chat_completion = client.chat.completions.create(
+            messages=messages,
+            model=model,
+            temperature=0.0,
+            max_tokens=512,
+            stop=None
+        )
+        usage = chat_completion.usage
+        return chat_completion.choices[0].message.content, usage.prompt_tokens, usage.completion_tokens
+
+    chunks = []
+    usage = None
+    for chunk in client.chat.completions.create(
+        messages=messages,
+        model=model,
+        temperature=0.0,
+        max_tokens=512,
+        stop=None,
+        stream=True
+    ):
+        if chunk.choices and chunk.choices[0].delta.content:
+            timer.first_token()
+            chunks.append(chunk.choices[0].delta.content)
+        # Groq restituisce l'usage solo nell'ultimo chunk (campo x_groq)
+        x_groq = getattr(chunk, 'x_groq', None)
+        if x_groq is not None and getattr(x_groq, 'usage', None) is not None:
+            usage = x_groq.usage
+    prompt_tokens = usage.prompt_tokens if usage else None
+    completion_tokens = usage.completion_tokens if usage else None
+    return "".join(chunks), prompt_tokens, completion_tokens
+
+def query_with_retries(client, messages, timer, label, max_retries=3, backoff_seconds=5, **query_kwargs):
+    """
+    Chiamata con retry sul rate limit (backoff lineare: 5s, 10s, 15s).
+    Restituisce il risultato di query_groq oppure None se la richiesta fallisce.
+    """
+    from groq import RateLimitError
+    for attempt in range(max_retries):
+        try:
+            with timer.attempt():
+                return query_groq(client, messages, timer, **query_kwargs)
+        except RateLimitError:
+            wait_time = (attempt + 1) * backoff_seconds
+            print(f"  [{label}] Rate Limit hit! Waiting {wait_time}s...")
+            timer.backoff(wait_time)
+        except Exception as e:
+            print(f"  [{label}] Generic Error: {e}")
+            return None # Errori non di rete (es. bad request) non si ritentano
+    return None
+
 # ==========================================
 # MAIN
 # ==========================================
-def main():
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="GSM8K evaluation through the Groq API.")
+    parser.add_argument("--methods", default=",".join(METHODS_TO_RUN),
+                        help="comma-separated method labels, or 'all' "
+                             f"(available: {', '.join(label for label, _ in evaluation_methods())})")
+    args = parser.parse_args(argv)
+
     print(f"--- Loading Dataset: {INPUT_FILE} ---")
     try:
-        with open(INPUT_FILE, 'r', encoding='utf-8') as f:
-            data = json.load(f)
+        data = load_rows(INPUT_FILE, lazy=True)  # anche formato compatto (righe espanse una alla volta) / keep mask
     except FileNotFoundError:
         print(f"ERRORE: Non trovo {INPUT_FILE}. Hai eseguito lo script di compressione?")
         return
@@ -75,18 +165,21 @@ def main():
         print("ERRORE: Manca la GROQ_API_KEY!")
         return
         
+    from groq import Groq
     client = Groq(api_key=GROQ_API_KEY)
 
-    # Mappa delle chiavi nel JSON -> Nome metodo per il report
-    # Verifica che queste chiavi esistano nel tuo JSON prodotto prima
-    methods_map = [
-        ('Original', 'question_original'),  # O 'question' se non hai rinominato
-        ('RuleBased', 'question_rulebased'),
-        ('LLMLingua2', 'question_llmlingua2')
-    ]
+    # Nome metodo per il report -> chiave nel JSON, dal registro dei compressori
+    # (le chiavi assenti nel file prodotto vengono saltate riga per riga)
+    selected = None if args.methods == 'all' else set(args.methods.split(","))
+    unknown = (selected or set()) - {label for label, _ in evaluation_methods()}
+    if unknown:
+        print(f"ERRORE: metodi sconosciuti: {', '.join(sorted(unknown))}")
+        return
+    methods_map = [(label, field) for label, field in evaluation_methods() if selected is None or label in selected]
 
     final_results = []
     stats = []
+    metrics = EvalMetrics()
 
     print("\n--- Starting API Inference ---")
     
@@ -103,78 +196,54 @@ def main():
         }
 
         for method_name, json_key in methods_map:
-            prompt_text = entry.get(json_key, "")
-            
-            # Se la compressione ha fallito o la chiave manca, saltiamo
+            # Campo assente (metodo non eseguito su questo file): si salta in silenzio
+            if json_key not in entry:
+                continue
+            prompt_text = entry[json_key]
+
+            # Se la compressione ha fallito, saltiamo
             if not prompt_text: 
                 print(f"  [{method_name}] Skipped (Empty prompt)")
                 continue
 
-            # Preparazione messaggi
-            messages = [
-                {
-                    "role": "system", 
-                    "content": "You are a math expert. Solve the problem step by step. IMPORTANT: At the end, output the final answer after '####'."
-                },
-                {
-                    "role": "user", 
-                    "content": prompt_text
-                }
-            ]
-
             # RETRY LOGIC PER RATE LIMIT
-            max_retries = 3
-            for attempt in range(max_retries):
-                try:
-                    start_t = time.time()
-                    
-                    chat_completion = client.chat.completions.create(
-                        messages=messages,
-                        model=MODEL_ID,
-                        temperature=0.0,
-                        max_tokens=512,
-                        stop=None
-                    )
-                    end_t = time.time()
-                    
-                    # Estrazione Dati
-                    response_text = chat_completion.choices[0].message.content
-                    input_tokens = chat_completion.usage.prompt_tokens
-                    
-                    pred_val = extract_answer_gsm8k(response_text)
-                    is_correct = check_correctness(pred_val, gold_val)
-                    latency = end_t - start_t
-
-                    # Salvataggio Risultati Parziali
-                    result_entry['evaluations'][method_name] = {
-                        # Salviamo solo i primi 50 chars del prompt per non intasare il log
-                        'prompt_snippet': prompt_text[:50] + "...", 
-                        'response': response_text,
-                        'prediction': pred_val,
-                        'correct': is_correct,
-                        'tokens': input_tokens,
-                        'latency': latency
-                    }
-                    
-                    stats.append({
-                        'Method': method_name, 
-                        'Correct': 1 if is_correct else 0, 
-                        'Tokens': input_tokens, 
-                        'Latency': latency
-                    })
-                    
-                    print(f"  [{method_name:<11}] Tok: {input_tokens:<4} | Lat: {latency:.2f}s | OK: {str(is_correct):<5} | Pred: {pred_val}")
-                    
-                    # Successo, usciamo dal loop dei retry
-                    break 
-
-                except RateLimitError:
-                    wait_time = (attempt + 1) * 5 # Backoff esponenziale: 5s, 10s, 15s
-                    print(f"  [{method_name}] Rate Limit hit! Waiting {wait_time}s...")
-                    time.sleep(wait_time)
-                except Exception as e:
-                    print(f"  [{method_name}] Generic Error: {e}")
-                    break # Errori non di rete (es. bad request) non si ritentano
+            # Il timer separa attesa in coda, tempo di servizio e tempo perso in retry/backoff
+            timer = metrics.request(MODEL_ID, method_name)
+            result = query_with_retries(client, build_messages(prompt_text), timer, method_name)
+            if result is None:
+                timer.finish(success=False)
+                continue
+            response_text, input_tokens, completion_tokens = result
+            timer.finish(output_tokens=completion_tokens)
+
+            # Estrazione Dati
+            pred_val = extract_answer_gsm8k(response_text)
+            is_correct = check_correctness(pred_val, gold_val)
+            latency = timer.service
+
+            # Salvataggio Risultati Parziali
+            result_entry['evaluations'][method_name] = {
+                # Salviamo solo i primi 50 chars del prompt per non intasare il log
+                'prompt_snippet': prompt_text[:50] + "...", 
+                'response': response_text,
+                'prediction': pred_val,
+                'correct': is_correct,
+                'tokens': input_tokens,
+                'output_tokens': completion_tokens,
+                'latency': latency,
+                'ttft': timer.ttft,
+                'retry_time': timer.retry,
+                'attempts': timer.attempts
+            }
+            
+            stats.append({
+                'Method': method_name, 
+                'Correct': 1 if is_correct else 0, 
+                'Tokens': input_tokens, 
+                'Latency': latency
+            })
+            
+            print(f"  [{method_name:<11}] Tok: {str(input_tokens):<4} | Lat: {latency:.2f}s | OK: {str(is_correct):<5} | Pred: {pred_val}")
 
         final_results.append(result_entry)
 
@@ -189,6 +258,7 @@ def main():
 
     # REPORT FINALE PANDAS
     if stats:
+        import pandas as pd
         df = pd.DataFrame(stats)
         summary = df.groupby('Method').agg({
             'Correct': 'mean', 
@@ -206,6 +276,10 @@ def main():
         print("="*40)
         print(summary[['Method', 'Accuracy', 'Tokens', 'Latency']].to_string(index=False))
         print("="*40)
+
+        metrics.print_summary()
+        json_path, prom_path = metrics.save(METRICS_PREFIX)
+        print(f"Metriche salvate in: {json_path}, {prom_path}")
     else:
         print("Nessuna statistica raccolta. Qualcosa è andato storto.")
 
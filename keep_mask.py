@@ -0,0 +1,270 @@
+"""
+Keep-mask representation of extractive compressions.
+
+rule_based, rule_numeric and LLMLingua-2 only drop whitespace words from the
+original prompt, so a compressed variant is fully described by which words
+it kept. Instead of a second copy of the text, a row can store a record:
+
+    {"n": 412, "rle": [[0, 17], [19, 40], ...]}     # kept word ranges [start, end)
+    {"n": 412, "bits": "<base64>"}                   # packed bitmask, bit i = word i
+    {..., "seps": [[5, "\\n"], ...]}                 # separators other than " " (k-th gap)
+    {"text": "..."}                                  # fallback: not a subsequence of the original
+
+decode(original, record) gives back the compressed string exactly; encode()
+falls back to storing the text whenever that would not hold. In memory a
+mask is a Python int (bit i = word i), so intersect/union/jaccard between
+methods are single big-int operations.
+
+    python keep_mask.py pack datasets/gsm8k_compressed_all.json out.masked.json
+    python keep_mask.py unpack out.masked.json out.json
+    python keep_mask.py stats datasets/gsm8k_compressed_all.json
+"""
+import argparse
+import base64
+import json
+import os
+import re
+import sys
+import time
+
+MASKS_FIELD = 'keep_masks'      # {campo compresso: record} nelle righe "packed"
+SOURCE_FIELDS = ('question_original', 'question')
+DEFAULT_SCHEME = 'rle'
+
+_WHITESPACE = re.compile(r'\s+')
+
+# ==========================================
+# ENCODE / DECODE
+# ==========================================
+def match_words(words, kept):
+    """
+    Indices into `words` of the words in `kept`, in order (leftmost greedy
+    subsequence match), or None if `kept` is not a subsequence of `words`.
+    """
+    indices, j = [], 0
+    for word in kept:
+        while j < len(words) and words[j] != word:
+            j += 1
+        if j == len(words):
+            return None
+        indices.append(j)
+        j += 1
+    return indices
+
+
+def _separators(text):
+    """Whitespace runs between the words of `text` (text without leading/trailing whitespace)."""
+    return _WHITESPACE.findall(text)
+
+
+def mask_from_indices(indices):
+    mask = 0
+    for i in indices:
+        mask |= 1 << i
+    return mask
+
+
+def indices_from_mask(mask):
+    return [i for i, bit in enumerate(reversed(bin(mask)[2:])) if bit == '1']
+
+
+def _runs(mask):
+    runs = []
+    for i in indices_from_mask(mask):
+        if runs and runs[-1][1] == i:
+            runs[-1][1] = i + 1
+        else:
+            runs.append([i, i + 1])
+    return runs
+
+
+def to_record(n, mask, scheme=DEFAULT_SCHEME, seps=None):
+    record = {'n': n}
+    if scheme == 'rle':
+        record['rle'] = _runs(mask)
+    elif scheme == 'bits':
+        record['bits'] = base64.b64encode(mask.to_bytes((n + 7) // 8, 'little')).decode('ascii')
+    else:
+        raise ValueError(f"Unknown scheme '{scheme}' (rle, bits)")
+    if seps:
+        record['seps'] = seps
+    return record
+
+
+def to_mask(record):
+    """Python int with bit i set for every kept word; raises for text-only records."""
+    if 'rle' in record:
+        mask = 0
+        for start, end in record['rle']:
+            mask |= ((1 << (end - start)) - 1) << start
+        return mask
+    if 'bits' in record:
+        return int.from_bytes(base64.b64decode(record['bits']), 'little')
+    raise ValueError("Record stores the text, not a mask")
+
+
+def encode(original, compressed, scheme=DEFAULT_SCHEME):
+    """Record for `compressed`; {'text': compressed} if it is not an exact word subsequence of `original`."""
+    words = original.split()
+    indices = match_words(words, compressed.split())
+    if indices is None or compressed != compressed.strip():
+        return {'text': compressed}
+    seps = [[k, sep] for k, sep in enumerate(_separators(compressed)) if sep != ' ']
+    return to_record(len(words), mask_from_indices(indices), scheme, seps)
+
+
+def decode(original, record):
+    if 'text' in record:
+        return record['text']
+    words = original.split()
+    if len(words) != record['n']:
+        raise ValueError(f"Mask over {record['n']} words, original has {len(words)}")
+    kept = [words[i] for i in indices_from_mask(to_mask(record))]
+    seps = [' '] * max(0, len(kept) - 1)
+    for k, sep in record.get('seps', ()):
+        seps[k] = sep
+    return "".join(word + sep for word, sep in zip(kept, seps + [''])) if kept else ""
+
+# ==========================================
+# SET OPERATIONS
+# ==========================================
+def keep_ratio(record):
+    return to_mask(record).bit_count() / record['n'] if record['n'] else 1.0
+
+
+def intersect(a, b, scheme=DEFAULT_SCHEME):
+    """Words kept by both methods (separators are not carried over)."""
+    _check_same_source(a, b)
+    return to_record(a['n'], to_mask(a) & to_mask(b), scheme)
+
+
+def union(a, b, scheme=DEFAULT_SCHEME):
+    _check_same_source(a, b)
+    return to_record(a['n'], to_mask(a) | to_mask(b), scheme)
+
+
+def jaccard(a, b):
+    _check_same_source(a, b)
+    ma, mb = to_mask(a), to_mask(b)
+    either = (ma | mb).bit_count()
+    return (ma & mb).bit_count() / either if either else 1.0
+
+
+def _check_same_source(a, b):
+    if 'text' in a or 'text' in b:
+        raise ValueError("Set operations need two mask records")
+    if a['n'] != b['n']:
+        raise ValueError(f"Masks over different texts ({a['n']} vs {b['n']} words)")
+
+# ==========================================
+# DATASET ROWS
+# ==========================================
+def source_text(entry):
+    for field in SOURCE_FIELDS:
+        if field in entry:
+            return entry[field]
+    raise KeyError(f"Row has none of {SOURCE_FIELDS}")
+
+
+def pack_rows(data, fields, scheme=DEFAULT_SCHEME):
+    """Moves each compressed field into entry['keep_masks'][field]; returns {field: fallback rows}."""
+    fallbacks = dict.fromkeys(fields, 0)
+    for entry in data:
+        original = source_text(entry)
+        masks = entry.setdefault(MASKS_FIELD, {})
+        for field in fields:
+            if field not in entry:
+                continue
+            record = encode(original, entry.pop(field), scheme)
+            fallbacks[field] += 'text' in record
+            masks[field] = record
+    return fallbacks
+
+
+def unpack_rows(data):
+    """Inverse of pack_rows, in place; rows without masks are left as they are."""
+    for entry in data:
+        masks = entry.pop(MASKS_FIELD, None)
+        if masks:
+            original = source_text(entry)
+            for field, record in masks.items():
+                entry[field] = decode(original, record)
+    return data
+
+
+def compressed_fields(data):
+    """Compressed string fields present in the rows (every question_* except the original)."""
+    fields = {}
+    for entry in data:
+        for key, value in entry.items():
+            if key.startswith('question_') and key != 'question_original' and isinstance(value, str):
+                fields[key] = None
+    return list(fields)
+
+# ==========================================
+# MAIN
+# ==========================================
+def _stats(data):
+    fields = sorted({f for entry in data for f in entry.get(MASKS_FIELD, {})})
+    print(f"{'Field':<30} {'rows':>6} {'kept':>7} {'text':>6}")
+    for field in fields:
+        records = [entry[MASKS_FIELD][field] for entry in data if field in entry.get(MASKS_FIELD, {})]
+        masks = [r for r in records if 'text' not in r]
+        ratio = sum(map(keep_ratio, masks)) / len(masks) if masks else 0.0
+        print(f"{field:<30} {len(records):>6} {ratio:>7.3f} {len(records) - len(masks):>6}")
+    print("\nMean Jaccard overlap of kept words:")
+    for i, a in enumerate(fields):
+        for b in fields[i + 1:]:
+            pairs = [(e[MASKS_FIELD][a], e[MASKS_FIELD][b]) for e in data
+                     if a in e.get(MASKS_FIELD, {}) and b in e[MASKS_FIELD]
+                     and 'text' not in e[MASKS_FIELD][a] and 'text' not in e[MASKS_FIELD][b]]
+            if pairs:
+                print(f"  {a} / {b}: {sum(jaccard(x, y) for x, y in pairs) / len(pairs):.3f} ({len(pairs)} rows)")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Keep-mask storage for compressed prompt fields.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    pack = sub.add_parser("pack", help="compressed strings -> keep masks")
+    pack.add_argument("input")
+    pack.add_argument("output")
+    pack.add_argument("--fields", default=None, help="comma-separated (default: every question_* field)")
+    pack.add_argument("--scheme", choices=("rle", "bits"), default=DEFAULT_SCHEME)
+    unpack = sub.add_parser("unpack", help="keep masks -> compressed strings")
+    unpack.add_argument("input")
+    unpack.add_argument("output")
+    stats = sub.add_parser("stats", help="keep ratio and overlap between methods")
+    stats.add_argument("input")
+    args = parser.parse_args(argv)
+
+    from compact_dataset import load_rows
+    start = time.perf_counter()
+    if args.command == "stats":
+        with open(args.input, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        if not any(MASKS_FIELD in entry for entry in data):
+            pack_rows(data, compressed_fields(data))
+        _stats(data)
+        return 0
+
+    if args.command == "pack":
+        with open(args.input, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        fields = args.fields.split(",") if args.fields else compressed_fields(data)
+        fallbacks = pack_rows(data, fields, args.scheme)
+        for field, count in fallbacks.items():
+            print(f"  {field}: {len(data) - count} masks, {count} stored as text")
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False)
+    else:
+        # Righe espanse e scritte una alla volta (anche dal formato compatto)
+        from dataset_gsm8k import write_json_rows
+        write_json_rows(load_rows(args.input, lazy=True), args.output, indent=4, ensure_ascii=False)
+    size_in, size_out = os.path.getsize(args.input), os.path.getsize(args.output)
+    print(f"{args.input}: {size_in / 2**20:.2f} MB -> {args.output}: {size_out / 2**20:.2f} MB "
+          f"in {time.perf_counter() - start:.2f}s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,127 @@
+"""
+spaCy-backed linguistic compression (the "linguistic rules" of the README):
+same removal rules as the numeric tier (rule_based_numeric.removable), but
+with the POS tags of en_core_web_sm in context instead of a lexicon lookup.
+
+Throughput matters more than anything else here:
+  - only the tagger runs: parser, NER and lemmatizer are disabled;
+  - texts go through nlp.pipe in batches (and n_process worker processes);
+  - prompts are split at demonstration separators and every distinct
+    demonstration is analysed once: with 8 shots drawn from a few hundred
+    problems, most demonstrations repeat across rows. Docs stay in an LRU
+    cache for the next call.
+
+    python cut_prompt_merge_llmlingua2.py --linguistic   # -> question_linguistic
+"""
+import re
+from collections import OrderedDict
+
+from compressor_models import DEMO_SEPARATOR
+from pos_lexicon import KEEP_TAGS, SPACY_MODEL, load_lexicon
+from protected_spans import split_segments
+from rule_based import normalize_word
+from rule_based_numeric import QUANTITY_TAGS, removable
+
+# ==========================================
+# CONFIGURATION
+# ==========================================
+DISABLED_COMPONENTS = ["parser", "ner", "lemmatizer"]  # pos_ viene da tagger + attribute_ruler
+BATCH_SIZE = 64
+N_PROCESS = 1          # >1: spaCy avvia i suoi worker (conviene solo su dataset grandi)
+DOC_CACHE_SIZE = 4096  # dimostrazioni analizzate tenute in memoria
+
+_SPACES = re.compile(r'[ \t]+')
+_LINE_EDGES = re.compile(r' *\n *')
+_PIECE_END = re.compile(re.escape(DEMO_SEPARATOR) + r'\s*|\n[ \t]*\n\s*')
+
+
+def split_demonstrations(text):
+    """
+    Pieces of `text` that end at a demonstration separator or a blank line,
+    trailing whitespace included, so the same demonstration is the same
+    string in every prompt; ''.join gives back the text.
+    """
+    pieces, pos = [], 0
+    for match in _PIECE_END.finditer(text):
+        pieces.append(text[pos:match.end()])
+        pos = match.end()
+    if pos < len(text):
+        pieces.append(text[pos:])
+    return pieces
+
+
+def _token_info(token):
+    if token.like_num or any(c.isdigit() for c in token.text):
+        return 'NUM', True
+    tag = load_lexicon().get(normalize_word(token.text))
+    if tag not in KEEP_TAGS:
+        tag = token.pos_
+    return tag, tag in QUANTITY_TAGS or token.text in ('$', '%')
+
+
+def compress_doc(doc):
+    words = [t.text for t in doc]
+    infos = [_token_info(t) for t in doc]
+    out = "".join(t.text_with_ws for i, t in enumerate(doc) if not removable(i, words, infos))
+    return _LINE_EDGES.sub("\n", _SPACES.sub(" ", out))
+
+
+class LinguisticCompressor:
+    """nlp.pipe-batched compressor with a Doc cache keyed by demonstration text."""
+
+    def __init__(self, model=SPACY_MODEL, batch_size=BATCH_SIZE, n_process=N_PROCESS, cache_size=DOC_CACHE_SIZE):
+        import spacy
+        self.nlp = spacy.load(model, disable=DISABLED_COMPONENTS)
+        self.batch_size = batch_size
+        self.n_process = n_process
+        self.cache_size = cache_size
+        self.docs = OrderedDict()
+        self.stats = {'pieces': 0, 'cache_hits': 0, 'analysed': 0}
+
+    def _analyse(self, pieces):
+        """piece -> Doc for every piece; only the ones never seen go through nlp.pipe."""
+        found, missing = {}, []
+        for piece in pieces:
+            self.stats['pieces'] += 1
+            if piece in found:
+                self.stats['cache_hits'] += 1
+            elif piece in self.docs:
+                self.docs.move_to_end(piece)
+                found[piece] = self.docs[piece]
+                self.stats['cache_hits'] += 1
+            else:
+                found[piece] = None
+                missing.append(piece)
+        docs = self.nlp.pipe(missing, batch_size=self.batch_size, n_process=self.n_process)
+        for piece, doc in zip(missing, docs):
+            found[piece] = doc
+            self.docs[piece] = doc
+            if len(self.docs) > self.cache_size:
+                self.docs.popitem(last=False)
+        self.stats['analysed'] += len(missing)
+        return found
+
+    def compress_many(self, texts, protected_spans=None):
+        """Compressed texts; protected spans (one list per text) are copied verbatim and never analysed."""
+        protected_spans = protected_spans or [None] * len(texts)
+        layouts = []  # per testo: [(testo verbatim, None) | (None, [pezzi])]
+        all_pieces = []
+        for text, spans in zip(texts, protected_spans):
+            layout = []
+            for segment, protected in split_segments(text, spans or []):
+                if protected:
+                    layout.append((segment, None))
+                else:
+                    pieces = split_demonstrations(segment)
+                    layout.append((None, pieces))
+                    all_pieces.extend(pieces)
+            layouts.append(layout)
+
+        docs = self._analyse(all_pieces)
+        compressed = {piece: compress_doc(doc) for piece, doc in docs.items()}
+        return ["".join(verbatim if pieces is None else "".join(compressed[p] for p in pieces)
+                        for verbatim, pieces in layout).strip()
+                for layout in layouts]
+
+    def compress(self, text, protected_spans=None):
+        return self.compress_many([text], [protected_spans])[0]
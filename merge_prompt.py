@@ -1,5 +1,7 @@
+import argparse
 import json
 import random
+from profiling import span, start_profiling, finish_profiling
 
 # ==========================================
 # 1. CONFIGURAZIONE
@@ -8,79 +10,185 @@ INPUT_FILE = "datasets/gsm8k_test_set_300.json"
 OUTPUT_FILE = "datasets/dataset_gsm8k_formatted_8shot.json"
 
 # Numero di esempi (Shots) da inserire nel contesto.
-# Per simulare un prompt "Full-Shot" pesante (come nel paper), 
+# Per simulare un prompt "Full-Shot" pesante (come nel paper),
 # idealmente dovresti metterne tra 4 e 8, dipendente dalla lunghezza media.
-NUM_SHOTS = 8 
+NUM_SHOTS = 8
 
-random.seed(42) # Per riproducibilità
+SEED = 42 # Per riproducibilità
+
+# Selezione delle dimostrazioni: 'random' (random.sample) o 'bm25' (le più simili al target, vedi demo_retrieval.py)
+RETRIEVAL = 'random'
+
+# Template del prompt (contesto = istruzione + dimostrazioni, target = domanda attuale)
+INSTRUCTION = "Instruction: Answer the following math problems reasoning step by step.\n\n"
+DEMO_TEMPLATE = "Question: {question}\nAnswer: {answer}\n###\n\n"  # "###": separatore chiaro
+TARGET_TEMPLATE = "Question: {question}\nAnswer: Let's think step by step."
 
 # ==========================================
-# 2. CARICAMENTO DATI
+# 2. SELEZIONE ESEMPI
 # ==========================================
-try:
-    with open(INPUT_FILE, 'r', encoding='utf-8') as f:
-        input_data = json.load(f)
-except FileNotFoundError:
-    print(f"Errore: File {INPUT_FILE} non trovato. Creo dati dummy per test.")
-    input_data = [{"question": f"Q{i}", "answer": f"A{i}"} for i in range(10)]
+def sample_demo_indices(rng, n, i, k):
+    """
+    k indici distinti in range(n) diversi da i, senza copiare il pool.
+    rng.sample dipende solo dalla lunghezza della popolazione: campionare
+    range(n - 1) e spostare di uno gli indici >= i dà esattamente gli stessi
+    esempi di rng.sample(input_data[:i] + input_data[i+1:], k).
+    """
+    return [j + 1 if j >= i else j for j in rng.sample(range(n - 1), k)]
+
+
+def row_rng(seed, i):
+    """RNG indipendente per la riga i: le righe si possono generare in qualsiasi ordine (o in parallelo)."""
+    return random.Random(f"{seed}:{i}")
 
 # ==========================================
 # 3. GENERAZIONE PROMPT
 # ==========================================
-processed_data = []
-
-print(f"Elaborazione di {len(input_data)} elementi con {NUM_SHOTS}-shot CoT...")
-
-for i, target_item in enumerate(input_data):
-    
-    # --- A. Selezione Esempi (Context) ---
-    # Escludiamo l'elemento corrente per evitare data leakage
-    candidates = input_data[:i] + input_data[i+1:]
-    
-    # Se non ci sono abbastanza candidati, ne prendiamo il massimo possibile
-    k = min(NUM_SHOTS, len(candidates))
-    examples = random.sample(candidates, k)
-    
-    # --- B. Costruzione della parte CONTESTO (da comprimere) ---
+TEMPLATES = {'instruction': INSTRUCTION, 'demo': DEMO_TEMPLATE, 'target': TARGET_TEMPLATE}
+
+
+def build_context(examples, templates=TEMPLATES):
     # Questa è la parte "grassa" che LLMLingua dovrà aggredire.
     # Include l'istruzione generale e gli esempi risolti.
-    context_str = "Instruction: Answer the following math problems reasoning step by step.\n\n"
-    
-    for ex in examples:
-        context_str += f"Question: {ex['question']}\n"
-        context_str += f"Answer: {ex['answer']}\n"
-        context_str += "###\n\n" # Separatore chiaro
-        
-    # --- C. Costruzione della parte TARGET (da preservare) ---
-    # Questa è la domanda attuale. È fondamentale che il modello veda i numeri
-    # di QUESTA domanda, quindi idealmente questa parte non va compressa (o pochissimo).
-    # Aggiungiamo il trigger CoT "Let's think step by step".
-    target_str = f"Question: {target_item['question']}\n"
-    target_str += "Answer: Let's think step by step."
-
-    # --- D. Unione (Full Prompt) ---
-    full_prompt = context_str + target_str
+    demo = templates['demo']
+    return templates['instruction'] + "".join(demo.format(question=ex['question'], answer=ex['answer']) for ex in examples)
+
+
+def build_target(item, templates=TEMPLATES):
+    # È fondamentale che il modello veda i numeri di QUESTA domanda,
+    # quindi questa parte non va compressa (vedi protected_spans).
+    return templates['target'].format(question=item['question'])
 
-    # --- E. Salvataggio ---
-    entry = {
+
+def build_entry(target_item, examples, templates=TEMPLATES):
+    context_str = build_context(examples, templates)
+    target_str = build_target(target_item, templates)
+    full_prompt = context_str + target_str
+    return {
         # I campi richiesti tassativamente da te:
         "question": full_prompt,      # Il prompt intero (Context + Target)
         "answer": target_item['answer'], # La risposta corretta (Ground Truth)
-        
+
         # Campi EXTRA (Utili per LLMLingua per separare la compressione):
         "context_only": context_str,
-        "target_only": target_str
+        "target_only": target_str,
+        # Offset del target in "question": i compressori lo lasciano intatto (vedi protected_spans.py)
+        "protected_spans": [[len(context_str), len(full_prompt)]]
     }
-    processed_data.append(entry)
+
+
+def sample_rows(n, num_shots=NUM_SHOTS, seed=SEED, per_row_seed=False, start=0, stop=None):
+    """
+    (target index, demo indices) per le righe start..stop, O(n * num_shots) in tutto.
+    per_row_seed=False: un unico RNG sequenziale, identico alle vecchie
+    esecuzioni con random.seed(seed) (richiede start=0).
+    per_row_seed=True: un RNG per riga (row_rng), indipendente dall'ordine.
+    """
+    stop = n if stop is None else stop
+    k = min(num_shots, max(0, n - 1))  # se non ci sono abbastanza candidati, il massimo possibile
+    rng = None if per_row_seed else random.Random(seed)
+    for i in range(start, stop):
+        # Escludiamo l'elemento corrente per evitare data leakage
+        yield i, sample_demo_indices(row_rng(seed, i) if per_row_seed else rng, n, i, k)
+
+
+def demo_rows(input_data, num_shots=NUM_SHOTS, seed=SEED, per_row_seed=False, start=0, stop=None, retrieval=RETRIEVAL):
+    """(target index, demo indices): sample_rows per 'random', demo_retrieval.retrieve_rows per 'bm25'."""
+    if retrieval == 'bm25':
+        from demo_retrieval import retrieve_rows
+        return retrieve_rows([item['question'] for item in input_data], num_shots, start=start, stop=stop)
+    if retrieval != 'random':
+        raise ValueError(f"Unknown retrieval '{retrieval}' (random, bm25)")
+    return sample_rows(len(input_data), num_shots, seed, per_row_seed, start, stop)
+
+
+def build_rows(input_data, num_shots=NUM_SHOTS, seed=SEED, per_row_seed=False, start=0, stop=None, retrieval=RETRIEVAL):
+    """Righe formattate (vedi sample_rows per il seeding)."""
+    for i, demos in demo_rows(input_data, num_shots, seed, per_row_seed, start, stop, retrieval):
+        yield build_entry(input_data[i], [input_data[j] for j in demos])
+
+
+_pool_data = {}
+
+
+def _init_pool(input_data, num_shots, seed):
+    _pool_data.update(input_data=input_data, num_shots=num_shots, seed=seed)
+
+
+def _build_chunk(bounds):
+    start, stop = bounds
+    return list(build_rows(_pool_data['input_data'], _pool_data['num_shots'], _pool_data['seed'],
+                           per_row_seed=True, start=start, stop=stop))
+
+
+def build_rows_parallel(input_data, num_shots=NUM_SHOTS, seed=SEED, workers=4, chunk_rows=500):
+    """Come build_rows(per_row_seed=True), su `workers` processi; l'ordine delle righe è preservato."""
+    from multiprocessing import Pool
+    chunks = [(s, min(s + chunk_rows, len(input_data))) for s in range(0, len(input_data), chunk_rows)]
+    with Pool(workers, initializer=_init_pool, initargs=(input_data, num_shots, seed)) as pool:
+        return [row for rows in pool.imap(_build_chunk, chunks) for row in rows]
 
 # ==========================================
-# 4. SALVATAGGIO OUTPUT
+# 4. MAIN
 # ==========================================
-with open(OUTPUT_FILE, 'w', encoding='utf-8') as f:
-    json.dump(processed_data, f, indent=4, ensure_ascii=False)
-
-print(f"Salvato in: {OUTPUT_FILE}")
-print("-" * 30)
-print(f"Esempio struttura finale (primo elemento):")
-print(f"LUNGHEZZA TOTALE: ~{len(processed_data[0]['question'].split())} parole")
-print(f"KEYS DISPONIBILI: {list(processed_data[0].keys())}")
\ No newline at end of file
+def load_input(path):
+    try:
+        with span("json_load"), open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        print(f"Errore: File {path} non trovato. Creo dati dummy per test.")
+        return [{"question": f"Q{i}", "answer": f"A{i}"} for i in range(10)]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Few-shot prompt builder (context + target) for GSM8K.")
+    parser.add_argument("--input", default=INPUT_FILE)
+    parser.add_argument("--output", default=OUTPUT_FILE)
+    parser.add_argument("--shots", type=int, default=NUM_SHOTS)
+    parser.add_argument("--seed", type=int, default=SEED)
+    parser.add_argument("--per-row-seed", action="store_true",
+                        help="one RNG per row (order independent); default reproduces random.seed(SEED) runs")
+    parser.add_argument("--workers", type=int, default=1, help="processes (implies --per-row-seed)")
+    parser.add_argument("--retrieval", choices=("random", "bm25"), default=RETRIEVAL,
+                        help="bm25: the most similar problems as demonstrations (demo_retrieval.py)")
+    parser.add_argument("--compact", action="store_true",
+                        help="write the compact format (problems once, rows as indices; see compact_dataset.py)")
+    args = parser.parse_args(argv)
+
+    start_profiling("merge_prompt")
+    input_data = load_input(args.input)
+    print(f"Elaborazione di {len(input_data)} elementi con {args.shots}-shot CoT...")
+
+    if args.compact:
+        from compact_dataset import CompactDataset
+        with span("build_compact"):
+            dataset = CompactDataset.build(input_data, args.shots, args.seed, args.per_row_seed or args.workers > 1,
+                                           args.retrieval)
+        with span("json_dump"):
+            dataset.save(args.output)
+        print(f"Salvato in: {args.output} ({len(dataset)} righe, {len(dataset.items)} problemi)")
+        finish_profiling()
+        return
+
+    with span("build_prompts"):
+        if args.workers > 1 and args.retrieval == 'random':
+            processed_data = build_rows_parallel(input_data, args.shots, args.seed, args.workers)
+        else:
+            # bm25: un solo indice in memoria, le query costano microsecondi
+            processed_data = list(build_rows(input_data, args.shots, args.seed, args.per_row_seed,
+                                             retrieval=args.retrieval))
+
+    with span("json_dump"), open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(processed_data, f, indent=4, ensure_ascii=False)
+
+    print(f"Salvato in: {args.output}")
+    print("-" * 30)
+    print(f"Esempio struttura finale (primo elemento):")
+    print(f"LUNGHEZZA TOTALE: ~{len(processed_data[0]['question'].split())} parole")
+    print(f"KEYS DISPONIBILI: {list(processed_data[0].keys())}")
+
+    finish_profiling()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,239 @@
+"""
+Local mock of an OpenAI/Groq-compatible chat-completions endpoint.
+
+Simulates the cost model that matters for prompt compression:
+
+    latency = BASE_LATENCY + prefill_s_per_token * input_tokens
+                           + decode_s_per_token  * output_tokens
+
+plus a fixed number of concurrent "GPU slots" (requests beyond that queue on
+the server) and a token-bucket rate limit on requests/min and tokens/min that
+answers 429 with a Retry-After header, like the real API.
+
+Served paths: /openai/v1/chat/completions (Groq SDK) and /v1/chat/completions.
+stream=true is answered with SSE chunks; the first chunk arrives after the
+prefill time, and the last one carries usage in x_groq, like Groq.
+
+Standalone:
+    python mock_llm_server.py --port 8765 --rpm 300
+Then point the Groq client at it: Groq(api_key="mock", base_url="http://127.0.0.1:8765").
+"""
+import argparse
+import json
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# ==========================================
+# DEFAULT SIMULATION PARAMETERS
+# ==========================================
+BASE_LATENCY = 0.05          # s, network + scheduling overhead
+PREFILL_S_PER_TOKEN = 0.0002 # s per input token
+DECODE_S_PER_TOKEN = 0.004   # s per output token
+OUTPUT_TOKENS = 180          # simulated completion length (capped by max_tokens)
+SLOTS = 8                    # concurrent requests served at once
+RATE_LIMIT_RPM = 0           # requests per minute, 0 = unlimited
+RATE_LIMIT_TPM = 0           # input+output tokens per minute, 0 = unlimited
+STREAM_CHUNK_TOKENS = 16     # tokens per SSE chunk
+
+_TOKEN_RE = re.compile(r"\w+|[^\w\s]")
+
+
+def count_tokens(text):
+    """Cheap tokenizer stand-in: words and punctuation marks."""
+    return len(_TOKEN_RE.findall(text or ""))
+
+
+class TokenBucket:
+    """Refills continuously at capacity/60 per second."""
+
+    def __init__(self, per_minute):
+        self.capacity = per_minute
+        self.level = float(per_minute)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def take(self, amount):
+        """Returns 0 if granted, else the seconds to wait before retrying."""
+        if self.capacity <= 0:
+            return 0.0
+        with self.lock:
+            now = time.monotonic()
+            rate = self.capacity / 60.0
+            self.level = min(self.capacity, self.level + (now - self.updated) * rate)
+            self.updated = now
+            if self.level >= amount:
+                self.level -= amount
+                return 0.0
+            return (amount - self.level) / rate
+
+
+class SimulationConfig:
+    def __init__(self, base_latency=BASE_LATENCY, prefill=PREFILL_S_PER_TOKEN, decode=DECODE_S_PER_TOKEN,
+                 output_tokens=OUTPUT_TOKENS, slots=SLOTS, rpm=RATE_LIMIT_RPM, tpm=RATE_LIMIT_TPM):
+        self.base_latency = base_latency
+        self.prefill = prefill
+        self.decode = decode
+        self.output_tokens = output_tokens
+        self.slots = threading.BoundedSemaphore(slots)
+        self.requests_bucket = TokenBucket(rpm)
+        self.tokens_bucket = TokenBucket(tpm)
+        self.lock = threading.Lock()
+        self.counters = {'requests': 0, 'rate_limited': 0, 'input_tokens': 0, 'output_tokens': 0}
+
+    def count(self, **deltas):
+        with self.lock:
+            for key, value in deltas.items():
+                self.counters[key] += value
+
+
+def _completion_text(n_tokens):
+    # Risposta fittizia in formato GSM8K: il contenuto non conta, solo la lunghezza
+    body = " ".join(["step"] * max(0, n_tokens - 2))
+    return f"{body} #### 0".strip()
+
+
+class MockChatHandler(BaseHTTPRequestHandler):
+    server_version = "MockLLM/1.0"
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass  # silenzioso: il driver stampa le sue statistiche
+
+    def do_POST(self):
+        if not self.path.rstrip('/').endswith('/chat/completions'):
+            self._send_json(404, {'error': {'message': f'Unknown path {self.path}'}})
+            return
+        length = int(self.headers.get('Content-Length', 0))
+        try:
+            payload = json.loads(self.rfile.read(length) or b'{}')
+        except json.JSONDecodeError:
+            self._send_json(400, {'error': {'message': 'Invalid JSON body'}})
+            return
+
+        cfg = self.server.sim
+        prompt = "\n".join(str(m.get('content', '')) for m in payload.get('messages', []))
+        input_tokens = count_tokens(prompt)
+        output_tokens = min(cfg.output_tokens, int(payload.get('max_tokens') or cfg.output_tokens))
+
+        wait = max(cfg.requests_bucket.take(1), cfg.tokens_bucket.take(input_tokens + output_tokens))
+        if wait > 0:
+            cfg.count(rate_limited=1)
+            self._send_json(429, {'error': {
+                'message': 'Rate limit reached (mock). Please try again later.',
+                'type': 'tokens', 'code': 'rate_limit_exceeded'}},
+                headers={'retry-after': f"{wait:.2f}"})
+            return
+
+        cfg.count(requests=1, input_tokens=input_tokens, output_tokens=output_tokens)
+        with cfg.slots:
+            prefill_time = cfg.base_latency + cfg.prefill * input_tokens
+            if payload.get('stream'):
+                self._stream(payload, prefill_time, input_tokens, output_tokens)
+                return
+            time.sleep(prefill_time + cfg.decode * output_tokens)
+            self._send_json(200, self._completion(payload, input_tokens, output_tokens))
+
+    def _completion(self, payload, input_tokens, output_tokens):
+        return {
+            'id': f"chatcmpl-{uuid.uuid4().hex[:12]}",
+            'object': 'chat.completion',
+            'created': int(time.time()),
+            'model': payload.get('model', 'mock'),
+            'choices': [{
+                'index': 0,
+                'message': {'role': 'assistant', 'content': _completion_text(output_tokens)},
+                'finish_reason': 'stop',
+            }],
+            'usage': {
+                'prompt_tokens': input_tokens,
+                'completion_tokens': output_tokens,
+                'total_tokens': input_tokens + output_tokens,
+            },
+        }
+
+    def _stream(self, payload, prefill_time, input_tokens, output_tokens):
+        cfg = self.server.sim
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        self.close_connection = True
+
+        base = {'id': f"chatcmpl-{uuid.uuid4().hex[:12]}", 'object': 'chat.completion.chunk',
+                'created': int(time.time()), 'model': payload.get('model', 'mock')}
+        words = _completion_text(output_tokens).split(" ")
+        time.sleep(prefill_time)
+        sent = 0
+        while sent < len(words):
+            piece = words[sent:sent + STREAM_CHUNK_TOKENS]
+            if sent:
+                time.sleep(cfg.decode * len(piece))
+            text = (" " if sent else "") + " ".join(piece)
+            sent += len(piece)
+            chunk = dict(base, choices=[{'index': 0, 'delta': {'content': text}, 'finish_reason': None}])
+            self._write_event(chunk)
+        usage = {'prompt_tokens': input_tokens, 'completion_tokens': output_tokens,
+                 'total_tokens': input_tokens + output_tokens}
+        final = dict(base, choices=[{'index': 0, 'delta': {}, 'finish_reason': 'stop'}], x_groq={'usage': usage})
+        self._write_event(final)
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+
+    def _write_event(self, obj):
+        self.wfile.write(f"data: {json.dumps(obj)}\n\n".encode('utf-8'))
+        self.wfile.flush()
+
+    def _send_json(self, status, obj, headers=None):
+        body = json.dumps(obj).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def start_server(host="127.0.0.1", port=0, **sim_kwargs):
+    """Starts the mock in a daemon thread. Returns (server, base_url)."""
+    server = ThreadingHTTPServer((host, port), MockChatHandler)
+    server.daemon_threads = True
+    server.sim = SimulationConfig(**sim_kwargs)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server, f"http://{host}:{server.server_address[1]}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mock chat-completions server with a latency model.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--base-latency", type=float, default=BASE_LATENCY)
+    parser.add_argument("--prefill", type=float, default=PREFILL_S_PER_TOKEN, help="seconds per input token")
+    parser.add_argument("--decode", type=float, default=DECODE_S_PER_TOKEN, help="seconds per output token")
+    parser.add_argument("--output-tokens", type=int, default=OUTPUT_TOKENS)
+    parser.add_argument("--slots", type=int, default=SLOTS)
+    parser.add_argument("--rpm", type=int, default=RATE_LIMIT_RPM)
+    parser.add_argument("--tpm", type=int, default=RATE_LIMIT_TPM)
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer((args.host, args.port), MockChatHandler)
+    server.daemon_threads = True
+    server.sim = SimulationConfig(args.base_latency, args.prefill, args.decode, args.output_tokens,
+                                  args.slots, args.rpm, args.tpm)
+    print(f"Mock LLM server on http://{args.host}:{args.port} (Ctrl+C to stop)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(f"Counters: {server.sim.counters}")
+
+
+if __name__ == "__main__":
+    main()
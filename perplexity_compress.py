@@ -0,0 +1,238 @@
+"""
+Batched LLMLingua-1-style compression with KV-cache reuse.
+
+The LLMLingua-1 path (compressor_models.compress_llmlingua1, llmlingua's
+compress_prompt) runs one prompt at a time and re-tokenises it for the
+target_token statistics. Here the small causal LM (gpt2 / TinyLlama) is
+driven directly:
+
+  - prompts are compressed in padded batches (similar lengths together);
+  - each prompt is cut into segments of SEGMENT_TOKENS tokens at word
+    boundaries and processed iteratively, as in LLMLingua-1's token-level
+    filter: a segment is scored conditioned on the already compressed
+    prefix, the least surprising words (lowest mean NLL) are dropped, and
+    the KV cache is sliced at the kept positions and reused for the next
+    segment instead of recomputing the prefix;
+  - batched KV caches are left-padded with an attention mask, and
+    position_ids continue from each prompt's own kept length;
+  - word tokenisations are cached (GSM8K reuses a small vocabulary).
+
+Selection is per whitespace word (same unit as the other compressors, so the
+output is extractive and fits keep_mask.py); force tokens are always kept.
+
+    python compress_dataset.py --methods llmlingua1_kv --rate 0.5
+"""
+from compressor_models import DEFAULT_FORCE_TOKENS, LLMLINGUA1_MODEL, apply_keep, select_keep
+from protected_spans import compress_unprotected, split_segments
+
+# ==========================================
+# CONFIGURATION
+# ==========================================
+BATCH_SIZE = 8          # prompt per forward
+SEGMENT_TOKENS = 128    # token per segmento (iterazione)
+
+
+def _to_cache(legacy):
+    """Legacy [(key, value)] per layer -> DynamicCache (update() exists in every transformers version)."""
+    if legacy is None:
+        return None
+    from transformers import DynamicCache
+    cache = DynamicCache()
+    for layer, (key, value) in enumerate(legacy):
+        cache.update(key, value, layer)
+    return cache
+
+
+def _to_legacy(cache):
+    if hasattr(cache, 'to_legacy_cache'):
+        return cache.to_legacy_cache()
+    if hasattr(cache, 'layers'):
+        return [(layer.keys, layer.values) for layer in cache.layers]
+    return cache
+
+
+class PerplexityCompressor:
+    """Small causal LM word filter, batched, with the compressed prefix kept in the KV cache."""
+
+    def __init__(self, model, tokenizer, device="cpu", batch_size=BATCH_SIZE, segment_tokens=SEGMENT_TOKENS):
+        self.model = model.eval()
+        self.tokenizer = tokenizer
+        self.device = device
+        self.batch_size = batch_size
+        config = model.config
+        self.max_positions = getattr(config, 'max_position_embeddings', None) or getattr(config, 'n_positions', 1024)
+        self.segment_tokens = min(segment_tokens, self.max_positions)
+        self.pad_id = tokenizer.pad_token_id if tokenizer.pad_token_id is not None else tokenizer.eos_token_id
+        self._word_ids = {}
+        self.stats = {'forwards': 0, 'tokens_scored': 0, 'tokens_reused': 0, 'resets': 0}
+
+    @classmethod
+    def load(cls, model_name=LLMLINGUA1_MODEL, device="cpu", dtype=None, **kwargs):
+        """CPU float32 by default, like load_llmlingua1; llmlingua itself is not needed."""
+        import torch
+        from transformers import AutoModelForCausalLM, AutoTokenizer
+        tokenizer = AutoTokenizer.from_pretrained(model_name)
+        model = AutoModelForCausalLM.from_pretrained(model_name, torch_dtype=dtype or torch.float32).to(device)
+        return cls(model, tokenizer, device, **kwargs)
+
+    @classmethod
+    def from_compressor(cls, compressor, **kwargs):
+        """Reuses the model of an llmlingua PromptCompressor (load_llmlingua1)."""
+        return cls(compressor.model, compressor.tokenizer, compressor.device, **kwargs)
+
+    def word_ids(self, words):
+        """Token ids of each word with its leading space (cached)."""
+        cache = self._word_ids
+        missing = list({w for w in words if w not in cache})
+        if missing:
+            encoded = self.tokenizer([" " + w for w in missing], add_special_tokens=False)['input_ids']
+            for word, ids in zip(missing, encoded):
+                cache[word] = ids[:self.segment_tokens] or [self.pad_id]
+        return [cache[w] for w in words]
+
+    def segments(self, word_ids):
+        """(start, end) word spans of at most segment_tokens tokens each."""
+        spans, start, used = [], 0, 0
+        for idx, ids in enumerate(word_ids):
+            if used + len(ids) > self.segment_tokens and idx > start:
+                spans.append((start, idx))
+                start, used = idx, 0
+            used += len(ids)
+        if start < len(word_ids):
+            spans.append((start, len(word_ids)))
+        return spans
+
+    def keep_masks(self, word_lists, rate, force_tokens=DEFAULT_FORCE_TOKENS):
+        """Keep mask per word list; lists of similar token length share a batch."""
+        lengths = [sum(map(len, self.word_ids(words))) for words in word_lists]
+        order = sorted(range(len(word_lists)), key=lambda i: -lengths[i])
+        masks = [None] * len(word_lists)
+        for b in range(0, len(order), self.batch_size):
+            batch = order[b:b + self.batch_size]
+            for i, keep in zip(batch, self._compress_batch([word_lists[i] for i in batch], rate, force_tokens)):
+                masks[i] = keep
+        return masks
+
+    def _compress_batch(self, word_lists, rate, force_tokens):
+        import torch
+
+        dev = self.device
+        rows = []
+        for words in word_lists:
+            ids = self.word_ids(words)
+            rows.append({'words': words, 'ids': ids, 'segments': self.segments(ids),
+                         'keep': [False] * len(words), 'past_len': 0, 'last_logits': None})
+
+        past, past_mask = None, None  # [(k, v)] per layer [B, heads, P, dim], left-padded; mask [B, P]
+        active = list(range(len(rows)))
+        step = 0
+        while True:
+            still = [r for r in active if step < len(rows[r]['segments'])]
+            if not still:
+                break
+            if past is not None and len(still) < len(active):
+                sel = torch.tensor([active.index(r) for r in still], device=dev)
+                past = [(k.index_select(0, sel), v.index_select(0, sel)) for k, v in past]
+                past_mask = past_mask.index_select(0, sel.cpu())
+            active = still
+
+            # Token del segmento corrente, con la parola di appartenenza
+            seg_tokens, owners = [], []
+            for r in active:
+                start, end = rows[r]['segments'][step]
+                toks, own = [], []
+                for w in range(start, end):
+                    toks.extend(rows[r]['ids'][w])
+                    own.extend([w - start] * len(rows[r]['ids'][w]))
+                seg_tokens.append(toks)
+                owners.append(own)
+            width = max(len(t) for t in seg_tokens)
+
+            # Finestra del modello piena: la riga riparte senza prefisso
+            for j, r in enumerate(active):
+                if rows[r]['past_len'] + width > self.max_positions:
+                    if past_mask is not None:
+                        past_mask[j] = 0
+                    rows[r]['past_len'], rows[r]['last_logits'] = 0, None
+                    self.stats['resets'] += 1
+
+            input_ids = torch.full((len(active), width), self.pad_id, dtype=torch.long)
+            seg_mask = torch.zeros((len(active), width), dtype=torch.long)
+            for j, toks in enumerate(seg_tokens):
+                input_ids[j, :len(toks)] = torch.tensor(toks)
+                seg_mask[j, :len(toks)] = 1
+            positions = torch.tensor([[rows[r]['past_len'] + t for t in range(width)] for r in active])
+            attention = seg_mask if past is None else torch.cat([past_mask, seg_mask], dim=1)
+            with torch.inference_mode():
+                out = self.model(input_ids=input_ids.to(dev), attention_mask=attention.to(dev),
+                                 position_ids=positions.clamp(max=self.max_positions - 1).to(dev),
+                                 past_key_values=_to_cache(past), use_cache=True)
+            logits = out.logits.float()
+            self.stats['forwards'] += 1
+            self.stats['tokens_scored'] += int(seg_mask.sum())
+            self.stats['tokens_reused'] += 0 if past_mask is None else int(past_mask.sum())
+
+            # NLL per token: il primo del segmento usa i logit finali del segmento precedente
+            lse = torch.logsumexp(logits, dim=-1)
+            nll = torch.full(lse.shape, float('inf'))
+            if width > 1:
+                target = logits[:, :-1].gather(2, input_ids[:, 1:, None].to(dev)).squeeze(2)
+                nll[:, 1:] = (lse[:, :-1] - target).cpu()
+
+            keep_pos = []
+            prev_len = 0 if past_mask is None else past_mask.shape[1]
+            for j, r in enumerate(active):
+                row, toks, own = rows[r], seg_tokens[j], owners[j]
+                if row['last_logits'] is not None:
+                    last = row['last_logits']
+                    nll[j, 0] = float(torch.logsumexp(last, dim=-1) - last[toks[0]])
+                row['last_logits'] = logits[j, len(toks) - 1]
+
+                start, end = row['segments'][step]
+                sums, counts = [0.0] * (end - start), [0] * (end - start)
+                for t, w in enumerate(own):
+                    sums[w] += float(nll[j, t])
+                    counts[w] += 1
+                scores = [s / c for s, c in zip(sums, counts)]
+                keep = select_keep(row['words'][start:end], scores, rate, force_tokens)
+                row['keep'][start:end] = keep
+
+                # Posizioni da tenere nella cache: il prefisso reale + i token delle parole tenute
+                kept = [prev_len + t for t, w in enumerate(own) if keep[w]]
+                keep_pos.append(list(range(prev_len - row['past_len'], prev_len)) + kept)
+                row['past_len'] += len(kept)
+
+            new_len = max(len(p) for p in keep_pos)
+            if new_len == 0:
+                past, past_mask = None, None
+            else:
+                index = torch.zeros((len(active), new_len), dtype=torch.long)
+                past_mask = torch.zeros((len(active), new_len), dtype=torch.long)
+                for j, pos in enumerate(keep_pos):
+                    if pos:
+                        index[j, new_len - len(pos):] = torch.tensor(pos)
+                        past_mask[j, new_len - len(pos):] = 1
+                index = index.to(dev)[:, None, :, None]
+                past = [(k.gather(2, index.expand(-1, k.shape[1], -1, k.shape[3])),
+                         v.gather(2, index.expand(-1, v.shape[1], -1, v.shape[3])))
+                        for k, v in _to_legacy(out.past_key_values)]
+            step += 1
+
+        return [row['keep'] for row in rows]
+
+    def compress_many(self, texts, rate, force_tokens=DEFAULT_FORCE_TOKENS, protected_spans=None):
+        """
+        Compressed texts (kept words joined by spaces); protected spans (one list
+        per text) are not scored and stay verbatim, the rest of every text in
+        one batched pass.
+        """
+        protected_spans = protected_spans or [None] * len(texts)
+        segment_lists = [
+            [seg.strip() for seg, protected in split_segments(text, spans) if not protected and seg.strip()]
+            if spans else [text]
+            for text, spans in zip(texts, protected_spans)
+        ]
+        flat = [seg.split() for segments in segment_lists for seg in segments]
+        masks = iter(self.keep_masks(flat, rate, force_tokens))
+        return [compress_unprotected(text, spans, lambda segments: [apply_keep(s.split(), next(masks)) for s in segments])
+                for text, spans in zip(texts, protected_spans)]
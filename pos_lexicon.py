@@ -0,0 +1,146 @@
+"""
+Precompiled word -> tag lexicon for the numeric-aware rule tier
+(rule_based_numeric.py): a dictionary lookup per word instead of a spaCy
+pipeline per prompt.
+
+Tags are spaCy's universal POS tags (DET, PRON, ADP, ADV, CCONJ, ...) plus
+four of ours that the tier never removes:
+  NUM  number words (one, twelve, half, dozen, ...)
+  UNIT units and time spans (dollars, hours, miles, week, %)
+  QTY  quantity modifiers (more, only, per, every, each, than, total, ...)
+  NEG  negations (not, no, never, ...)
+
+The built-in table covers the closed-class words of rule_based plus the four
+keep-classes. For open-class words, build the table once with spaCy over the
+dataset vocabulary (most frequent tag per word):
+
+    python pos_lexicon.py build --input datasets/dataset_gsm8k_formatted_8shot.json
+
+load_lexicon() layers it as: built-in closed classes < spaCy table < keep-classes.
+Words missing from the lexicon are kept.
+"""
+import argparse
+import json
+import os
+import sys
+from collections import Counter, defaultdict
+from functools import lru_cache
+
+import rule_based
+
+# ==========================================
+# CONFIGURATION
+# ==========================================
+LEXICON_FILE = "models/pos_lexicon.json"
+SPACY_MODEL = "en_core_web_sm"
+BUILD_INPUT = "datasets/dataset_gsm8k_formatted_8shot.json"
+
+NUMBER_WORDS = {
+    'zero', 'one', 'two', 'three', 'four', 'five', 'six', 'seven', 'eight', 'nine', 'ten',
+    'eleven', 'twelve', 'thirteen', 'fourteen', 'fifteen', 'sixteen', 'seventeen', 'eighteen',
+    'nineteen', 'twenty', 'thirty', 'forty', 'fifty', 'sixty', 'seventy', 'eighty', 'ninety',
+    'hundred', 'hundreds', 'thousand', 'thousands', 'million', 'millions', 'billion',
+    'first', 'second', 'third', 'fourth', 'fifth', 'sixth', 'seventh', 'eighth', 'ninth', 'tenth',
+    'half', 'halves', 'quarter', 'quarters', 'thirds', 'fourths', 'fifths',
+    'twice', 'thrice', 'double', 'triple', 'quadruple', 'dozen', 'dozens', 'pair', 'pairs', 'couple'
+}
+UNITS = {
+    'dollar', 'dollars', 'cent', 'cents', 'euro', 'euros', 'pound', 'pounds',
+    'percent', 'percentage', '%', '$',
+    'second', 'seconds', 'minute', 'minutes', 'hour', 'hours', 'day', 'days', 'week', 'weeks',
+    'weekday', 'weekdays', 'weekend', 'weekends', 'month', 'months', 'year', 'years',
+    'inch', 'inches', 'foot', 'feet', 'yard', 'yards', 'mile', 'miles', 'meter', 'meters',
+    'kilometer', 'kilometers', 'km', 'cm', 'mm', 'm',
+    'ounce', 'ounces', 'oz', 'gram', 'grams', 'kilogram', 'kilograms', 'kg', 'lb', 'lbs', 'ton', 'tons',
+    'liter', 'liters', 'gallon', 'gallons', 'cup', 'cups', 'mph'
+}
+QUANTITY_MODIFIERS = {
+    'more', 'most', 'less', 'least', 'fewer', 'only', 'per', 'every', 'each', 'all', 'both', 'total',
+    'than', 'times', 'extra', 'remaining', 'left', 'another', 'rest', 'twice', 'as', 'same',
+    'equal', 'equally', 'sum', 'difference', 'average', 'altogether', 'combined', 'respectively',
+    'after', 'before', 'until', 'since', 'between', 'among', 'out', 'off', 'without'
+}
+NEGATIONS = {'not', "n't", 'no', 'never', 'none', 'nothing', 'neither', 'nor', 'cannot'}
+
+KEEP_TAGS = {'NUM', 'UNIT', 'QTY', 'NEG'}
+
+_CLOSED_CLASSES = [
+    (rule_based.ARTICLES, 'DET'),
+    (rule_based.PRONOUNS, 'PRON'),
+    (rule_based.ADVERBS, 'ADV'),
+    (rule_based.PREPOSITIONS, 'ADP'),
+    (rule_based.CONJUNCTIONS, 'CCONJ'),
+]
+_KEEP_CLASSES = [
+    (UNITS, 'UNIT'),
+    (QUANTITY_MODIFIERS, 'QTY'),
+    (NUMBER_WORDS, 'NUM'),   # dopo UNITS: 'second' è prima di tutto un ordinale
+    (NEGATIONS, 'NEG'),
+]
+
+
+def builtin_lexicon():
+    lexicon = {}
+    for words, tag in _CLOSED_CLASSES:
+        for word in words:
+            lexicon.setdefault(word, tag)
+    return lexicon
+
+
+@lru_cache(maxsize=None)
+def load_lexicon(path=LEXICON_FILE):
+    """The merged word -> tag table (cached: loaded once per process)."""
+    lexicon = builtin_lexicon()
+    if path and os.path.exists(path):
+        with open(path, 'r', encoding='utf-8') as f:
+            lexicon.update(json.load(f))
+    for words, tag in _KEEP_CLASSES:
+        for word in words:
+            lexicon[word] = tag
+    return lexicon
+
+# ==========================================
+# BUILD (spaCy, once)
+# ==========================================
+def build_lexicon(texts, model=SPACY_MODEL, batch_size=256):
+    """Most frequent universal POS tag of every (normalized) word in `texts`."""
+    import spacy
+    nlp = spacy.load(model, disable=["parser", "ner", "lemmatizer"])
+    counts = defaultdict(Counter)
+    for doc in nlp.pipe(texts, batch_size=batch_size):
+        for token in doc:
+            word = rule_based.normalize_word(token.text)
+            if word:
+                counts[word][token.pos_] += 1
+    return {word: tags.most_common(1)[0][0] for word, tags in sorted(counts.items())}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Word -> POS lexicon for the numeric-aware rule tier.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    build = sub.add_parser("build", help="tag the dataset vocabulary with spaCy and save the table")
+    build.add_argument("--input", default=BUILD_INPUT)
+    build.add_argument("--output", default=LEXICON_FILE)
+    build.add_argument("--model", default=SPACY_MODEL)
+    sub.add_parser("show", help="size of the merged lexicon per tag")
+    args = parser.parse_args()
+
+    if args.command == "show":
+        tags = Counter(load_lexicon().values())
+        for tag, n in tags.most_common():
+            print(f"{tag:<6} {n:>7}")
+        return 0
+
+    with open(args.input, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    texts = [entry.get('question_original', entry.get('question', '')) for entry in data]
+    lexicon = build_lexicon(texts, args.model)
+    os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(lexicon, f, ensure_ascii=False, indent=0)
+    print(f"Saved {len(lexicon)} words to {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
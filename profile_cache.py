@@ -0,0 +1,254 @@
+"""
+Cached perplexity profiles for the demonstrations of few-shot prompts.
+
+With 8 shots drawn from a few hundred problems, every demonstration appears
+in dozens of prompts, and the small-LM compressor would score it again each
+time. Here each distinct piece of a context (the instruction and every
+demonstration, see coarse_filter.split_context) is scored once, conditioned
+on the fixed instruction prefix. Its per-token NLLs are stored in a
+memory-mapped file:
+
+    models/ppl_profiles/profiles.f32    float32 NLLs, append-only (np.memmap)
+    models/ppl_profiles/index.json      sha1(model, prefix, piece) -> [offset, length]
+
+Compressing a prompt assembles the cached profiles and scores only the pieces
+never seen before. The missing pieces go in padded batches, which all reuse
+the KV cache of the prefix. Words get their mean token NLL, and the rate is
+applied over the whole unprotected text (compressor_models.select_keep).
+
+Unlike PerplexityCompressor's iterative mode, a demonstration is conditioned
+on the instruction only, not on the demonstrations before it. That is the
+price of reusing its profile in any prompt.
+
+    python compress_dataset.py --methods llmlingua1_cached --rate 0.5
+"""
+import hashlib
+import json
+import os
+
+from coarse_filter import split_context
+from compressor_models import DEFAULT_FORCE_TOKENS, DEMO_SEPARATOR, apply_keep, select_keep
+from merge_prompt import INSTRUCTION
+from perplexity_compress import BATCH_SIZE, _to_cache, _to_legacy
+from protected_spans import compress_unprotected, split_segments
+
+# ==========================================
+# CONFIGURATION
+# ==========================================
+PROFILE_DIR = "models/ppl_profiles"
+DATA_FILE = "profiles.f32"
+INDEX_FILE = "index.json"
+
+
+class ProfileStore:
+    """Append-only float32 arrays keyed by string, read back through np.memmap (single writer)."""
+
+    def __init__(self, directory=PROFILE_DIR):
+        self.directory = directory
+        self.data_path = os.path.join(directory, DATA_FILE)
+        self.index_path = os.path.join(directory, INDEX_FILE)
+        self.index = {}
+        if os.path.exists(self.index_path):
+            with open(self.index_path, 'r', encoding='utf-8') as f:
+                self.index = json.load(f)
+        self._map = None
+        self._dirty = False
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, key):
+        return key in self.index
+
+    def _mapped(self, end):
+        """np.memmap of the data file, reopened if it no longer covers `end` values."""
+        import numpy as np
+        if self._map is None or len(self._map) < end:
+            self._map = np.memmap(self.data_path, dtype=np.float32, mode='r')
+        return self._map
+
+    def get(self, key):
+        """Read-only view of the stored array, or None."""
+        entry = self.index.get(key)
+        if entry is None:
+            return None
+        offset, length = entry
+        return self._mapped(offset + length)[offset:offset + length]
+
+    def put_many(self, arrays):
+        """{key: 1-D array}; appended to the data file, visible to get() right away."""
+        import numpy as np
+        if not arrays:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        offset = os.path.getsize(self.data_path) // 4 if os.path.exists(self.data_path) else 0
+        with open(self.data_path, 'ab') as f:
+            for key, values in arrays.items():
+                values = np.asarray(values, dtype=np.float32)
+                values.tofile(f)
+                self.index[key] = [offset, len(values)]
+                offset += len(values)
+        self._dirty = True
+
+    def flush(self):
+        """Writes the index (atomically: readers never see a partial file)."""
+        if not self._dirty:
+            return
+        tmp_path = self.index_path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.index, f)
+        os.replace(tmp_path, self.index_path)
+        self._dirty = False
+
+
+class CachedPerplexityCompressor:
+    """Word filter on cached per-demonstration NLL profiles; same interface as PerplexityCompressor."""
+
+    def __init__(self, compressor, store=None, prefix=INSTRUCTION, batch_size=BATCH_SIZE):
+        self.compressor = compressor  # PerplexityCompressor: modello, tokenizer, cache delle tokenizzazioni
+        self.store = store if store is not None else ProfileStore()
+        self.prefix = prefix
+        self.batch_size = batch_size
+        config = compressor.model.config
+        self.model_name = getattr(config, '_name_or_path', '') or type(compressor.model).__name__
+        # Lo stesso modello con un altro tokenizer produce un altro profilo
+        self.tokenizer_name = (getattr(compressor.tokenizer, 'name_or_path', '')
+                               or type(compressor.tokenizer).__name__)
+        self._prefix_state = None
+        self.stats = {'pieces': 0, 'cache_hits': 0, 'scored': 0}
+
+    @classmethod
+    def load(cls, directory=PROFILE_DIR, prefix=INSTRUCTION, **kwargs):
+        from perplexity_compress import PerplexityCompressor
+        return cls(PerplexityCompressor.load(**kwargs), ProfileStore(directory), prefix)
+
+    def key(self, piece, prefix):
+        """
+        The profile depends only on the whitespace words (piece.split()), so
+        pieces that differ only in spacing share one entry.
+        """
+        digest = hashlib.sha1()
+        for part in (self.model_name, self.tokenizer_name, " ".join(prefix.split()), " ".join(piece.split())):
+            digest.update(part.encode('utf-8') + b'\0')
+        return digest.hexdigest()
+
+    def _prefix_kv(self):
+        """(legacy KV, last logits, length) of the fixed prefix, computed once."""
+        import torch
+        if self._prefix_state is None:
+            ids = [i for word in self.compressor.word_ids(self.prefix.split()) for i in word]
+            with torch.inference_mode():
+                out = self.compressor.model(input_ids=torch.tensor([ids], device=self.compressor.device), use_cache=True)
+            self._prefix_state = (_to_legacy(out.past_key_values), out.logits[0, -1].float(), len(ids))
+        return self._prefix_state
+
+    def _score(self, pieces, conditioned):
+        """Token NLLs of each piece, after the prefix (conditioned=True) or from scratch."""
+        import torch
+        comp = self.compressor
+        dev = comp.device
+        token_lists = [[i for word in comp.word_ids(p.split()) for i in word] for p in pieces]
+        past_len, limit = 0, comp.max_positions
+        if conditioned:
+            past, last_logits, past_len = self._prefix_kv()
+        out_nll = []
+        for b in range(0, len(token_lists), self.batch_size):
+            batch = [t[:limit - past_len] for t in token_lists[b:b + self.batch_size]]
+            width = max(1, max(len(t) for t in batch))
+            input_ids = torch.full((len(batch), width), comp.pad_id, dtype=torch.long)
+            mask = torch.zeros((len(batch), past_len + width), dtype=torch.long)
+            mask[:, :past_len] = 1
+            for j, toks in enumerate(batch):
+                input_ids[j, :len(toks)] = torch.tensor(toks, dtype=torch.long)
+                mask[j, past_len:past_len + len(toks)] = 1
+            kwargs = {}
+            if conditioned:
+                # La KV del prefisso è la stessa per tutte le righe: la si espande, non si ricalcola
+                kwargs['past_key_values'] = _to_cache([(k.expand(len(batch), -1, -1, -1), v.expand(len(batch), -1, -1, -1))
+                                                       for k, v in past])
+            positions = torch.arange(past_len, past_len + width).expand(len(batch), -1)
+            with torch.inference_mode():
+                logits = comp.model(input_ids=input_ids.to(dev), attention_mask=mask.to(dev),
+                                    position_ids=positions.to(dev), use_cache=False, **kwargs).logits.float()
+            lse = torch.logsumexp(logits, dim=-1)
+            nll = torch.full(lse.shape, float('inf'))
+            if width > 1:
+                target = logits[:, :-1].gather(2, input_ids[:, 1:, None].to(dev)).squeeze(2)
+                nll[:, 1:] = (lse[:, :-1] - target).cpu()
+            if conditioned:
+                nll[:, 0] = (torch.logsumexp(last_logits, dim=-1) - last_logits[input_ids[:, 0].to(dev)]).cpu()
+            for j, toks in enumerate(token_lists[b:b + self.batch_size]):
+                row = nll[j, :len(batch[j])].tolist()
+                # Oltre la finestra del modello (caso limite): token senza contesto, sempre tenuti
+                out_nll.append(row + [float('inf')] * (len(toks) - len(row)))
+        self.stats['scored'] += len(pieces)
+        return out_nll
+
+    def cacheable(self, piece):
+        """Only the instruction and complete demonstrations are stored; anything else (the target) is scored each time."""
+        return piece == self.prefix or piece.rstrip().endswith(DEMO_SEPARATOR)
+
+    def profiles(self, pieces):
+        """Token NLLs per piece; the header (== prefix) is scored from scratch, the rest after it."""
+        keys, missing, fresh = [], {}, {}
+        for piece in pieces:
+            prefix = "" if piece == self.prefix else self.prefix
+            key = self.key(piece, prefix)
+            keys.append(key)
+            self.stats['pieces'] += 1
+            if key in self.store or key in missing:
+                self.stats['cache_hits'] += 1
+            else:
+                missing[key] = (piece, prefix)
+        for conditioned in (False, True):
+            todo = [(k, p) for k, (p, prefix) in missing.items() if bool(prefix) == conditioned]
+            if todo:
+                scores = self._score([p for _, p in todo], conditioned)
+                for (key, piece), nll in zip(todo, scores):
+                    fresh[key] = nll
+                self.store.put_many({k: fresh[k] for k, p in todo if self.cacheable(p)})
+        return [fresh[k] if k in fresh else self.store.get(k) for k in keys]
+
+    def split(self, text):
+        head, demos = split_context(text, self.prefix)
+        return ([head] if head else []) + demos
+
+    def word_scores(self, pieces, profiles):
+        """Mean token NLL of every whitespace word of the pieces, in order."""
+        scores = []
+        for piece, profile in zip(pieces, profiles):
+            pos = 0
+            for ids in self.compressor.word_ids(piece.split()):
+                scores.append(sum(float(x) for x in profile[pos:pos + len(ids)]) / len(ids))
+                pos += len(ids)
+        return scores
+
+    def compress_many(self, texts, rate, force_tokens=DEFAULT_FORCE_TOKENS, protected_spans=None):
+        """
+        Same contract as PerplexityCompressor.compress_many. The pieces of all
+        texts are looked up (and the missing ones scored) in one batched pass;
+        the index is flushed at the end.
+        """
+        protected_spans = protected_spans or [None] * len(texts)
+        segment_lists = [
+            [seg.strip() for seg, protected in split_segments(text, spans) if not protected and seg.strip()]
+            if spans else [text]
+            for text, spans in zip(texts, protected_spans)
+        ]
+        piece_lists = [[self.split(seg) for seg in segments] for segments in segment_lists]
+        flat = [piece for pieces in piece_lists for seg_pieces in pieces for piece in seg_pieces]
+        profiles = iter(self.profiles(flat))
+
+        out = []
+        for text, spans, segments, pieces in zip(texts, protected_spans, segment_lists, piece_lists):
+            words = [seg.split() for seg in segments]
+            scores = [s for seg_pieces in pieces
+                      for s in self.word_scores(seg_pieces, [next(profiles) for _ in seg_pieces])]
+            keep = select_keep([w for ws in words for w in ws], scores, rate, force_tokens)
+            compressed, pos = [], 0
+            for ws in words:
+                compressed.append(apply_keep(ws, keep[pos:pos + len(ws)]))
+                pos += len(ws)
+            out.append(compress_unprotected(text, spans, lambda _: compressed))
+        self.store.flush()
+        return out
@@ -0,0 +1,280 @@
+"""
+Opt-in per-stage profiling for the dataset, formatter and compression scripts.
+
+Disabled by default: span() and @profiled cost a single flag check. Enable it
+from the environment when launching any script:
+
+    PROFILE=1 python cut_prompt_merge_llmlingua2.py
+    PROFILE=1 PROFILE_CPROFILE=1 PROFILE_DIR=profiles python merge_prompt.py
+
+Each span records wall time, CPU time, RSS delta and peak RSS. Spans nest, so
+the report shows both total and self time per stage path. At the end of a run
+finish_profiling() prints the breakdown and writes to PROFILE_DIR:
+  - <run>.spans.json   : the per-stage breakdown
+  - <run>.collapsed    : self wall time (us) per stack in the collapsed-stack
+                         format used by flamegraph.pl / speedscope / py-spy raw
+  - <run>.prof         : cProfile stats (only with PROFILE_CPROFILE=1),
+                         readable with pstats or snakeviz
+"""
+import functools
+import json
+import os
+import resource
+import threading
+import time
+from contextlib import contextmanager
+
+# ==========================================
+# CONFIGURATION (from environment)
+# ==========================================
+ENV_ENABLE = "PROFILE"
+ENV_CPROFILE = "PROFILE_CPROFILE"
+ENV_DIR = "PROFILE_DIR"
+DEFAULT_DIR = "profiles"
+
+# Metodi del tokenizer HF cronometrati da instrument_compressor()
+TOKENIZER_METHODS = ('tokenize', 'encode', 'encode_plus', 'batch_encode_plus', 'decode', 'batch_decode', 'convert_tokens_to_ids')
+
+_PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+
+def _rss_bytes():
+    """Current resident set size (Linux /proc, falls back to peak RSS)."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except (OSError, ValueError, IndexError):
+        return _peak_rss_bytes()
+
+
+def _peak_rss_bytes():
+    # ru_maxrss is KiB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def memory_rollup():
+    """
+    RSS / PSS / USS of this process in MB (/proc/self/smaps_rollup).
+    USS (private pages) is what the process costs on its own; pages shared
+    with other processes count fully in RSS and proportionally in PSS.
+    Without smaps_rollup only RSS is known and PSS / USS are None.
+    """
+    fields = {}
+    try:
+        with open('/proc/self/smaps_rollup') as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) == 3 and parts[2] == 'kB':
+                    fields[parts[0].rstrip(':')] = int(parts[1]) * 1024
+    except OSError:
+        return {'rss_mb': _rss_bytes() / 2**20, 'pss_mb': None, 'uss_mb': None}
+    uss = fields.get('Private_Clean', 0) + fields.get('Private_Dirty', 0)
+    return {'rss_mb': fields.get('Rss', 0) / 2**20, 'pss_mb': fields.get('Pss', 0) / 2**20, 'uss_mb': uss / 2**20}
+
+
+class SpanStats:
+    def __init__(self):
+        self.count = 0
+        self.wall = 0.0
+        self.cpu = 0.0
+        self.child_wall = 0.0
+        self.rss_delta = 0
+        self.peak_rss = 0
+
+    def as_dict(self):
+        return {
+            'count': self.count,
+            'wall_s': self.wall,
+            'self_wall_s': self.wall - self.child_wall,
+            'cpu_s': self.cpu,
+            'rss_delta_mb': self.rss_delta / 2**20,
+            'peak_rss_mb': self.peak_rss / 2**20,
+        }
+
+
+class Profiler:
+    def __init__(self, run_name, use_cprofile=False, output_dir=DEFAULT_DIR):
+        self.run_name = run_name
+        self.output_dir = output_dir
+        self.stats = {}  # stack path tuple -> SpanStats
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._cprofile = None
+        self._started = time.perf_counter()
+        if use_cprofile:
+            import cProfile
+            self._cprofile = cProfile.Profile()
+            self._cprofile.enable()
+
+    def _stack(self):
+        if not hasattr(self._local, 'stack'):
+            self._local.stack = []
+        return self._local.stack
+
+    @contextmanager
+    def span(self, name):
+        stack = self._stack()
+        stack.append(name)
+        path = tuple(stack)
+        wall0, cpu0, rss0 = time.perf_counter(), time.process_time(), _rss_bytes()
+        try:
+            yield
+        finally:
+            wall = time.perf_counter() - wall0
+            cpu = time.process_time() - cpu0
+            rss1 = _rss_bytes()
+            stack.pop()
+            with self._lock:
+                st = self.stats.setdefault(path, SpanStats())
+                st.count += 1
+                st.wall += wall
+                st.cpu += cpu
+                st.rss_delta += rss1 - rss0
+                st.peak_rss = max(st.peak_rss, _peak_rss_bytes())
+                if len(path) > 1:
+                    self.stats.setdefault(path[:-1], SpanStats()).child_wall += wall
+
+    def breakdown(self):
+        total = time.perf_counter() - self._started
+        rows = []
+        for path, st in sorted(self.stats.items()):
+            row = {'stage': '/'.join(path), 'depth': len(path) - 1}
+            row.update(st.as_dict())
+            row['wall_pct'] = 100 * st.wall / total if total > 0 else 0.0
+            rows.append(row)
+        return {'run': self.run_name, 'total_wall_s': total, 'peak_rss_mb': _peak_rss_bytes() / 2**20, 'stages': rows}
+
+    def print_report(self):
+        report = self.breakdown()
+        print("\n" + "=" * 86)
+        print(f"  PROFILE: {report['run']}  (total {report['total_wall_s']:.2f}s, peak RSS {report['peak_rss_mb']:.0f} MB)")
+        print("=" * 86)
+        print(f"{'Stage':<40} {'calls':>6} {'wall s':>8} {'self s':>8} {'cpu s':>8} {'%':>6} {'dRSS MB':>8}")
+        for row in report['stages']:
+            label = "  " * row['depth'] + row['stage'].split('/')[-1]
+            print(
+                f"{label[:40]:<40} {row['count']:>6} {row['wall_s']:>8.3f} {row['self_wall_s']:>8.3f} "
+                f"{row['cpu_s']:>8.3f} {row['wall_pct']:>5.1f}% {row['rss_delta_mb']:>8.1f}"
+            )
+        print("=" * 86)
+
+    def dump(self):
+        os.makedirs(self.output_dir, exist_ok=True)
+        base = os.path.join(self.output_dir, self.run_name)
+        with open(f"{base}.spans.json", 'w', encoding='utf-8') as f:
+            json.dump(self.breakdown(), f, indent=4)
+        with open(f"{base}.collapsed", 'w', encoding='utf-8') as f:
+            for path, st in sorted(self.stats.items()):
+                self_us = int(max(0.0, st.wall - st.child_wall) * 1e6)
+                if self_us:
+                    f.write(f"{';'.join(path)} {self_us}\n")
+        paths = [f"{base}.spans.json", f"{base}.collapsed"]
+        if self._cprofile is not None:
+            self._cprofile.disable()
+            self._cprofile.dump_stats(f"{base}.prof")
+            paths.append(f"{base}.prof")
+        return paths
+
+
+# ==========================================
+# MODULE-LEVEL API
+# ==========================================
+_active = None
+
+
+def start_profiling(run_name):
+    """Starts a profiler if PROFILE is set in the environment. Returns it (or None)."""
+    global _active
+    if os.getenv(ENV_ENABLE, '') in ('', '0'):
+        _active = None
+        return None
+    _active = Profiler(
+        run_name,
+        use_cprofile=os.getenv(ENV_CPROFILE, '') not in ('', '0'),
+        output_dir=os.getenv(ENV_DIR, DEFAULT_DIR),
+    )
+    print(f"[profiling] enabled for run '{run_name}'")
+    return _active
+
+
+def finish_profiling():
+    """Prints the breakdown and writes the dumps of the active profiler, if any."""
+    global _active
+    if _active is None:
+        return
+    _active.print_report()
+    paths = _active.dump()
+    print(f"[profiling] written: {', '.join(paths)}")
+    _active = None
+
+
+@contextmanager
+def span(name):
+    if _active is None:
+        yield
+        return
+    with _active.span(name):
+        yield
+
+
+def profiled(name=None):
+    """Decorator version of span(); defaults to the function name."""
+    def decorator(func):
+        label = name or func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _active is None:
+                return func(*args, **kwargs)
+            with _active.span(label):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+# ==========================================
+# LLMLINGUA INSTRUMENTATION
+# ==========================================
+class _TimedTokenizer:
+    """Proxy around a HF tokenizer that records tokenisation calls as spans."""
+
+    def __init__(self, tokenizer):
+        object.__setattr__(self, '_tokenizer', tokenizer)
+
+    def __call__(self, *args, **kwargs):
+        with span('tokenize'):
+            return self._tokenizer(*args, **kwargs)
+
+    def __getattr__(self, name):
+        attr = getattr(self._tokenizer, name)
+        if name in TOKENIZER_METHODS and callable(attr):
+            return profiled('tokenize')(attr)
+        return attr
+
+    def __setattr__(self, name, value):
+        setattr(self._tokenizer, name, value)
+
+    def __len__(self):
+        return len(self._tokenizer)
+
+
+def instrument_compressor(compressor):
+    """
+    Splits PromptCompressor.compress_prompt into sub-stages when profiling is on:
+    'tokenize' (HF tokenizer), 'count_tokens' (tiktoken length checks) and
+    'model_forward' (classifier / small LM forward pass). Whatever remains as
+    self time of the 'compress_prompt' span is token selection and post-processing.
+    """
+    if _active is None:
+        return compressor
+    compressor.compress_prompt = profiled('compress_prompt')(compressor.compress_prompt)
+    model = getattr(compressor, 'model', None)
+    if model is not None:
+        model.forward = profiled('model_forward')(model.forward)
+    tokenizer = getattr(compressor, 'tokenizer', None)
+    if tokenizer is not None and not isinstance(tokenizer, _TimedTokenizer):
+        compressor.tokenizer = _TimedTokenizer(tokenizer)
+    oai_tokenizer = getattr(compressor, 'oai_tokenizer', None)
+    if oai_tokenizer is not None:
+        oai_tokenizer.encode = profiled('count_tokens')(oai_tokenizer.encode)
+    return compressor
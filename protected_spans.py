@@ -0,0 +1,106 @@
+"""
+Protected spans: parts of a prompt that every compressor must leave verbatim
+(e.g. the target question and its numbers).
+
+Spans are given either as character offsets, [[start, end], ...] on the
+text (merge_prompt.py writes them in the 'protected_spans' field of every
+row), or inline with markup:
+
+    "Question: ... ###\n<protect>Question: Tom has 3 apples ...</protect>"
+
+Compressors only ever see the unprotected segments: the protected ones are
+not scored at all and are put back unchanged (compress_unprotected).
+
+Pure standard library, like rule_based.
+"""
+import re
+
+PROTECT_OPEN = "<protect>"
+PROTECT_CLOSE = "</protect>"
+_MARKUP_RE = re.compile(re.escape(PROTECT_OPEN) + r"(.*?)" + re.escape(PROTECT_CLOSE), re.DOTALL)
+
+
+def parse_markup(text):
+    """Strips <protect>...</protect> tags: returns (plain text, spans on the plain text)."""
+    out, spans, pos, length = [], [], 0, 0
+    for match in _MARKUP_RE.finditer(text):
+        before = text[pos:match.start()]
+        out.append(before)
+        length += len(before)
+        inner = match.group(1)
+        out.append(inner)
+        spans.append((length, length + len(inner)))
+        length += len(inner)
+        pos = match.end()
+    out.append(text[pos:])
+    return "".join(out), spans
+
+
+def normalize_spans(spans, length):
+    """Sorted, clipped to [0, length] and with overlapping spans merged."""
+    merged = []
+    for start, end in sorted((max(0, int(s)), min(length, int(e))) for s, e in spans or ()):
+        if end <= start:
+            continue
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def split_segments(text, spans):
+    """[(segment, is_protected), ...] covering the whole text in order."""
+    segments, pos = [], 0
+    for start, end in normalize_spans(spans, len(text)):
+        if start > pos:
+            segments.append((text[pos:start], False))
+        segments.append((text[start:end], True))
+        pos = end
+    if pos < len(text) or not segments:
+        segments.append((text[pos:], False))
+    return segments
+
+
+def row_text_and_spans(entry, field='question'):
+    """Text of `field` and its protected spans (markup wins over the 'protected_spans' field)."""
+    text = entry.get(field, '')
+    if PROTECT_OPEN in text:
+        return parse_markup(text)
+    return text, entry.get('protected_spans') or []
+
+
+def _boundary(whitespace):
+    if not whitespace:
+        return ""
+    return "\n" if "\n" in whitespace else " "
+
+
+def compress_unprotected(text, spans, compress_many):
+    """
+    Compresses only the unprotected segments of `text`.
+
+    compress_many(list of segments) -> list of compressed segments, in order;
+    it is called once, so batched compressors can score all segments together.
+    Protected segments are copied verbatim; the whitespace around a compressed
+    segment collapses to one newline (if it had one) or one space. Without
+    spans this is just compress_many([text])[0].
+    """
+    if not spans:
+        return compress_many([text])[0]
+    segments = split_segments(text, spans)
+    todo = [seg.strip() for seg, protected in segments if not protected and seg.strip()]
+    compressed = iter(compress_many(todo) if todo else ())
+    out = []
+    for seg, protected in segments:
+        if protected:
+            out.append(seg)
+            continue
+        core = seg.strip()
+        if not core:
+            out.append(_boundary(seg))
+            continue
+        lead = seg[:len(seg) - len(seg.lstrip())]
+        trail = seg[len(seg.rstrip()):]
+        out.append(_boundary(lead) + next(compressed) + _boundary(trail))
+    return "".join(out).strip()
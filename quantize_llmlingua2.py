@@ -0,0 +1,176 @@
+"""
+CPU backends for the LLMLingua-2 classifier: ONNX export, int8 quantisation,
+agreement check against fp32 and throughput comparison.
+
+    # 1. export the classifier to ONNX (+ an int8 ONNX copy via onnxruntime)
+    python quantize_llmlingua2.py export
+
+    # 2. compare keep-decisions and throughput of every backend against fp32 torch
+    python quantize_llmlingua2.py check --backends int8,onnx,onnx-int8
+
+The check scores the same prompts with each backend, applies the same
+selection (compressor_models.select_keep at TARGET_RATE) and measures the
+fraction of words whose keep/drop decision matches the fp32 model. Words that
+are force tokens are always kept whatever the scores, so they are left out of
+the agreement: only the decisions the classifier actually makes are counted.
+It exits with 1 if any backend is below AGREEMENT_THRESHOLD.
+
+Once a backend passes, the compression scripts can use it through
+compressor_models.load_llmlingua2(backend=...).
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+from compressor_models import (DEFAULT_FORCE_TOKENS, LLMLINGUA2_MODEL, ONNX_MODEL_PATH, Llmlingua2Scorer,
+                               OnnxTokenClassifier, forced_mask, load_llmlingua2, quantize_int8, select_keep)
+
+# ==========================================
+# CONFIGURATION
+# ==========================================
+INPUT_FILE = "datasets/dataset_gsm8k_formatted_8shot.json"
+NUM_PROMPTS = 50
+TARGET_RATE = 0.5
+AGREEMENT_THRESHOLD = 0.97   # frazione minima di decisioni keep/drop (parole non forzate) uguali a fp32
+ONNX_OPSET = 14
+ONNX_INT8_PATH = ONNX_MODEL_PATH.replace(".onnx", ".int8.onnx")
+
+
+def export_onnx(model_name=LLMLINGUA2_MODEL, onnx_path=ONNX_MODEL_PATH, int8_path=ONNX_INT8_PATH):
+    import torch
+    compressor = load_llmlingua2(model_name, device="cpu")
+    model = compressor.model.eval()
+    dummy = compressor.tokenizer(["Export sample for the classifier ."], return_tensors="pt")
+
+    os.makedirs(os.path.dirname(onnx_path) or ".", exist_ok=True)
+    print(f"Exporting {model_name} -> {onnx_path}")
+    with torch.no_grad():
+        torch.onnx.export(
+            model,
+            (dummy['input_ids'], dummy['attention_mask']),
+            onnx_path,
+            input_names=['input_ids', 'attention_mask'],
+            output_names=['logits'],
+            dynamic_axes={
+                'input_ids': {0: 'batch', 1: 'sequence'},
+                'attention_mask': {0: 'batch', 1: 'sequence'},
+                'logits': {0: 'batch', 1: 'sequence'},
+            },
+            opset_version=ONNX_OPSET,
+        )
+
+    try:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+    except ImportError:
+        print("onnxruntime.quantization not available: skipping the int8 ONNX copy")
+        return
+    print(f"Quantizing (dynamic int8) -> {int8_path}")
+    quantize_dynamic(onnx_path, int8_path, weight_type=QuantType.QInt8)
+
+
+def load_prompts(path=INPUT_FILE, limit=NUM_PROMPTS):
+    """Contexts from the formatted dataset, or the benchmark's GSM8K-shaped prompts."""
+    if os.path.exists(path):
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        return [e.get('context_only', e.get('question', '')) for e in data[:limit]]
+    import random
+    from benchmark_compressors import gsm8k_shaped_prompt
+    rng = random.Random(42)
+    return [gsm8k_shaped_prompt(rng, 8) for _ in range(limit)]
+
+
+def build_scorer(reference, backend):
+    """Scorer sharing the tokenizer of the fp32 reference, with the backend's model."""
+    if backend == 'torch':
+        model = reference.model
+    elif backend == 'int8':
+        import copy
+        model = quantize_int8(copy.deepcopy(reference.model))
+    elif backend == 'onnx':
+        model = OnnxTokenClassifier(ONNX_MODEL_PATH)
+    elif backend == 'onnx-int8':
+        model = OnnxTokenClassifier(ONNX_INT8_PATH)
+    else:
+        raise ValueError(f"Unknown backend {backend}")
+    return Llmlingua2Scorer(model, reference.tokenizer, "cpu")
+
+
+def timed_scores(scorer, word_lists, repeat=3):
+    scorer.score_words(word_lists[:2])  # warmup
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        scores = scorer.score_words(word_lists)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return scores, best
+
+
+def check(backends, model_name=LLMLINGUA2_MODEL):
+    import torch
+    reference = load_llmlingua2(model_name, device="cpu")
+    word_lists = [p.split() for p in load_prompts()]
+    n_words = sum(len(w) for w in word_lists)
+    print(f"Prompts: {len(word_lists)} ({n_words} words), torch threads: {torch.get_num_threads()}")
+
+    ref_scorer = build_scorer(reference, 'torch')
+    ref_scores, ref_time = timed_scores(ref_scorer, word_lists)
+    ref_keep = [select_keep(w, s, TARGET_RATE, DEFAULT_FORCE_TOKENS) for w, s in zip(word_lists, ref_scores)]
+    # le parole forzate sono tenute da tutti i backend: non contano nell'agreement
+    scored = [[not f for f in forced_mask(w, DEFAULT_FORCE_TOKENS)] for w in word_lists]
+    n_scored = sum(sum(m) for m in scored)
+    print(f"Words decided by the classifier (not forced): {n_scored}")
+
+    print("\n" + "=" * 72)
+    print(f"{'Backend':<12} {'agreement':>10} {'prompts/s':>10} {'words/s':>10} {'speed-up':>9}")
+    print("=" * 72)
+    print(f"{'torch fp32':<12} {1.0:>10.4f} {len(word_lists) / ref_time:>10.1f} {n_words / ref_time:>10.0f} {1.0:>8.2f}x")
+
+    failures = []
+    for backend in backends:
+        try:
+            scorer = build_scorer(reference, backend)
+        except Exception as e:
+            print(f"{backend:<12} skipped: {e}")
+            continue
+        scores, elapsed = timed_scores(scorer, word_lists)
+        same = total = 0
+        for words, s, keep_ref, mask in zip(word_lists, scores, ref_keep, scored):
+            keep = select_keep(words, s, TARGET_RATE, DEFAULT_FORCE_TOKENS)
+            same += sum(a == b for a, b, m in zip(keep, keep_ref, mask) if m)
+            total += sum(mask)
+        agreement = same / total if total else 1.0
+        print(f"{backend:<12} {agreement:>10.4f} {len(word_lists) / elapsed:>10.1f} {n_words / elapsed:>10.0f} "
+              f"{ref_time / elapsed:>8.2f}x{'' if agreement >= AGREEMENT_THRESHOLD else '  <-- below threshold'}")
+        if agreement < AGREEMENT_THRESHOLD:
+            failures.append(backend)
+    print("=" * 72)
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ONNX / int8 backends for the LLMLingua-2 classifier.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    exp = sub.add_parser("export", help="export the classifier to ONNX (+ int8 ONNX copy)")
+    exp.add_argument("--model", default=LLMLINGUA2_MODEL)
+    chk = sub.add_parser("check", help="agreement with fp32 and throughput per backend")
+    chk.add_argument("--model", default=LLMLINGUA2_MODEL)
+    chk.add_argument("--backends", default="int8,onnx,onnx-int8")
+    args = parser.parse_args()
+
+    if args.command == "export":
+        export_onnx(args.model)
+        return 0
+    failures = check(args.backends.split(","), args.model)
+    if failures:
+        print(f"Agreement below {AGREEMENT_THRESHOLD:.0%} for: {', '.join(failures)}")
+        return 1
+    print(f"All backends agree with fp32 on at least {AGREEMENT_THRESHOLD:.0%} of keep-decisions.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,78 @@
+"""
+Rule-based prompt compression (stopword-category removal).
+
+Pure standard library on purpose: the compression scripts, the benchmark and
+the dataset tools import it without paying for torch / transformers.
+"""
+import re
+
+from profiling import profiled
+from protected_spans import compress_unprotected
+
+# ==========================================
+# RULE-BASED LOGIC
+# ==========================================
+ARTICLES = {'a', 'an', 'the'}
+CONJUNCTIONS = {'and', 'but', 'or', 'so', 'yet', 'for', 'nor'}
+PREPOSITIONS = {
+    'in', 'on', 'at', 'to', 'from', 'with', 'by', 'about', 'as', 'into',
+    'like', 'through', 'after', 'over', 'between', 'out', 'against',
+    'during', 'without', 'before', 'under', 'around', 'among', 'of',
+    'per', 'within', 'upon', 'beneath', 'beside', 'beyond', 'off',
+    'above', 'below', 'near', 'behind', 'across', 'along', 'toward',
+    'towards', 'throughout', 'until', 'since'
+}
+ADVERBS = {
+    'very', 'really', 'quite', 'just', 'only', 'also', 'too', 'much',
+    'most', 'more', 'well', 'even', 'however', 'then', 'now', 'every',
+    'daily', 'always', 'never', 'often', 'sometimes', 'usually', 'rarely',
+    'frequently', 'seldom', 'hardly', 'barely', 'nearly', 'almost',
+    'extremely', 'completely', 'totally', 'absolutely', 'quite', 'rather',
+    'fairly', 'pretty', 'enough', 'still', 'yet', 'already'
+}
+PRONOUNS = {
+    'i', 'you', 'he', 'she', 'it', 'we', 'they', 'me', 'him', 'her',
+    'us', 'them', 'my', 'your', 'his', 'her', 'its', 'our', 'their',
+    'mine', 'yours', 'hers', 'ours', 'theirs', 'myself', 'yourself',
+    'himself', 'herself', 'itself', 'ourselves', 'yourselves', 'themselves'
+}
+REMOVE_WORDS = ARTICLES | CONJUNCTIONS | PREPOSITIONS | ADVERBS | PRONOUNS
+
+# Ordine di rimozione in modalità budget (token_budget.py): prima le categorie
+# che portano meno informazione, le preposizioni per ultime.
+REMOVE_ORDER = [ARTICLES, ADVERBS, PRONOUNS, CONJUNCTIONS, PREPOSITIONS]
+
+_NON_WORD = re.compile(r'[^\w]')
+_SPACES = re.compile(r'\s+')
+
+
+def normalize_word(token):
+    return _NON_WORD.sub('', token.lower())
+
+
+def _compress(text):
+    tokens = text.split()
+    # Keep token if it's NOT in the remove list (normalized) or if it's empty
+    compressed_tokens = [t for t in tokens if normalize_word(t) not in REMOVE_WORDS or t == '']
+    compressed = ' '.join(compressed_tokens)
+    return _SPACES.sub(' ', compressed).strip()
+
+
+@profiled("rule_based_compress")
+def rule_based_compress(text, protected_spans=None):
+    """protected_spans: [(start, end), ...] character offsets left verbatim (see protected_spans)."""
+    return compress_unprotected(text, protected_spans, lambda segments: [_compress(s) for s in segments])
+
+
+def drop_order(words):
+    """
+    Indices of the removable words, in the order the budget mode drops them:
+    category by category (REMOVE_ORDER), front to back inside a category.
+    Dropping all of them gives the same words as rule_based_compress.
+    """
+    rank = {}
+    for level, category in enumerate(REMOVE_ORDER):
+        for word in category:
+            rank.setdefault(word, level)
+    removable = [(rank[w], i) for i, w in enumerate(normalize_word(t) for t in words) if w in rank]
+    return [i for _, i in sorted(removable)]
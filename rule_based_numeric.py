@@ -0,0 +1,74 @@
+"""
+Numeric-aware rule tier: like rule_based, but removals are decided per word
+in context with a precompiled POS lexicon (pos_lexicon.py) instead of a flat
+stopword list.
+
+Never removed:
+  - numerals ("48", "$5", "3/4", "twelve", "half", "dozen"), units and time
+    spans, quantity modifiers (more, only, per, every, each, than, ...),
+    negations
+  - words carrying sentence punctuation ("it." keeps the full stop)
+Removed (DET / PRON / ADV / ADP / CCONJ / INTJ) unless the context makes
+them quantitative:
+  - "a" / "an" after a quantity or before a number / unit ("$5 a week", "a dozen")
+  - a preposition before a quantity ("in 3 hours", "for $5") and "of" after
+    one ("3 of them", "half of the cookies")
+  - "and" / "or" next to a quantity ("5 and 6")
+
+The per-token work is two dictionary lookups (tag cache), so it runs close
+to the stopword filter. Pure standard library, like rule_based.
+"""
+import re
+from functools import lru_cache
+
+from pos_lexicon import load_lexicon
+from profiling import profiled
+from protected_spans import compress_unprotected
+from rule_based import normalize_word
+
+REMOVABLE_TAGS = {'DET', 'PRON', 'ADV', 'ADP', 'CCONJ', 'INTJ'}
+QUANTITY_TAGS = {'NUM', 'UNIT'}
+
+_DIGIT = re.compile(r'\d')
+_SENTENCE_PUNCT = ('.', '?', '!', ':', ';')
+
+
+@lru_cache(maxsize=65536)
+def token_info(token):
+    """(tag, is_quantity) of a raw whitespace token."""
+    if _DIGIT.search(token):
+        return 'NUM', True
+    word = normalize_word(token)
+    tag = load_lexicon().get(word, 'X') if word else 'PUNCT'
+    if token in ('$', '%'):
+        tag = 'UNIT'
+    return tag, tag in QUANTITY_TAGS
+
+
+def removable(i, tokens, infos):
+    """Whether tokens[i] can go, given the (tag, is_quantity) of every token (see module doc)."""
+    tag, _ = infos[i]
+    if tag not in REMOVABLE_TAGS or tokens[i].endswith(_SENTENCE_PUNCT):
+        return False
+    prev_qty = i > 0 and infos[i - 1][1]
+    next_qty = i + 1 < len(tokens) and infos[i + 1][1]
+    word = normalize_word(tokens[i])
+    if tag == 'DET' and word in ('a', 'an'):
+        return not (prev_qty or next_qty)
+    if tag == 'ADP':
+        return not (next_qty or (word == 'of' and prev_qty))
+    if tag == 'CCONJ':
+        return not (prev_qty or next_qty)
+    return True
+
+
+def _compress(text):
+    tokens = text.split()
+    infos = [token_info(t) for t in tokens]
+    return ' '.join(t for i, t in enumerate(tokens) if not removable(i, tokens, infos))
+
+
+@profiled("numeric_rule_compress")
+def numeric_rule_compress(text, protected_spans=None):
+    """protected_spans: [(start, end), ...] character offsets left verbatim (see protected_spans)."""
+    return compress_unprotected(text, protected_spans, lambda segments: [_compress(s) for s in segments])
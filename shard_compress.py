@@ -0,0 +1,270 @@
+"""
+Sharded LLMLingua-2 compression on many-core CPUs.
+
+One process with default torch threading scales poorly here: every row is a
+small forward pass (one or two 512-token windows) and most intra-op threads
+sit idle on synchronisation. Instead we run M worker processes, each with its
+own copy of the classifier and T = cores / M intra-op threads. Rows are
+handed out one at a time (dynamic: long prompts don't stall a shard) and the
+results come back in row order.
+
+    # sweep the worker x thread splits on this machine and print the best one
+    python shard_compress.py --tune
+
+    # use a split in the compression script
+    python cut_prompt_merge_llmlingua2.py --workers 4 --threads 2
+
+Workers are spawned (not forked) so that each one imports torch after its
+thread limits are set.
+
+With shared weights (--shared-weights) the classifier is written once to a
+snapshot under models/shared/, keyed by checkpoint revision, and every worker
+builds the model empty from its config and memory-maps the snapshot
+(compressor_models.model_from_snapshot, no from_pretrained): N workers keep
+one physical copy of the weights in the page cache instead of N private ones.
+
+    # per-worker unique memory (USS) and total RSS / PSS: private copies vs mmap
+    python shard_compress.py --memory --workers 4
+    python shard_compress.py --memory --workers 4 --kind llmlingua1
+"""
+import argparse
+import multiprocessing as mp
+import os
+import sys
+import time
+
+from compressor_models import BACKENDS, LLMLINGUA1_MODEL, LLMLINGUA2_MODEL, weights_snapshot_path
+
+# ==========================================
+# CONFIGURATION
+# ==========================================
+TUNE_ROWS = 64          # righe usate per ogni split durante --tune
+READY_TIMEOUT_S = 600   # attesa massima per il caricamento dei modelli nei worker
+ROW_FIELDS = ('context_only', 'target_only', 'question_original')  # inviati ai worker
+DEFAULT_MODELS = {'llmlingua2': LLMLINGUA2_MODEL, 'llmlingua1': LLMLINGUA1_MODEL}
+WARMUP_TEXT = ("Natalia sold clips to 48 of her friends in April, and then she sold half as many clips in May. "
+               "How many clips did Natalia sell altogether in April and May?")
+
+_worker = {}
+
+
+def available_cores():
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def split_options(cores, max_workers=None):
+    """(workers, threads) pairs that use all the cores: one per divisor of `cores`."""
+    max_workers = max_workers or cores
+    return [(m, cores // m) for m in range(1, cores + 1) if cores % m == 0 and m <= max_workers]
+
+# ==========================================
+# WORKER SIDE
+# ==========================================
+def _load(kind, model_name, backend, threads, weights_path=None):
+    from compressor_models import load_llmlingua1, load_llmlingua2
+    if kind == 'llmlingua1':
+        return load_llmlingua1(model_name, weights_path=weights_path)
+    return load_llmlingua2(model_name, "cpu", backend, num_threads=threads, weights_path=weights_path)
+
+
+def _init_worker(threads, model_name, backend, ready, weights_path=None, kind='llmlingua2'):
+    # Prima di importare torch: OpenMP / MKL leggono queste variabili all'avvio
+    for var in ('OMP_NUM_THREADS', 'MKL_NUM_THREADS'):
+        os.environ[var] = str(threads)
+    import torch
+    torch.set_num_threads(threads)
+    torch.set_num_interop_threads(1)
+
+    compressor = _load(kind, model_name, backend, threads, weights_path)
+    _worker['compressor'] = compressor
+    _worker['kind'] = kind
+    _worker['ready'] = ready
+    if ready is not None:
+        ready.wait(READY_TIMEOUT_S)
+
+
+def _export_snapshot(kind, model_name, path):
+    from compressor_models import save_weights_snapshot
+    save_weights_snapshot(_load(kind, model_name, 'torch', None).model, path)
+
+
+def _compress_task(task):
+    from cut_prompt_merge_llmlingua2 import compress_entry
+    idx, entry, coarse_keep = task
+    try:
+        return idx, compress_entry(_worker['compressor'], entry, coarse_keep), None
+    except Exception as e:
+        return idx, None, str(e)
+
+
+def _memory_task(_):
+    """Warm-up forward, then memory once every worker has done the same."""
+    from compressor_models import compress_llmlingua1
+    from cut_prompt_merge_llmlingua2 import compress_entry
+    from profiling import memory_rollup
+    compressor = _worker['compressor']
+    if _worker['kind'] == 'llmlingua1':
+        compress_llmlingua1(compressor, WARMUP_TEXT, 0.5)
+    else:
+        compress_entry(compressor, {'context_only': WARMUP_TEXT})
+    # La barriera tiene ogni task su un worker diverso e misura a pagine condivise già toccate da tutti
+    _worker['ready'].wait(READY_TIMEOUT_S)
+    return {'pid': os.getpid(), **memory_rollup()}
+
+# ==========================================
+# PARENT SIDE
+# ==========================================
+def ensure_weights_snapshot(model_name=LLMLINGUA2_MODEL, kind='llmlingua2'):
+    """Path of the weight snapshot for this checkpoint revision, written once by a throwaway process if missing."""
+    path = weights_snapshot_path(model_name)
+    if not os.path.exists(path):
+        print(f"Writing weight snapshot {path} ...")
+        with mp.get_context("spawn").Pool(1) as pool:
+            pool.apply(_export_snapshot, (kind, model_name, path))
+    return path
+
+
+def start_pool(workers, threads, model_name=LLMLINGUA2_MODEL, backend='torch', wait_ready=False,
+               shared_weights=False, kind='llmlingua2'):
+    """
+    Pool of `workers` processes with one model each. With wait_ready=True no
+    worker takes a row before all models are loaded (used to time the splits).
+    With shared_weights=True the workers memory-map one weight snapshot.
+    """
+    weights_path = None
+    if shared_weights:
+        if backend != 'torch':
+            raise ValueError(f"Shared weights need the torch backend (got '{backend}')")
+        weights_path = ensure_weights_snapshot(model_name, kind)
+    ctx = mp.get_context("spawn")
+    ready = ctx.Barrier(workers) if wait_ready else None
+    return ctx.Pool(workers, initializer=_init_worker,
+                    initargs=(threads, model_name, backend, ready, weights_path, kind))
+
+
+def compress_sharded(pool, entries, coarse_keep=None):
+    """Yields (row index, final prompt, error) in row order."""
+    tasks = ((i, {k: e[k] for k in ROW_FIELDS if k in e}, coarse_keep) for i, e in enumerate(entries))
+    return pool.imap(_compress_task, tasks, chunksize=1)
+
+# ==========================================
+# TUNING
+# ==========================================
+def time_split(entries, workers, threads, model_name=LLMLINGUA2_MODEL, backend='torch'):
+    """Returns (load seconds, compression seconds, errors) for one split."""
+    start = time.perf_counter()
+    pool = start_pool(workers, threads, model_name, backend, wait_ready=True)
+    try:
+        # Un giro a vuoto per worker: modelli caricati e primo forward pagato
+        list(compress_sharded(pool, entries[:workers]))
+        loaded = time.perf_counter()
+        errors = sum(1 for _, _, error in compress_sharded(pool, entries) if error)
+        done = time.perf_counter()
+    finally:
+        pool.close()
+        pool.join()
+    return loaded - start, done - loaded, errors
+
+# ==========================================
+# MEMORY REPORT
+# ==========================================
+def measure_workers(workers, threads, model_name, kind, shared_weights):
+    pool = start_pool(workers, threads, model_name, wait_ready=True, shared_weights=shared_weights, kind=kind)
+    try:
+        return pool.map(_memory_task, range(workers), chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def _fmt(value):
+    return f"{value:>9.0f}" if value is not None else f"{'n/a':>9}"
+
+
+def memory_report(workers, threads, kind='llmlingua2', model_name=None):
+    """Per-worker USS and total RSS / PSS with private copies vs memory-mapped weights."""
+    model_name = model_name or DEFAULT_MODELS[kind]
+    print(f"Model: {model_name} ({kind}), workers: {workers} x {threads} threads")
+    totals = {}
+    for label, shared in (('private', False), ('mmap', True)):
+        stats = measure_workers(workers, threads, model_name, kind, shared)
+        print(f"\n--- weights: {label} ---")
+        print(f"{'pid':>8} {'RSS MB':>9} {'PSS MB':>9} {'USS MB':>9}")
+        for row in stats:
+            print(f"{row['pid']:>8} {row['rss_mb']:>9.0f} {_fmt(row['pss_mb'])} {_fmt(row['uss_mb'])}")
+        has_pss = all(row['pss_mb'] is not None for row in stats)
+        totals[label] = {
+            'rss_mb': sum(row['rss_mb'] for row in stats),
+            'pss_mb': sum(row['pss_mb'] for row in stats) if has_pss else None,
+            'uss_mb': sum(row['uss_mb'] for row in stats) / len(stats) if has_pss else None,
+        }
+
+    print("\n" + "=" * 64)
+    print(f"{'weights':<10} {'total RSS MB':>13} {'total PSS MB':>13} {'USS/worker MB':>14}")
+    print("=" * 64)
+    for label, t in totals.items():
+        print(f"{label:<10} {t['rss_mb']:>13.0f} {_fmt(t['pss_mb']):>13} {_fmt(t['uss_mb']):>14}")
+    print("=" * 64)
+    print("Total PSS is the physical memory actually used by the workers; "
+          "total RSS counts shared pages once per worker.")
+    if totals['private']['pss_mb'] and totals['mmap']['pss_mb']:
+        saved = totals['private']['pss_mb'] - totals['mmap']['pss_mb']
+        print(f"Memory-mapped weights save {saved:.0f} MB over {workers} workers.")
+    return totals
+
+
+def load_tune_rows(limit=TUNE_ROWS):
+    from quantize_llmlingua2 import load_prompts
+    return [{'context_only': p} for p in load_prompts(limit=limit)]
+
+
+def tune(entries, cores, max_workers=None, model_name=LLMLINGUA2_MODEL, backend='torch'):
+    splits = split_options(cores, max_workers)
+    print(f"Rows: {len(entries)}, cores: {cores}, backend: {backend}")
+    print("\n" + "=" * 64)
+    print(f"{'workers':>8} {'threads':>8} {'load s':>8} {'rows/s':>9} {'speed-up':>9} {'errors':>7}")
+    print("=" * 64)
+    results = []
+    for workers, threads in splits:
+        load_s, elapsed, errors = time_split(entries, workers, threads, model_name, backend)
+        rows_per_s = len(entries) / elapsed if elapsed else 0.0
+        results.append({'workers': workers, 'threads': threads, 'load_s': load_s,
+                        'rows_per_s': rows_per_s, 'errors': errors})
+        base = results[0]['rows_per_s']
+        print(f"{workers:>8} {threads:>8} {load_s:>8.1f} {rows_per_s:>9.2f} "
+              f"{rows_per_s / base if base else 0.0:>8.2f}x {errors:>7}")
+    print("=" * 64)
+    best = max(results, key=lambda r: r['rows_per_s'])
+    print(f"Best split on this machine: --workers {best['workers']} --threads {best['threads']} "
+          f"({best['rows_per_s']:.2f} rows/s)")
+    return results, best
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sharded LLMLingua-2 compression: worker x thread tuning.")
+    parser.add_argument("--tune", action="store_true", help="time every worker x thread split")
+    parser.add_argument("--memory", action="store_true",
+                        help="memory per worker with private vs memory-mapped weights")
+    parser.add_argument("--workers", type=int, default=4, help="workers for --memory")
+    parser.add_argument("--kind", choices=sorted(DEFAULT_MODELS), default="llmlingua2", help="model for --memory")
+    parser.add_argument("--cores", type=int, default=available_cores())
+    parser.add_argument("--max-workers", type=int, default=None,
+                        help="cap on processes (each one holds a model copy in RAM)")
+    parser.add_argument("--rows", type=int, default=TUNE_ROWS)
+    parser.add_argument("--model", default=None)
+    parser.add_argument("--backend", choices=BACKENDS, default="torch")
+    args = parser.parse_args()
+
+    if args.memory:
+        memory_report(args.workers, max(1, args.cores // args.workers), args.kind, args.model)
+    if args.tune:
+        tune(load_tune_rows(args.rows), args.cores, args.max_workers, args.model or LLMLINGUA2_MODEL, args.backend)
+    if not (args.memory or args.tune):
+        print("Nothing to do: use --tune / --memory, or cut_prompt_merge_llmlingua2.py --workers M --threads T")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
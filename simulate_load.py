@@ -0,0 +1,205 @@
+"""
+End-to-end cost/latency simulation: does compression pay off under load?
+
+Replays a compressed dataset (question_original / question_rulebased /
+question_llmlingua2) through the same request path as evaluation_llama.py
+(Groq client, query_with_retries, EvalMetrics) against mock_llm_server.py, at a
+configurable concurrency. Each method is replayed separately so the load is
+comparable.
+
+For every compressed method the report gives the break-even compression cost,
+i.e. the most the compressor may spend per prompt before the saved prefill
+time is eaten up:
+  - latency view    : mean request latency saved vs Original
+  - throughput view : wall time saved per prompt vs Original at this concurrency
+The verdict needs the compressor cost measured on the real checkpoints:
+pass it with --compressor-cost METHOD=MS, or point --cost-baseline at a
+benchmark_compressors.py baseline recorded with the real models. The default
+benchmarks/baseline.json is not used: it times the tiny offline models, whose
+cost says nothing about the real compressors. Without a cost the verdict is
+reported as unavailable.
+
+Usage:
+    python simulate_load.py --concurrency 8 --rpm 600
+    python simulate_load.py --base-url http://127.0.0.1:8765 --compressor-cost LLMLingua2=35
+    python simulate_load.py --cost-baseline benchmarks/baseline_real.json
+"""
+import argparse
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import compressor_registry
+from compact_dataset import load_rows
+from eval_metrics import EvalMetrics
+from evaluation_llama import build_messages, query_with_retries
+import mock_llm_server
+
+# ==========================================
+# CONFIGURATION
+# ==========================================
+INPUT_FILE = "datasets/gsm8k_compressed.json"
+METRICS_PREFIX = "metrics_simulation"
+MODEL_ID = "mock-llama"
+CONCURRENCY = 4
+BACKOFF_SECONDS = 1   # più corto del valutatore reale (5s), il mock si ricarica in fretta
+
+METHODS = compressor_registry.evaluation_methods()
+BASELINE_METHOD = 'Original'
+
+# Costo del compressore da una baseline di benchmark_compressors.py misurata sui
+# modelli reali (--cost-baseline): benchmarks/baseline.json usa i modelli tiny
+BENCHMARK_CASE = "gsm8k_8shot"
+# label del metodo -> nome del compressore nel benchmark (stessi nomi del registro)
+BENCHMARK_NAMES = {compressor_registry.get(name).label: name for name in compressor_registry.names()}
+
+# ==========================================
+# REPLAY
+# ==========================================
+def replay_method(client, method_name, prompts, concurrency, metrics, stream):
+    """Sends all prompts of one method through the pool. Returns (wall_s, ok, failed)."""
+
+    def one(prompt, enqueued_at):
+        timer = metrics.request(MODEL_ID, method_name, enqueued_at=enqueued_at)
+        result = query_with_retries(
+            client, build_messages(prompt), timer, method_name,
+            backoff_seconds=BACKOFF_SECONDS, stream=stream, model=MODEL_ID)
+        timer.finish(output_tokens=result[2] if result else None, success=result is not None)
+        return result is not None
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        futures = [pool.submit(one, p, time.perf_counter()) for p in prompts]
+        outcomes = [f.result() for f in futures]
+    wall = time.perf_counter() - start
+    return wall, sum(outcomes), len(outcomes) - sum(outcomes)
+
+
+def load_compressor_costs(overrides, baseline_path=None):
+    """ms per prompt per method, from an explicit benchmark baseline and CLI overrides."""
+    costs = {}
+    if baseline_path:
+        with open(baseline_path, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        for method, bench_name in BENCHMARK_NAMES.items():
+            case = baseline.get(bench_name, {}).get('cases', {}).get(BENCHMARK_CASE)
+            if case:
+                costs[method] = 1000.0 / case['prompts_per_s']
+    for item in overrides or []:
+        method, _, value = item.partition('=')
+        costs[method] = float(value)
+    return costs
+
+
+def print_report(rows, costs, concurrency):
+    base = next((r for r in rows if r['method'] == BASELINE_METHOD), None)
+    print("\n" + "=" * 100)
+    print(f"  SIMULATION REPORT (concurrency={concurrency})")
+    print("=" * 100)
+    print(f"{'Method':<12} {'n':>4} {'in tok':>7} {'mean s':>7} {'p95 s':>7} {'retry s':>8} {'wall s':>8} "
+          f"{'req/s':>6} {'BE lat ms':>10} {'BE thr ms':>10} {'cost ms':>8}  verdict")
+    for r in rows:
+        be_lat = be_thr = None
+        if base and r is not base and r['n'] and base['n']:
+            be_lat = 1000 * (base['mean_latency'] - r['mean_latency'])
+            be_thr = 1000 * (base['wall'] / base['n'] - r['wall'] / r['n'])
+        cost = costs.get(r['method'])
+        verdict = ""
+        if be_lat is not None and cost is None:
+            verdict = "unavailable (no compressor cost)"
+        elif be_lat is not None:
+            verdict = "pays off" if cost < min(be_lat, be_thr) else ("latency only" if cost < be_lat else "does not pay off")
+        print(f"{r['method']:<12} {r['n']:>4} {r['mean_in_tokens']:>7.0f} {r['mean_latency']:>7.2f} {r['p95_latency']:>7.2f} "
+              f"{r['retry_total']:>8.2f} {r['wall']:>8.2f} {r['n'] / r['wall'] if r['wall'] else 0:>6.2f} "
+              f"{_fmt(be_lat):>10} {_fmt(be_thr):>10} {_fmt(cost):>8}  {verdict}")
+    print("=" * 100)
+    print("BE = break-even compressor cost per prompt (ms): compression pays off below it.")
+    if any(r is not base and r['method'] not in costs for r in rows):
+        print("Verdict unavailable without the real compressor cost: pass --compressor-cost METHOD=MS "
+              "or --cost-baseline with a baseline measured on the real checkpoints.")
+
+
+def _fmt(value):
+    return f"{value:.1f}" if value is not None else "-"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay a compressed dataset against the mock LLM server.")
+    parser.add_argument("--input", default=INPUT_FILE)
+    parser.add_argument("--limit", type=int, default=None, help="replay only the first N rows")
+    parser.add_argument("--concurrency", type=int, default=CONCURRENCY)
+    parser.add_argument("--stream", action="store_true", help="use streaming (records TTFT)")
+    parser.add_argument("--base-url", default=None, help="use an already running server instead of an in-process one")
+    parser.add_argument("--compressor-cost", "--cost", action="append", metavar="METHOD=MS",
+                        help="compressor cost per prompt in ms, measured on the real checkpoint "
+                             "(overrides --cost-baseline)")
+    parser.add_argument("--cost-baseline", default=None, metavar="PATH",
+                        help="benchmark_compressors.py baseline measured on the real checkpoints "
+                             "(not the default tiny-model benchmarks/baseline.json)")
+    # Parametri del mock in-process
+    parser.add_argument("--prefill", type=float, default=mock_llm_server.PREFILL_S_PER_TOKEN)
+    parser.add_argument("--decode", type=float, default=mock_llm_server.DECODE_S_PER_TOKEN)
+    parser.add_argument("--output-tokens", type=int, default=mock_llm_server.OUTPUT_TOKENS)
+    parser.add_argument("--slots", type=int, default=mock_llm_server.SLOTS)
+    parser.add_argument("--rpm", type=int, default=mock_llm_server.RATE_LIMIT_RPM)
+    parser.add_argument("--tpm", type=int, default=mock_llm_server.RATE_LIMIT_TPM)
+    args = parser.parse_args()
+
+    from groq import Groq
+
+    print(f"--- Loading Dataset: {args.input} ---")
+    data = load_rows(args.input, lazy=True)  # anche formato compatto / keep mask
+    if args.limit:
+        data = data[:args.limit]
+    # Una sola passata sulle righe (nel formato compatto ogni accesso espande la riga)
+    prompts_by_method = {method_name: [] for method_name, _ in METHODS}
+    for entry in data:
+        for method_name, json_key in METHODS:
+            if entry.get(json_key):
+                prompts_by_method[method_name].append(entry[json_key])
+
+    server = None
+    base_url = args.base_url
+    if base_url is None:
+        server, base_url = mock_llm_server.start_server(
+            prefill=args.prefill, decode=args.decode, output_tokens=args.output_tokens,
+            slots=args.slots, rpm=args.rpm, tpm=args.tpm)
+        print(f"--- Mock server started on {base_url} ---")
+
+    # max_retries=0: i retry li gestisce query_with_retries come nel valutatore
+    client = Groq(api_key="mock", base_url=base_url, max_retries=0)
+    metrics = EvalMetrics()
+    rows = []
+
+    for method_name, _ in METHODS:
+        prompts = prompts_by_method[method_name]
+        if not prompts:
+            print(f"  [{method_name}] Skipped (no prompts)")
+            continue
+        print(f"--- Replaying {method_name}: {len(prompts)} prompts @ concurrency {args.concurrency} ---")
+        wall, ok, failed = replay_method(client, method_name, prompts, args.concurrency, metrics, args.stream)
+        latency = metrics.histogram('latency_seconds', MODEL_ID, method_name)
+        retry = metrics.histogram('retry_seconds', MODEL_ID, method_name)
+        rows.append({
+            'method': method_name,
+            'n': ok,
+            'failed': failed,
+            'mean_in_tokens': sum(mock_llm_server.count_tokens(p) for p in prompts) / len(prompts),
+            'mean_latency': latency.sum / latency.count,
+            'p95_latency': latency.percentile(95),
+            'retry_total': retry.sum,
+            'wall': wall,
+        })
+
+    if server is not None:
+        server.shutdown()
+        print(f"Mock counters: {server.sim.counters}")
+
+    print_report(rows, load_compressor_costs(args.compressor_cost, args.cost_baseline), args.concurrency)
+    metrics.print_summary()
+    json_path, prom_path = metrics.save(METRICS_PREFIX)
+    print(f"Metriche salvate in: {json_path}, {prom_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,252 @@
+"""
+Token-budget compression: the most faithful prompt that fits a hard ceiling
+of tokens counted with the *target* model's tokenizer (the one we pay for),
+not with BERT's or GPT-2's.
+
+Every compressor is reduced to a drop order over the whitespace words of the
+context, computed once:
+  - rule_based : stopword categories one at a time (rule_based.REMOVE_ORDER)
+  - llmlingua2 : lowest classifier keep-probability first
+  - llmlingua1 : lowest surprisal under the small LM first
+Fitting the budget is then a binary search on how many words of that order to
+drop, with one target-tokenizer count per step: O(log n) counts per prompt
+and no re-scoring, instead of recompressing at ever lower rates. Words that
+contain a force token are never dropped, and neither is protected text (the
+target question, 'protected_spans' or <protect> markup, see protected_spans.py):
+it counts against the budget but is never scored.
+
+    python token_budget.py --budget 400 --methods rule_based,llmlingua2
+    python token_budget.py --budget 400 --tokenizer approx   # no HF download
+"""
+import argparse
+import json
+import re
+import sys
+import time
+
+from compact_dataset import load_rows
+from compressor_models import (DEFAULT_FORCE_TOKENS, LLMLINGUA1_MODEL, clean_memory, drop_order, llmlingua1_word_scores,
+                               load_llmlingua1, load_llmlingua2)
+from profiling import span, start_profiling, finish_profiling
+from protected_spans import row_text_and_spans, split_segments
+import rule_based
+
+# ==========================================
+# CONFIGURATION
+# ==========================================
+INPUT_FILE = "datasets/dataset_gsm8k_formatted_8shot.json"
+OUTPUT_FILE = "datasets/gsm8k_budget.json"
+
+# Tokenizer del modello valutato da evaluation_llama.py (llama-3.1-8b-instant).
+# Repo gated su HF: serve il login, altrimenti --tokenizer approx.
+TARGET_TOKENIZER = "meta-llama/Llama-3.1-8B-Instruct"
+BUDGET_TOKENS = 400
+METHODS = ['rule_based', 'llmlingua2', 'llmlingua1']
+FORCE_TOKENS = DEFAULT_FORCE_TOKENS
+
+_GAP_WORD_RE = re.compile(r'(\s*)(\S+)')
+
+FIELDS = {
+    'rule_based': 'question_rulebased_budget',
+    'llmlingua2': 'question_llmlingua2_budget',
+    'llmlingua1': 'question_llmlingua1_budget',
+}
+
+
+def load_token_counter(name=TARGET_TOKENIZER):
+    """text -> number of tokens for the target model ('approx': regex stand-in, see mock_llm_server)."""
+    if name != 'approx':
+        try:
+            from transformers import AutoTokenizer
+            tokenizer = AutoTokenizer.from_pretrained(name)
+            return lambda text: len(tokenizer.encode(text, add_special_tokens=False))
+        except Exception as e:
+            print(f"WARNING: cannot load tokenizer {name} ({e}); counting with the approximate tokenizer")
+    from mock_llm_server import count_tokens
+    return count_tokens
+
+# ==========================================
+# BUDGET FITTING
+# ==========================================
+def segment_words(text, spans):
+    """Word lists of the unprotected segments: the only words a budget may drop."""
+    return [seg.split() for seg, protected in split_segments(text, spans) if not protected and seg.strip()]
+
+
+def render(row, dropped=()):
+    """
+    The row text without the words at the (flat, as in segment_words) indices
+    `dropped`. Nothing dropped gives back the text unchanged. Otherwise
+    protected text and separators stay verbatim (as keep_mask.py keeps
+    'seps'): where dropped words leave several gaps in a row, the one with
+    the most newlines is kept, so line structure survives.
+    """
+    text, spans = row
+    if not dropped:
+        return text
+    out, gaps, index = [], [], 0   # gaps: spazi incontrati dall'ultimo pezzo tenuto
+    for seg, protected in split_segments(text, spans):
+        if protected:
+            out.append(_merge_gaps(gaps, bool(out)) + seg)
+            gaps = []
+            continue
+        for match in _GAP_WORD_RE.finditer(seg):
+            gaps.append(match.group(1))
+            if index not in dropped:
+                out.append(_merge_gaps(gaps, bool(out)) + match.group(2))
+                gaps = []
+            index += 1
+        gaps.append(seg[len(seg.rstrip()):])
+    return "".join(out) + (gaps[-1] if gaps else "")
+
+
+def _merge_gaps(gaps, inside):
+    """One separator for consecutive gaps: the text's own leading whitespace at the start."""
+    if not gaps:
+        return ""
+    if not inside:
+        return gaps[0]
+    return max(gaps, key=lambda gap: (gap.count("\n"), bool(gap)))
+
+
+def fit_budget(row, order, budget, count_tokens):
+    """
+    Drops the first k words of `order` (flat indices over segment_words) with the
+    smallest k that fits `budget` tokens (binary search: fewer words never
+    means more tokens). Returns a dict with text, tokens, dropped and fits; if
+    dropping every candidate is still too much, the shortest prompt is
+    returned with fits=False.
+    """
+    def build(k):
+        text = render(row, set(order[:k]))
+        return text, count_tokens(text)
+
+    text, tokens = build(0)
+    if tokens <= budget:
+        return {'text': text, 'tokens': tokens, 'dropped': 0, 'fits': True}
+    hi = len(order)
+    hi_text, hi_tokens = build(hi)
+    if hi_tokens > budget:
+        return {'text': hi_text, 'tokens': hi_tokens, 'dropped': hi, 'fits': False}
+    lo = 0  # lo non rientra nel budget, hi sì
+    while hi - lo > 1:
+        mid = (lo + hi) // 2
+        mid_text, mid_tokens = build(mid)
+        if mid_tokens <= budget:
+            hi, hi_text, hi_tokens = mid, mid_text, mid_tokens
+        else:
+            lo = mid
+    return {'text': hi_text, 'tokens': hi_tokens, 'dropped': hi, 'fits': True}
+
+
+def budget_rule_based(rows, budget, count_tokens):
+    out = []
+    for row in rows:
+        segments = segment_words(*row)
+        words = [w for seg in segments for w in seg]
+        out.append(fit_budget(row, rule_based.drop_order(words), budget, count_tokens))
+    return out
+
+
+def budget_llmlingua2(scorer, rows, budget, count_tokens, force_tokens=FORCE_TOKENS):
+    segment_lists = [segment_words(*row) for row in rows]
+    # un'unica passata batched per tutti i segmenti di tutti i prompt
+    flat_scores = iter(scorer.score_words([words for segments in segment_lists for words in segments]))
+    out = []
+    for row, segments in zip(rows, segment_lists):
+        words = [w for seg in segments for w in seg]
+        scores = [p for _ in segments for p in next(flat_scores)]
+        out.append(fit_budget(row, drop_order(words, scores, force_tokens), budget, count_tokens))
+    return out
+
+
+def budget_llmlingua1(compressor, rows, budget, count_tokens, force_tokens=FORCE_TOKENS):
+    out = []
+    for row in rows:
+        segments = segment_words(*row)
+        words = [w for seg in segments for w in seg]
+        scores = [p for seg in segments for p in llmlingua1_word_scores(compressor, " ".join(seg))]
+        out.append(fit_budget(row, drop_order(words, scores, force_tokens), budget, count_tokens))
+    return out
+
+# ==========================================
+# MAIN PROCESSING
+# ==========================================
+def split_row(entry):
+    """(text, protected spans) of a formatted row; the target question is always protected."""
+    if 'context_only' in entry:
+        context, target = entry['context_only'], entry.get('target_only', '')
+        text = context + target
+        return text, [[len(context), len(text)]] if target else []
+    return row_text_and_spans(entry, 'question_original' if 'question_original' in entry else 'question')
+
+
+def run_method(method, rows, budget, count_tokens, llmlingua1_model=LLMLINGUA1_MODEL):
+    if method == 'rule_based':
+        return budget_rule_based(rows, budget, count_tokens)
+    if method == 'llmlingua2':
+        from compressor_models import Llmlingua2Scorer
+        with span("model_load"):
+            scorer = Llmlingua2Scorer.from_compressor(load_llmlingua2())
+        results = budget_llmlingua2(scorer, rows, budget, count_tokens)
+        del scorer
+        clean_memory()
+        return results
+    if method == 'llmlingua1':
+        with span("model_load"):
+            compressor = load_llmlingua1(llmlingua1_model)
+        results = budget_llmlingua1(compressor, rows, budget, count_tokens)
+        del compressor
+        clean_memory()
+        return results
+    raise ValueError(f"Unknown method '{method}' (choose from {METHODS})")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compress prompts under a hard target-tokenizer budget.")
+    parser.add_argument("--budget", type=int, default=BUDGET_TOKENS, help="max prompt tokens (target tokenizer)")
+    parser.add_argument("--methods", default=",".join(METHODS))
+    parser.add_argument("--tokenizer", default=TARGET_TOKENIZER, help="HF tokenizer name or 'approx'")
+    parser.add_argument("--input", default=INPUT_FILE)
+    parser.add_argument("--output", default=OUTPUT_FILE)
+    parser.add_argument("--limit", type=int, default=None, help="only the first N rows")
+    args = parser.parse_args(argv)
+
+    start_profiling("token_budget")
+    with span("json_load"):
+        # Formato compatto: con --limit si espandono solo le prime N righe
+        data = load_rows(args.input, lazy=True)
+        data = data[:args.limit] if args.limit else list(data)
+    count_tokens = load_token_counter(args.tokenizer)
+    rows = [split_row(entry) for entry in data]
+    original = [count_tokens(row[0]) for row in rows]
+    print(f"Rows: {len(data)}, budget: {args.budget} tokens ({args.tokenizer}), "
+          f"original mean: {sum(original) / max(1, len(original)):.0f} tokens")
+
+    print("\n" + "=" * 64)
+    print(f"{'Method':<12} {'mean tokens':>12} {'fit':>7} {'mean dropped':>13} {'time s':>8}")
+    print("=" * 64)
+    for method in args.methods.split(","):
+        start = time.perf_counter()
+        with span(f"budget_{method}"):
+            results = run_method(method, rows, args.budget, count_tokens)
+        elapsed = time.perf_counter() - start
+        for entry, result in zip(data, results):
+            entry[FIELDS[method]] = result['text']
+        n = max(1, len(results))
+        print(f"{method:<12} {sum(r['tokens'] for r in results) / n:>12.1f} "
+              f"{sum(r['fits'] for r in results) / n:>6.0%} {sum(r['dropped'] for r in results) / n:>13.1f} "
+              f"{elapsed:>8.2f}")
+    print("=" * 64)
+
+    for entry in data:
+        entry['budget_tokens'] = args.budget
+    with span("json_dump"), open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(data, f, indent=4, ensure_ascii=False)
+    print(f"Saved to {args.output}")
+    finish_profiling()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())